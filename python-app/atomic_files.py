@@ -0,0 +1,59 @@
+import os
+import threading
+from contextlib import contextmanager
+
+def temp_path(path):
+    """
+    Ruta temporal, en la misma carpeta que path, donde se escribe un artefacto antes de renombrarlo.
+    Es oculta (empieza por '.') para que no la confundan con un artefacto los recorridos de carpetas, es única
+    por proceso e hilo y conserva la extensión, de la que matplotlib y PIL deducen el formato de la imagen.
+    """
+    folder, name = os.path.split(path)
+    root, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}")
+
+def _fsync(path):
+    """Fuerza a disco el contenido de path (un archivo o una carpeta)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _fsync_folder(folder):
+    """Fuerza a disco la entrada de la carpeta tras un renombrado. En Windows no se pueden abrir carpetas y se omite."""
+    try:
+        _fsync(folder or ".")
+    except PermissionError:
+        pass
+
+@contextmanager
+def atomic_path(path):
+    """
+    Escritura atómica de un artefacto que genera otra librería a partir de una ruta (savefig, to_file):
+    se entrega una ruta temporal y, si el bloque termina sin errores, se fuerza a disco con fsync, se renombra
+    a path con os.replace y se fuerza a disco la carpeta, para que el renombrado no llegue al disco antes que
+    el contenido. Si el proceso o la máquina caen a mitad de escritura, path conserva su versión anterior
+    completa (o no existe), nunca un archivo truncado; si el bloque lanza una excepción, se borra el temporal.
+    """
+    tmp_path = temp_path(path)
+    try:
+        yield tmp_path
+        _fsync(tmp_path)
+        os.replace(tmp_path, path)
+        _fsync_folder(os.path.dirname(path))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def atomic_write(path, data):
+    """Escribe data (bytes o str, esta última en UTF-8) en path de forma atómica. Retorna los bytes escritos."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+    return data
@@ -0,0 +1,207 @@
+"""
+Servidor HTTP que imita a Grobid para medir los generadores sin el contenedor real.
+
+Responde a /api/version, /api/isalive y /api/processFulltextDocument (y al resto de /api/process*) con
+TEI XML grabados: los archivos .xml de --fixtures (por ejemplo, tei.xml copiados de una ejecución real) o,
+si no se indica, TEI sintéticos generados con la estructura de processFulltextDocument. El TEI devuelto
+depende del contenido del PDF subido, de modo que un mismo PDF recibe siempre la misma respuesta.
+
+Se puede configurar la latencia (fija, con jitter y por MB subido), la proporción de respuestas 503 y 204
+y una capacidad máxima de peticiones simultáneas, por encima de la cual responde 503 como el Grobid real.
+
+Uso:
+    python benchmarks/grobid_stub.py [--port 8070] [--latency 0.5] [--jitter 0.2] [--busy-rate 0.05]
+                                     [--capacity 8] [--fixtures DIR] [--paragraphs 500]
+"""
+import os
+import sys
+import glob
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tei_parsing_benchmark import write_synthetic_tei
+
+GROBID_VERSION = "0.8.1"
+SYNTHETIC_ABSTRACT = "Synthetic abstract about open science, reproducibility and machine learning."
+VOCABULARY = ("open science reproducibility machine learning dataset benchmark neural network citation "
+              "metadata repository workflow provenance software analysis retrieval evaluation corpus "
+              "ontology semantic annotation knowledge graph preprint licence archive infrastructure").split()
+
+def load_fixtures(folder):
+    """Lee los TEI grabados (*.xml) de folder, ordenados por nombre."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(folder, "**", "*.xml"), recursive=True)):
+        with open(path, "rb") as f:
+            fixtures.append(f.read())
+    if not fixtures:
+        raise ValueError(f"No se encontraron TEI (*.xml) en {folder}")
+    return fixtures
+
+def synthetic_fixtures(count=8, paragraphs=500, figures=20, references=100, seed=0):
+    """
+    Genera count TEI sintéticos de processFulltextDocument con abstracts distintos (para que las nubes
+    de palabras varíen) y un número de figuras distinto en cada uno.
+    """
+    rng = random.Random(seed)
+    fixtures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(count):
+            path = os.path.join(tmp, f"{i}.xml")
+            write_synthetic_tei(path, paragraphs, figures + i, references)
+            with open(path, "r", encoding="utf-8") as f:
+                tei = f.read()
+            abstract = " ".join(rng.choice(VOCABULARY) for _ in range(60)) + "."
+            fixtures.append(tei.replace(SYNTHETIC_ABSTRACT, abstract, 1).encode("utf-8"))
+    return fixtures
+
+class GrobidStub:
+    """Servidor de prueba en un hilo en segundo plano. start() retorna su URL base."""
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, latency_per_mb=0.0, busy_rate=0.0,
+                 no_content_rate=0.0, capacity=None, seed=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_mb = latency_per_mb
+        self.busy_rate = busy_rate
+        self.no_content_rate = no_content_rate
+        self.capacity = capacity
+        self.counts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def _enter(self):
+        with self._lock:
+            if self.capacity and self.in_flight >= self.capacity:
+                return False
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _draw(self):
+        with self._lock:
+            return self._rng.random(), self._rng.uniform(-1.0, 1.0)
+
+    def handle_process(self, body):
+        """Retorna (código, cuerpo) para una petición de procesamiento con el PDF subido en body."""
+        if not self._enter():
+            return 503, b"Grobid ocupado"
+        try:
+            draw, jitter = self._draw()
+            delay = self.latency + self.jitter * jitter + self.latency_per_mb * len(body) / 1e6
+            time.sleep(max(0.0, delay))
+            if draw < self.busy_rate:
+                return 503, b"Grobid ocupado"
+            if draw < self.busy_rate + self.no_content_rate:
+                return 204, b""
+            index = int.from_bytes(hashlib.sha256(body).digest()[:4], "big") % len(self.fixtures)
+            return 200, self.fixtures[index]
+        finally:
+            self._leave()
+
+    def start(self, port=0, host="127.0.0.1"):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, code, body, content_type="text/plain"):
+                with stub._lock:
+                    stub.counts[(self.command, self.path.split("?")[0], code)] += 1
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().strip(), 16)
+                        chunks.append(self.rfile.read(size + 2)[:size])
+                        if size == 0:
+                            return b"".join(chunks)
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                if self.path == "/api/version":
+                    self._send(200, GROBID_VERSION.encode("utf-8"))
+                elif self.path == "/api/isalive":
+                    self._send(200, b"true")
+                else:
+                    self._send(404, b"Not found")
+
+            def do_POST(self):
+                body = self._read_body()
+                if not self.path.split("?")[0].startswith("/api/process"):
+                    self._send(404, b"Not found")
+                    return
+                code, payload = stub.handle_process(body)
+                self._send(code, payload, "application/xml" if code == 200 else "text/plain")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def add_stub_arguments(parser):
+    """Opciones del servidor de prueba, compartidas con pipeline_benchmark.py."""
+    parser.add_argument("--latency", type=float, default=0.2, help="segundos de respuesta por petición")
+    parser.add_argument("--jitter", type=float, default=0.05, help="variación aleatoria (+/-) de la latencia")
+    parser.add_argument("--latency-per-mb", type=float, default=0.0, help="segundos adicionales por MB subido")
+    parser.add_argument("--busy-rate", type=float, default=0.0, help="proporción de respuestas 503")
+    parser.add_argument("--no-content-rate", type=float, default=0.0, help="proporción de respuestas 204")
+    parser.add_argument("--capacity", type=int, default=None, help="peticiones simultáneas antes de responder 503")
+    parser.add_argument("--fixtures", help="carpeta con TEI grabados (*.xml); por defecto, TEI sintéticos")
+    parser.add_argument("--paragraphs", type=int, default=500, help="párrafos de cada TEI sintético")
+    parser.add_argument("--seed", type=int, default=0)
+
+def stub_from_arguments(args):
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else synthetic_fixtures(paragraphs=args.paragraphs,
+                                                                                     seed=args.seed)
+    return GrobidStub(fixtures, latency=args.latency, jitter=args.jitter, latency_per_mb=args.latency_per_mb,
+                      busy_rate=args.busy_rate, no_content_rate=args.no_content_rate, capacity=args.capacity,
+                      seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--host", default="127.0.0.1")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    stub = stub_from_arguments(args)
+    base_url = stub.start(args.port, args.host)
+    print(f"Grobid de prueba escuchando en {base_url} ({len(stub.fixtures)} TEI). Ctrl + C para detenerlo.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+        for (method, path, code), n in sorted(stub.counts.items()):
+            print(f"{method} {path} {code}: {n}")
+
+if __name__ == "__main__":
+    main()
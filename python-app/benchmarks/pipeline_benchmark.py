@@ -0,0 +1,166 @@
+"""
+Benchmark de los generadores contra un Grobid de prueba (grobid_stub.py), sin necesidad del contenedor real.
+
+Para cada tamaño de corpus se generan PDFs sintéticos en una carpeta temporal y se ejecutan, en el orden de
+docker-compose original, keyword_cloud_generator.py, figures_visualization_generator.py y
+links_in_pdf_generator.py (o pipeline.py con --pipeline). El primero envía los PDFs a Grobid; los demás
+reutilizan el TEI. Cada script corre en su propio proceso y, por cada uno, se informa:
+  - tiempo total y rendimiento (documentos/s),
+  - latencia p50/p99 por documento y de las peticiones a Grobid, y número de 503,
+  - p50/p99 de las etapas de instrumentation (upload, grobid, parse, render, write, chart),
+  - pico de memoria (RSS) del proceso y de sus procesos hijos (pool de renderizado).
+
+Uso:
+    python benchmarks/pipeline_benchmark.py [--sizes 10,1000,10000] [--latency 0.2] [--busy-rate 0.02]
+                                            [--capacity 8] [--paragraphs 500] [--pdf-kb 200] [--pipeline]
+                                            [--output resultados.json]
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, APP_DIR)
+from grobid_stub import add_stub_arguments, stub_from_arguments
+
+GENERATORS = ("keyword_cloud_generator.py", "figures_visualization_generator.py", "links_in_pdf_generator.py")
+STAGES = ("upload", "grobid", "parse", "render", "write", "chart")
+
+def write_synthetic_pdf(path, index, size):
+    """PDF mínimo con contenido único (hash distinto por índice) relleno hasta size bytes."""
+    header = (f"%PDF-1.4\n% documento sintetico {index}\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+              f"2 0 obj << /Type /Pages /Kids [] /Count 0 >> endobj\n").encode("ascii")
+    trailer = b"\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+    padding = max(0, size - len(header) - len(trailer))
+    with open(path, "wb") as f:
+        f.write(header)
+        block = (f"% relleno {index} ".encode("ascii") * 64)[:4096]
+        while padding > 0:
+            f.write(block[:padding])
+            padding -= len(block)
+        f.write(trailer)
+
+def make_corpus(folder, count, pdf_size):
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        write_synthetic_pdf(os.path.join(folder, f"articulo_{i:05d}.pdf"), i, pdf_size)
+
+def run_worker(script):
+    """Ejecuta el script como __main__ en este proceso e imprime su pico de memoria y el de sus hijos."""
+    os.chdir(APP_DIR)
+    sys.argv = [script]
+    start = time.perf_counter()
+    try:
+        runpy.run_path(os.path.join(APP_DIR, script), run_name="__main__")
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    # ru_maxrss está en KB en Linux
+    print(json.dumps({
+        "seconds": elapsed,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_max_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+def measure(script, env, log_path):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", script], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    import instrumentation
+    loaded, _ = instrumentation.load_events(log_path)
+    summary = loaded.summary(top=0)
+    document_seconds = [sum(stages.values()) for stages in loaded.documents.values()]
+    result.update({
+        "document_p50": instrumentation.percentile(document_seconds, 0.5),
+        "document_p99": instrumentation.percentile(document_seconds, 0.99),
+        "grobid": summary["grobid"],
+        "stages": summary["stages"],
+    })
+    return result
+
+def benchmark_size(count, args, base_url):
+    """Ejecuta los scripts sobre un corpus sintético de count PDFs. Retorna {script: resultado}."""
+    tmp = tempfile.mkdtemp(prefix=f"bench_{count}_", dir=args.workdir)
+    pdf_folder = os.path.join(tmp, "pdfs")
+    try:
+        make_corpus(pdf_folder, count, args.pdf_kb * 1024)
+        env = dict(os.environ, PDF_FOLDER=pdf_folder, GROBID_URL=base_url, METRICS_PROMETHEUS="off",
+                   PYTHONPATH=APP_DIR, MPLBACKEND="Agg")
+        if args.preview:
+            env["KEYWORD_CLOUD_PREVIEW"] = "1"
+        results = {}
+        for script in (("pipeline.py",) if args.pipeline else GENERATORS):
+            log_path = os.path.join(tmp, f"{os.path.splitext(script)[0]}.jsonl")
+            env["METRICS_LOG"] = log_path
+            print(f"  {script} con {count} PDFs...", flush=True)
+            results[script] = measure(script, env, log_path)
+        return results
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            print(f"  Resultados conservados en {tmp}")
+
+def _fmt(value, pattern="{:.3f}"):
+    return "-" if value is None else pattern.format(value)
+
+def print_results(count, results):
+    print(f"\nCorpus de {count} PDFs")
+    print(f"{'script':<36} {'tiempo (s)':>10} {'docs/s':>8} {'doc p50':>8} {'doc p99':>8} "
+          f"{'grobid p50':>10} {'grobid p99':>10} {'503':>5} {'RSS (MB)':>9} {'hijos (MB)':>10}")
+    for script, r in results.items():
+        grobid = r["grobid"]
+        print(f"{script:<36} {r['seconds']:>10.2f} {count / r['seconds']:>8.2f} {_fmt(r['document_p50']):>8} "
+              f"{_fmt(r['document_p99']):>8} {_fmt(grobid['latency_p50']):>10} {_fmt(grobid['latency_p99']):>10} "
+              f"{grobid['status'].get('503', 0):>5} {r['max_rss_mb']:>9.1f} {r['children_max_rss_mb']:>10.1f}")
+        stages = [f"{stage} {_fmt(r['stages'][stage]['p50'])}/{_fmt(r['stages'][stage]['p99'])}"
+                  for stage in STAGES if stage in r["stages"]]
+        if stages:
+            print(f"{'':<4}etapas p50/p99 (s): " + ", ".join(stages))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10", help="tamaños de corpus separados por comas (p. ej. 10,1000,10000)")
+    parser.add_argument("--pdf-kb", type=int, default=200, help="tamaño de cada PDF sintético en KB")
+    parser.add_argument("--pipeline", action="store_true", help="mide pipeline.py en lugar de los tres generadores")
+    parser.add_argument("--preview", action="store_true", help="nubes de baja resolución (KEYWORD_CLOUD_PREVIEW=1)")
+    parser.add_argument("--workdir", default=None, help="carpeta donde crear los corpus (por defecto, la temporal)")
+    parser.add_argument("--keep", action="store_true", help="no borrar los corpus y artefactos generados")
+    parser.add_argument("--output", help="guarda los resultados en JSON para compararlos entre versiones")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker)
+        return
+
+    stub = stub_from_arguments(args)
+    base_url = stub.start()
+    print(f"Grobid de prueba en {base_url}: {len(stub.fixtures)} TEI de "
+          f"{sum(map(len, stub.fixtures)) / len(stub.fixtures) / 1024:.0f} KB de media, latencia "
+          f"{args.latency} s (+/- {args.jitter}), 503: {args.busy_rate:.0%}, capacidad: {args.capacity or 'sin límite'}")
+    all_results = {}
+    try:
+        for count in (int(size) for size in args.sizes.split(",")):
+            all_results[count] = benchmark_size(count, args, base_url)
+            print_results(count, all_results[count])
+    finally:
+        stub.stop()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"arguments": {k: v for k, v in vars(args).items() if k != "worker"},
+                       "results": all_results}, f, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark del parseo de TEI XML: compara las funciones originales (ET.parse / ET.fromstring con el árbol
+completo en memoria) con el extractor en streaming de tei_stream.py (iterparse + liberación de elementos).
+
+Cada medición se ejecuta en un proceso aparte para que el pico de memoria (RSS) no se contamine entre modos.
+
+Uso:
+    python benchmarks/tei_parsing_benchmark.py [--paragraphs 100000] [--figures 500] [--references 2000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NS = {"tei": "http://www.tei-c.org/ns/1.0"}
+
+def write_synthetic_tei(path, paragraphs, figures, references):
+    """Genera un TEI XML con la estructura de processFulltextDocument y el tamaño indicado."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<TEI xmlns="http://www.tei-c.org/ns/1.0">')
+        f.write("<teiHeader><profileDesc><abstract><div><p>Synthetic abstract about open science, "
+                "reproducibility and machine learning.</p></div></abstract></profileDesc></teiHeader><text><body>")
+        for i in range(paragraphs):
+            f.write(f'<div><head>Section {i}</head><p>Paragraph {i} with some text about results and '
+                    f'<ref type="bibr" target="#b{i % max(references, 1)}">[{i}]</ref> methods.</p>')
+            if figures and i % max(paragraphs // figures, 1) == 0:
+                kind = ' type="table"' if i % 3 == 0 else ""
+                f.write(f'<figure{kind}><head>Figure {i}</head><figDesc>Caption {i}</figDesc></figure>')
+            f.write("</div>")
+        f.write("</body><back><div><listBibl>")
+        for i in range(references):
+            f.write(f'<biblStruct xml:id="b{i}"><analytic><title>Reference {i}</title>'
+                    f'<idno type="DOI">10.1000/ref.{i}</idno></analytic>'
+                    f'<monogr><title>Journal</title></monogr><ptr target="https://example.org/ref/{i}"/></biblStruct>')
+        f.write("</listBibl></div></back></text></TEI>")
+
+def legacy_extract(path):
+    """Funciones originales: count_figures_in_tei (ET.parse) + extract_links_from_tei (ET.fromstring) + abstract."""
+    root = ET.parse(path).getroot()
+    figures = len(root.findall(".//tei:figure", NS))
+    with open(path, "r", encoding="utf-8") as f:
+        root = ET.fromstring(f.read())
+    links = set()
+    for elem in root.iter():
+        target = elem.attrib.get("target", "")
+        if target.startswith("http"):
+            links.add(target)
+    abstract = root.find(".//tei:abstract", NS)
+    return {"figures": figures, "links": len(links), "abstract": abstract is not None}
+
+def stream_extract(path):
+    from tei_stream import extract_tei_summary
+    summary = extract_tei_summary(path)
+    return {"figures": summary["figures"], "links": len(summary["links"]), "abstract": summary["abstract"] is not None}
+
+def run_worker(mode, path):
+    start = time.perf_counter()
+    result = {"noop": lambda p: {}, "legacy": legacy_extract, "stream": stream_extract}[mode](path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss está en KB en Linux
+    result.update({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+    print(json.dumps(result))
+
+def measure(mode, path):
+    output = subprocess.run([sys.executable, __file__, "--worker", mode, path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=100000)
+    parser.add_argument("--figures", type=int, default=500)
+    parser.add_argument("--references", type=int, default=2000)
+    parser.add_argument("--worker", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*args.worker)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tei.xml")
+        write_synthetic_tei(path, args.paragraphs, args.figures, args.references)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"TEI sintético: {size_mb:.1f} MB")
+        baseline = measure("noop", path)["max_rss_mb"]
+        print(f"{'modo':<8} {'tiempo (s)':>10} {'pico RSS (MB)':>14} {'RSS sobre base (MB)':>20} figuras  links")
+        for mode in ("legacy", "stream"):
+            r = measure(mode, path)
+            print(f"{mode:<8} {r['seconds']:>10.2f} {r['max_rss_mb']:>14.1f} {r['max_rss_mb'] - baseline:>20.1f} "
+                  f"{r['figures']:>7} {r['links']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Punto de entrada único con subcomandos. Cada subcomando importa solo los módulos que necesita: matplotlib,
+wordcloud y requests se cargan cuando una etapa dibuja, renderiza o llama a Grobid, no al arrancar.
+El tiempo de importación de cada subcomando se imprime y se registra en las métricas de la ejecución.
+
+Uso:
+    python cli.py run [--fetch-only | --charts-only | --skip etapa,...]   pipeline completo (pipeline.py)
+    python cli.py run --resume                                          solo los PDFs sin terminar
+    python cli.py watch                                                 ingesta continua (watch_daemon.py)
+    python cli.py check                                                 pruebas iniciales de Grobid
+    python cli.py verify [--deep]                                       test finales
+    python cli.py clouds | figures | links [--reindex]                  generadores por separado
+    python cli.py index <consulta> [argumentos]                         consultas al índice (metadata_index.py)
+    python cli.py metrics [events.jsonl] [id de ejecución]              resumen de métricas
+    python cli.py storage [report | migrate]                            almacenamiento comprimido de los TEI
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+
+# Backend sin ventana fijado antes de que cualquier subcomando importe matplotlib
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+def run_pipeline(module, args):
+    if args.fetch_only:
+        skip = module.skip_except(module.FETCH_ONLY)
+    elif args.charts_only:
+        skip = module.skip_except(module.CHARTS_ONLY)
+    else:
+        skip = tuple(name.strip() for name in (args.skip or "").split(",") if name.strip())
+        unknown = set(skip) - {stage.name for stage in module.STAGES}
+        if unknown:
+            print(f"Etapas desconocidas: {', '.join(sorted(unknown))}. "
+                  f"Etapas: {', '.join(stage.name for stage in module.STAGES)}.")
+            return 2
+    return module.main(skip, resume=True if args.resume else None)
+
+def run_check(module, args):
+    return 0 if module.wait_for_grobid() else 1
+
+def run_verify(module, args):
+    return 0 if module.main() else 1
+
+def run_main(module, args):
+    return module.main() or 0
+
+# Subcomando: (módulo, función que lo ejecuta, descripción)
+COMMANDS = {
+    "run": ("pipeline", run_pipeline, "ejecuta el pipeline completo en un solo proceso"),
+    "watch": ("watch_daemon", run_main, "procesa los PDFs que se vayan añadiendo a la carpeta"),
+    "check": ("tester_inicial", run_check, "espera a Grobid y ejecuta las pruebas iniciales"),
+    "verify": ("tester_final", run_verify, "ejecuta los test finales"),
+    "clouds": ("keyword_cloud_generator", run_main, "genera las keyword clouds"),
+    "figures": ("figures_visualization_generator", run_main, "genera el gráfico de figuras por artículo"),
+    "links": ("links_in_pdf_generator", run_main, "extrae los links de cada PDF"),
+    "index": ("metadata_index", run_main, "consultas al índice de metadatos"),
+    "metrics": ("instrumentation", run_main, "resumen de las métricas de una ejecución"),
+    "storage": ("tei_storage", run_main, "informa del espacio de los TEI o los migra al almacenamiento comprimido"),
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", metavar="subcomando")
+    subparsers.required = True
+    for name, (_, _, help_text) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if name == "run":
+            only = subparser.add_mutually_exclusive_group()
+            only.add_argument("--fetch-only", action="store_true",
+                              help="solo comprueba Grobid y obtiene el TEI de cada PDF")
+            only.add_argument("--charts-only", action="store_true",
+                              help="solo regenera los gráficos de corpus a partir del índice, sin llamar a Grobid")
+            only.add_argument("--skip", help="etapas que no se ejecutan, separadas por comas")
+            subparser.add_argument("--resume", action="store_true",
+                                   help="procesa solo los PDFs que la ejecución anterior no terminó, "
+                                        "con un límite de intentos (PIPELINE_RETRY_BUDGET)")
+        else:
+            # Los argumentos restantes se pasan al script tal como los recibiría en la línea de comandos
+            subparser.add_argument("args", nargs=argparse.REMAINDER)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    # REMAINDER no recoge las opciones que van antes del primer argumento posicional (p. ej. 'links --reindex'):
+    # se reciben como desconocidas y se pasan al script en su lugar
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command == "run":
+        parser.error(f"argumentos no reconocidos: {' '.join(extra)}")
+    module_name, handler, _ = COMMANDS[args.command]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    seconds = time.perf_counter() - start
+    print(f"Subcomando '{args.command}': módulos importados en {seconds * 1000:.0f} ms.")
+    if "instrumentation" in sys.modules:
+        sys.modules["instrumentation"].record_import(args.command, seconds)
+    sys.argv = [f"{module_name}.py"] + extra + list(getattr(args, "args", []))
+    return handler(module, args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,83 +1,198 @@
 import sys
 import os
-import requests
-import xml.etree.ElementTree as ET
-import matplotlib.pyplot as plt
+import re
+import json
+import hashlib
+from fulltext_extraction import FULLTEXT_FOLDER, fulltext_tei_path, fulltext_is_current, get_fulltext_tei
+from tei_stream import extract_tei_summary
+from grobid_pool import process_concurrently
+import metadata_index
+import instrumentation
+import atomic_files
+import grobid_backends
+
+# Número máximo de barras por gráfico (modo 'bars' en 'auto' y cada página de la vista paginada)
+MAX_BARS = 40
+# Artículos mostrados en el top del modo 'distribution' y número de intervalos del histograma
+TOP_N = 20
+HISTOGRAM_BINS = 50
+# Nombre de las imágenes de la vista paginada (page_001.png, ..., page_1000.png)
+PAGE_FILE = re.compile(r"^page_(\d+)\.png$")
+# Backend sin ventana, fijado antes de que matplotlib se importe (pyplot solo se carga al dibujar un gráfico)
+os.environ.setdefault("MPLBACKEND", "Agg")
 
 def process_pdf_save_tei(pdf_path, base_url, output_folder):
     """
-    Envía el PDF al endpoint /api/processFulltextDocument de Grobid para obtener el TEI XML
-    y lo guarda en output_folder como 'tei.xml'.
+    Obtiene el TEI XML completo del PDF mediante la etapa de extracción compartida, que hace una
+    única llamada a /api/processFulltextDocument y lo guarda en output_folder como 'tei.xml' (comprimido
+    según TEI_COMPRESSION).
     """
-    url = f"{base_url}/api/processFulltextDocument"
-    try:
-        with open(pdf_path, "rb") as pdf_file:
-            files = {"input": pdf_file}
-            response = requests.post(url, files=files)
-        if response.status_code == 200:
-            tei_xml = response.text
-            tei_output_path = os.path.join(output_folder, "tei.xml")
-            with open(tei_output_path, "w", encoding="utf-8") as f:
-                f.write(tei_xml)
-            print(f"TEI XML guardado en: {tei_output_path}")
-        else:
-            print(f"Error en el procesamiento de {os.path.basename(pdf_path)}. Código: {response.status_code}")
-            print(response.text)
-    except Exception as e:
-        print(f"Excepción al enviar {os.path.basename(pdf_path)}: {e}")
+    pdf_folder, pdf_file = os.path.split(pdf_path)
+    if not get_fulltext_tei(pdf_folder, pdf_file, base_url):
+        print(f"No se pudo obtener el TEI XML para {pdf_file}.")
 
 def count_figures_in_tei(tei_file_path):
     """
-    Lee el archivo TEI XML y cuenta el número de elementos <figure> usando el namespace TEI.
+    Lee el archivo TEI XML en streaming (iterparse, sin construir el árbol completo; si está comprimido se
+    descomprime también en streaming) y cuenta el número de elementos <figure> usando el namespace TEI.
     """
     try:
-        tree = ET.parse(tei_file_path)
-        root = tree.getroot()
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
-        figures = root.findall(".//tei:figure", ns)
-        return len(figures)
+        return extract_tei_summary(tei_file_path)["figures"]
     except Exception as e:
         print(f"Error al contar figuras en {tei_file_path}: {e}")
         return 0
 
+def get_summary_mode():
+    """Modo del gráfico resumen (FIGURES_SUMMARY_MODE): 'auto' (por defecto), 'bars' o 'distribution'."""
+    mode = os.environ.get("FIGURES_SUMMARY_MODE", "auto").lower()
+    return mode if mode in ("auto", "bars", "distribution") else "auto"
+
+def pages_enabled():
+    """Indica si se genera también la vista paginada por artículo (FIGURES_SUMMARY_PAGES=1)."""
+    return os.environ.get("FIGURES_SUMMARY_PAGES", "0").lower() in ("1", "true", "yes")
+
+def plot_figures_bars(articles, counts, output_image_path, title="Número de figuras por artículo"):
+    """
+    Gráfico de barras con una barra por artículo. El ancho crece con el número de artículos hasta el de
+    MAX_BARS barras; con más artículos se omiten los nombres, que no cabrían (se leen en la vista paginada).
+    """
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(max(6, min(len(articles), MAX_BARS)*1.5), 6))
+    plt.bar(articles, counts, color='green')
+    plt.xlabel("Artículos")
+    plt.ylabel("Número de figuras")
+    plt.title(title)
+    if len(articles) > MAX_BARS:
+        plt.xticks([])
+    else:
+        plt.xticks(rotation=45, ha="right")
+    plt.tight_layout()
+    with atomic_files.atomic_path(output_image_path) as tmp_path:
+        plt.savefig(tmp_path)
+    plt.close()
+
+def plot_figures_distribution(results, output_image_path):
+    """
+    Gráfico de tamaño fijo para corpus grandes: histograma del número de figuras por artículo y
+    los TOP_N artículos con más figuras. El tiempo de dibujo no depende del número de artículos.
+    """
+    import matplotlib.pyplot as plt
+    counts = list(results.values())
+    top = sorted(results.items(), key=lambda item: (-item[1], item[0]))[:TOP_N]
+    fig, (ax_hist, ax_top) = plt.subplots(1, 2, figsize=(16, 7))
+    max_count = max(counts)
+    bins = range(0, max_count + 2) if max_count < HISTOGRAM_BINS else HISTOGRAM_BINS
+    ax_hist.hist(counts, bins=bins, color='green', align='left' if max_count < HISTOGRAM_BINS else 'mid')
+    ax_hist.set_xlabel("Número de figuras")
+    ax_hist.set_ylabel("Número de artículos")
+    ax_hist.set_title(f"Distribución de figuras ({len(counts)} artículos)")
+    names = [name if len(name) <= 40 else name[:37] + "..." for name, _ in top]
+    ax_top.barh(names[::-1], [count for _, count in top][::-1], color='green')
+    ax_top.set_xlabel("Número de figuras")
+    ax_top.set_title(f"Top {len(top)} artículos por número de figuras")
+    fig.tight_layout()
+    with atomic_files.atomic_path(output_image_path) as tmp_path:
+        fig.savefig(tmp_path)
+    plt.close(fig)
+
+def plot_figures_pages(pdf_folder, articles, counts, pages_folder):
+    """
+    Vista paginada por artículo: imágenes page_001.png, page_002.png... con MAX_BARS artículos cada una.
+    Solo se vuelven a dibujar las páginas cuyo contenido ha cambiado desde la última ejecución.
+    """
+    os.makedirs(pages_folder, exist_ok=True)
+    total_pages = (len(articles) + MAX_BARS - 1) // MAX_BARS
+    redrawn = 0
+    for page in range(total_pages):
+        start = page * MAX_BARS
+        page_articles = articles[start:start + MAX_BARS]
+        page_counts = counts[start:start + MAX_BARS]
+        page_path = os.path.join(pages_folder, f"page_{page + 1:03d}.png")
+        signature = hashlib.sha256(json.dumps([total_pages, page_articles, page_counts]).encode("utf-8")).hexdigest()
+        meta_key = f"figures_page_{page + 1}"
+        if os.path.exists(page_path) and metadata_index.get_meta(pdf_folder, meta_key) == signature:
+            continue
+        plot_figures_bars(page_articles, page_counts, page_path,
+                          title=f"Número de figuras por artículo (página {page + 1} de {total_pages})")
+        metadata_index.set_meta(pdf_folder, meta_key, signature)
+        redrawn += 1
+    # Eliminar páginas sobrantes de ejecuciones anteriores con más artículos
+    for filename in os.listdir(pages_folder):
+        match = PAGE_FILE.match(filename)
+        if match and int(match.group(1)) > total_pages:
+            os.remove(os.path.join(pages_folder, filename))
+    print(f"Vista paginada ({total_pages} páginas, {redrawn} actualizadas) guardada en: {pages_folder}")
+
 def generate_figures_summary(pdf_folder, output_image_path):
     """
-    Recorre cada PDF del directorio pdf_folder, busca el archivo tei.xml en su subcarpeta 'pdf_full_text_document'
-    y cuenta el número de figuras. Luego, genera un gráfico de barras con el número de figuras por artículo (usando
-    el nombre base del PDF como etiqueta) y lo guarda en output_image_path.
+    Recorre cada PDF del directorio pdf_folder y toma su número de figuras del índice SQLite (metadata_index);
+    si el documento aún no está indexado, cuenta las figuras del tei.xml de su subcarpeta 'pdf_full_text_document'
+    y registra sus conteos (si el documento ya tiene fila, sin tocar el resto de columnas). Luego genera el
+    gráfico resumen en output_image_path:
+      - 'bars': una barra por artículo (usando el nombre base del PDF como etiqueta). Con más de MAX_BARS
+        artículos el gráfico conserva el ancho de MAX_BARS barras, sin nombres, y se genera también la
+        vista paginada.
+      - 'distribution': histograma y top de artículos, de tamaño fijo.
+      - 'auto': 'bars' hasta MAX_BARS artículos y 'distribution' a partir de ahí.
+    Con FIGURES_SUMMARY_PAGES=1 se genera además la vista paginada por artículo.
+    Si los conteos no han cambiado desde el último gráfico, no se vuelve a dibujar.
     Se ordenan alfabéticamente los artículos para que la asociación sea correcta.
     """
     results = {}
+    # Los conteos se leen del índice SQLite; solo se parsean los TEI que aún no están indexados
+    indexed = metadata_index.get_figure_counts(pdf_folder)
     # Ordenar los archivos PDF para tener un orden consistente
     for filename in sorted(os.listdir(pdf_folder)):
         if filename.lower().endswith(".pdf"):
             base_name = os.path.splitext(filename)[0]
-            tei_path = os.path.join(pdf_folder, base_name, "pdf_full_text_document", "tei.xml")
+            if base_name in indexed:
+                results[base_name] = indexed[base_name]
+                continue
+            tei_path = fulltext_tei_path(pdf_folder, filename)
             if os.path.exists(tei_path):
-                count = count_figures_in_tei(tei_path)
-                results[base_name] = count
+                summary = extract_tei_summary(tei_path)
+                if metadata_index.get_document(pdf_folder, base_name) is None:
+                    metadata_index.record_document(pdf_folder, filename, summary)
+                else:
+                    # La fila ya existe (p. ej. con su sha256, tei_key y links): solo se actualizan los conteos
+                    metadata_index.record_figure_counts(pdf_folder, filename, summary["figures"], summary["tables"])
+                results[base_name] = summary["figures"]
             else:
                 print(f"No se encontró tei.xml para {filename} en la ruta esperada.")
     
-    if results:
-        # Ordenar los artículos alfabéticamente
-        articles = sorted(results.keys())
-        counts = [results[a] for a in articles]
-        plt.figure(figsize=(max(6, len(articles)*1.5), 6))
-        plt.bar(articles, counts, color='green')
-        plt.xlabel("Artículos")
-        plt.ylabel("Número de figuras")
-        plt.title("Número de figuras por artículo")
-        plt.xticks(rotation=45, ha="right")
-        plt.tight_layout()
-        plt.savefig(output_image_path)
-        plt.close()
-        print(f"Gráfico de resumen guardado en: {output_image_path}")
-    else:
+    if not results:
         print("No se encontraron datos para generar el gráfico.")
+        return
+
+    mode = get_summary_mode()
+    if mode == "auto":
+        mode = "bars" if len(results) <= MAX_BARS else "distribution"
+    paginate = pages_enabled()
+    if mode == "bars" and len(results) > MAX_BARS and not paginate:
+        print(f"Más de {MAX_BARS} artículos en modo 'bars': se genera también la vista paginada.")
+        paginate = True
+    signature = hashlib.sha256(json.dumps([mode, paginate, sorted(results.items())]).encode("utf-8")).hexdigest()
+    if os.path.exists(output_image_path) and metadata_index.get_meta(pdf_folder, "figures_summary") == signature:
+        print(f"Los conteos de figuras no han cambiado. Se mantiene el gráfico: {output_image_path}")
+        return
+
+    # Ordenar los artículos alfabéticamente
+    articles = sorted(results.keys())
+    counts = [results[a] for a in articles]
+    with instrumentation.stage_timer("chart", mode=mode, articles=len(articles)):
+        if mode == "bars":
+            plot_figures_bars(articles, counts, output_image_path)
+        else:
+            plot_figures_distribution(results, output_image_path)
+        print(f"Gráfico de resumen guardado en: {output_image_path}")
+        if paginate:
+            pages_folder = os.path.join(os.path.dirname(output_image_path), "figures_in_articles_pages")
+            plot_figures_pages(pdf_folder, articles, counts, pages_folder)
+    metadata_index.record_artifact(pdf_folder, None, metadata_index.ARTIFACT_FIGURES_SUMMARY, output_image_path)
+    metadata_index.set_meta(pdf_folder, "figures_summary", signature)
 
 def main():
-    base_url = os.environ.get("GROBID_URL", "http://grobid:8070")
+    base_url = grobid_backends.get_base_url()
     pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
     
     pdf_files = sorted([f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")])
@@ -85,22 +200,25 @@ def main():
         print(f"No se encontraron archivos PDF en el directorio {pdf_folder}.")
         return
     
-    # Procesar cada PDF para generar y guardar el TEI XML en pdf_full_text_document
-    for pdf_file in pdf_files:
+    instrumentation.configure(pdf_folder)
+    # Procesar cada PDF (en paralelo, según GROBID_CONCURRENCY) para generar y guardar el TEI XML en pdf_full_text_document
+    def process(pdf_file):
         pdf_path = os.path.join(pdf_folder, pdf_file)
         base_name = os.path.splitext(pdf_file)[0]
-        output_folder = os.path.join(pdf_folder, base_name, "pdf_full_text_document")
-        tei_file = os.path.join(output_folder, "tei.xml")
-        if os.path.exists(tei_file):
+        output_folder = os.path.join(pdf_folder, base_name, FULLTEXT_FOLDER)
+        if fulltext_is_current(pdf_folder, pdf_file, base_url):
             print(f"TEI XML ya generado para {pdf_file}. Se omite el procesamiento.")
         else:
             os.makedirs(output_folder, exist_ok=True)
             print(f"\nProcesando el archivo PDF: {pdf_path}")
             process_pdf_save_tei(pdf_path, base_url, output_folder)
+
+    process_concurrently(pdf_files, process)
     
     # Una vez procesados todos los PDFs, generar el gráfico resumen en la ruta general de los PDFs.
     output_image_path = os.path.join(pdf_folder, "figures_in_articles.png")
     generate_figures_summary(pdf_folder, output_image_path)
+    instrumentation.finish()
 
 if __name__ == "__main__":
     print("Ejecutando archivo figures_visualization_generator.py")
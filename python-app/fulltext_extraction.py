@@ -0,0 +1,235 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import tei_cache
+import atomic_files
+import tei_storage
+import grobid_client
+import pdf_splitting
+import link_extraction
+import metadata_index
+import instrumentation
+from tei_stream import summarize_tei_string
+from text_frequencies import term_frequencies
+from grobid_pool import GrobidBusyError, get_concurrency, retry_when_busy
+
+# Carpeta (dentro de la carpeta de cada PDF) donde se guarda el TEI XML completo
+FULLTEXT_FOLDER = "pdf_full_text_document"
+FULLTEXT_ENDPOINT = "processFulltextDocument"
+
+def fulltext_tei_path(pdf_folder, pdf_file):
+    """
+    Devuelve la ruta del TEI XML completo de un PDF, el documento canónico del que se obtiene todo lo demás:
+    <pdf_folder>/<base_name>/pdf_full_text_document/tei.xml, con la extensión de su compresión (.gz o .zst)
+    si está comprimido (tei_storage.locate). Se lee con tei_storage.open_tei o tei_storage.read_tei.
+    """
+    base_name = os.path.splitext(pdf_file)[0]
+    return tei_storage.locate(os.path.join(pdf_folder, base_name, FULLTEXT_FOLDER, "tei.xml"))
+
+def request_fulltext_tei(pdf_path, base_url, options=None):
+    """
+    Envía el PDF al endpoint /api/processFulltextDocument de Grobid (con las opciones del formulario, si las hay).
+    Retorna el TEI XML (cadena), "" si Grobid responde 204 (sin contenido) o None si hubo otro error.
+    Si Grobid responde 503 (ocupado) se lanza GrobidBusyError para que el pool reintente; el limitador del backend
+    que respondió ya ha reducido su concurrencia (grobid_client.post_pdf).
+    Los PDFs grandes que cumplen GROBID_SPLIT_PAGES y GROBID_SPLIT_MIN_MB se procesan por rangos de páginas
+    (request_fulltext_tei_chunks).
+    """
+    ranges = pdf_splitting.page_ranges(pdf_path)
+    if ranges:
+        return request_fulltext_tei_chunks(pdf_path, base_url, ranges, options)
+    return _post_fulltext(pdf_path, base_url, options)
+
+def _post_fulltext(pdf_path, base_url, options=None):
+    """Una petición a processFulltextDocument con el resultado y los errores descritos en request_fulltext_tei."""
+    try:
+        response = grobid_client.post_pdf(base_url, FULLTEXT_ENDPOINT, pdf_path, options)
+        if response.status_code == 503:
+            raise GrobidBusyError(f"Grobid ocupado al procesar {os.path.basename(pdf_path)}")
+        if response.status_code == 200:
+            return response.text
+        elif response.status_code == 204:
+            print(f"Grobid no devolvió contenido (204) para {os.path.basename(pdf_path)}.")
+            return ""
+        else:
+            print(f"Error en el procesamiento de {os.path.basename(pdf_path)}. Código: {response.status_code}")
+            print(response.text)
+            instrumentation.record_error("grobid", os.path.basename(pdf_path), f"HTTP {response.status_code}")
+    except GrobidBusyError:
+        raise
+    except Exception as e:
+        print(f"Excepción al enviar {os.path.basename(pdf_path)}: {e}")
+        instrumentation.record_error("grobid", os.path.basename(pdf_path), f"{type(e).__name__}: {e}")
+    return None
+
+def request_fulltext_tei_chunks(pdf_path, base_url, ranges, options=None):
+    """
+    Procesa el PDF por rangos de páginas con los parámetros start y end de processFulltextDocument, en
+    paralelo (acotado por los limitadores de los backends de Grobid), y combina los TEI en un único documento
+    (pdf_splitting.merge_tei). Cada fragmento vuelve a subir el PDF completo, proyectado con mmap, pero
+    Grobid solo procesa su rango: las peticiones son más cortas, no agotan GROBID_READ_TIMEOUT y se reparten
+    entre los workers de Grobid. Un 503 solo reintenta el fragmento afectado. Retorna el TEI combinado,
+    "" si ningún fragmento tiene contenido o None si alguno falla.
+    """
+    def request_chunk(page_range):
+        start, end = page_range
+        return _post_fulltext(pdf_path, base_url, dict(options or {}, start=start, end=end))
+
+    print(f"{os.path.basename(pdf_path)}: se procesa en {len(ranges)} fragmentos de páginas.")
+    with ThreadPoolExecutor(max_workers=min(len(ranges), get_concurrency())) as executor:
+        chunks = list(executor.map(lambda page_range: retry_when_busy(request_chunk, page_range), ranges))
+    if any(chunk is None for chunk in chunks):
+        return None
+    with instrumentation.stage_timer("merge", os.path.basename(pdf_path)):
+        return pdf_splitting.merge_tei([(start, chunk) for (start, _), chunk in zip(ranges, chunks)])
+
+def _read_key(key_path):
+    try:
+        with open(key_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _store_fulltext(pdf_folder, pdf_file, key, tei_xml, source=None):
+    """
+    Guarda el TEI en la carpeta del PDF (comprimido según TEI_COMPRESSION) junto a su tei.key (escrituras
+    atómicas) y registra sus metadatos en el índice SQLite, junto con su tamaño y checksum en el manifiesto
+    de artefactos. Si el TEI ya está guardado en source (la entrada de la caché), la carpeta del PDF recibe un
+    enlace duro a ese archivo en lugar de una segunda copia (tei_storage.link_tei). Retorna la ruta del TEI guardado.
+    """
+    with instrumentation.stage_timer("parse", pdf_file):
+        summary = summarize_tei_string(tei_xml)
+        # Las frecuencias de términos del abstract se calculan una sola vez por TEI y quedan en el índice
+        counts = term_frequencies(summary["abstract"] or "")
+        # Links, DOIs e identificadores arXiv del texto, las notas y las referencias, en una sola pasada
+        links = link_extraction.extract_links(tei_xml)
+    with instrumentation.stage_timer("write", pdf_file):
+        tei_output_path = fulltext_tei_path(pdf_folder, pdf_file)
+        os.makedirs(os.path.dirname(tei_output_path), exist_ok=True)
+        # tei.xml y después tei.key, ambos con escritura atómica: un proceso interrumpido nunca deja un TEI
+        # truncado con una clave que lo dé por válido
+        stored = None
+        if source is not None:
+            try:
+                stored = tei_storage.link_tei(source, tei_output_path)
+            except FileNotFoundError:
+                # La entrada se expulsó de la caché entre tanto: se guarda una copia
+                pass
+        tei_output_path, data = stored or tei_storage.write_tei(tei_output_path, tei_xml)
+        atomic_files.atomic_write(fulltext_key_path(tei_output_path), key)
+        sha256 = tei_cache.file_sha256(os.path.join(pdf_folder, pdf_file))
+        metadata_index.record_document(pdf_folder, pdf_file, summary, sha256, key, links)
+        metadata_index.record_term_counts(pdf_folder, pdf_file, counts)
+        metadata_index.record_artifact(pdf_folder, pdf_file, metadata_index.ARTIFACT_TEI, tei_output_path, data)
+    return tei_output_path
+
+def _restore_document(pdf_folder, pdf_file, stored_key, tei_xml):
+    """
+    Al servir el TEI de la carpeta, su fila del índice vuelve a 'done' si un fallo anterior la cambió, y se
+    vuelve a registrar si falta o corresponde a otra clave.
+    """
+    document = metadata_index.get_document(pdf_folder, os.path.splitext(pdf_file)[0])
+    if document is None or document["tei_key"] != stored_key:
+        _store_fulltext(pdf_folder, pdf_file, stored_key, tei_xml, fulltext_tei_path(pdf_folder, pdf_file))
+    elif document["status"] != metadata_index.STATUS_DONE:
+        metadata_index.mark_done(pdf_folder, pdf_file)
+
+def tei_is_complete(tei_xml):
+    """
+    Indica si el TEI termina con el cierre de su elemento raíz. Detecta los tei.xml truncados que dejaba una
+    ejecución interrumpida antes de que las escrituras fueran atómicas.
+    """
+    return tei_xml.rstrip().endswith("</TEI>")
+
+def fulltext_key_path(tei_output_path):
+    """Ruta del archivo 'tei.key' que guarda, junto al tei.xml, la clave de caché con la que se generó."""
+    return os.path.join(os.path.dirname(tei_output_path), "tei.key")
+
+def fulltext_key(pdf_folder, pdf_file, base_url, options=None):
+    """
+    Clave de contenido del TEI completo del PDF (hash del PDF + versión de Grobid + endpoint + opciones).
+    Si el PDF se procesa por rangos de páginas, las opciones incluyen el tamaño de fragmento.
+    Retorna None si no se puede leer la versión de Grobid (ningún backend responde).
+    """
+    pdf_path = os.path.join(pdf_folder, pdf_file)
+    return tei_cache.cache_key(pdf_path, base_url, FULLTEXT_ENDPOINT, pdf_splitting.key_options(pdf_path, options))
+
+def fulltext_is_current(pdf_folder, pdf_file, base_url, artifact_path=None, options=None):
+    """
+    Indica si el TEI de la carpeta del PDF se generó a partir del contenido actual del PDF.
+    Si se indica artifact_path (p. ej. keyword_cloud.png o links.txt), además comprueba que el artefacto
+    exista y sea posterior al TEI, de modo que un PDF reemplazado con el mismo nombre se vuelva a procesar.
+    Si la versión de Grobid no se puede leer, se confía en el tei.key guardado.
+    """
+    tei_output_path = fulltext_tei_path(pdf_folder, pdf_file)
+    key_path = fulltext_key_path(tei_output_path)
+    stored_key = _read_key(key_path)
+    if stored_key is None or not os.path.exists(tei_output_path):
+        return False
+    key = fulltext_key(pdf_folder, pdf_file, base_url, options)
+    if key is not None and stored_key != key:
+        return False
+    if artifact_path is not None:
+        return os.path.exists(artifact_path) and os.path.getmtime(artifact_path) >= os.path.getmtime(key_path)
+    return True
+
+def get_fulltext_tei(pdf_folder, pdf_file, base_url, options=None):
+    """
+    Etapa de extracción compartida: devuelve el TEI XML completo del PDF.
+    El TEI se busca, en orden, en <base_name>/pdf_full_text_document/tei.xml (si su tei.key coincide con
+    el contenido actual del PDF) y en la caché direccionada por contenido (tei_cache). Solo si no está en
+    ninguna se hace una única llamada a processFulltextDocument; así los PDFs renombrados o duplicados no
+    vuelven a enviarse a Grobid y los reemplazados sí. Cada TEI nuevo se registra en el índice SQLite.
+    Si la versión de Grobid no se puede leer, se usa el TEI de la carpeta tal como está y, si no hay, no se
+    hace la petición: nunca se guarda una clave calculada sin la versión.
+    Retorna el TEI XML, "" en caso de 204 o None si no se pudo obtener.
+    """
+    tei_output_path = fulltext_tei_path(pdf_folder, pdf_file)
+    key = fulltext_key(pdf_folder, pdf_file, base_url, options)
+    stored_key = _read_key(fulltext_key_path(tei_output_path))
+    cache_dir = tei_cache.get_cache_dir(pdf_folder)
+
+    if os.path.exists(tei_output_path) and (key is None or stored_key in (key, None)):
+        try:
+            tei_xml = tei_storage.read_tei(tei_output_path)
+        except (OSError, EOFError, ValueError, RuntimeError):
+            tei_xml = ""
+        if tei_is_complete(tei_xml):
+            if stored_key is None and key is not None:
+                # TEI generado antes de existir la caché: se adopta una vez sin volver a llamar a Grobid
+                _store_fulltext(pdf_folder, pdf_file, key, tei_xml, tei_cache.put(cache_dir, key, tei_xml))
+            elif stored_key is not None:
+                _restore_document(pdf_folder, pdf_file, stored_key, tei_xml)
+            return tei_xml
+        print(f"El TEI XML de {pdf_file} está incompleto. Se vuelve a obtener.")
+
+    if key is None:
+        print(f"No se pudo leer la versión de Grobid. No se procesa {pdf_file}.")
+        metadata_index.set_status(pdf_folder, pdf_file, metadata_index.STATUS_FAILED,
+                                  "No se pudo leer la versión de Grobid")
+        return None
+
+    with tei_cache.key_lock(key):
+        tei_xml = tei_cache.get(cache_dir, key)
+        if tei_xml is not None:
+            print(f"TEI XML recuperado de la caché para {pdf_file}.")
+        else:
+            tei_xml = request_fulltext_tei(os.path.join(pdf_folder, pdf_file), base_url, options)
+            if tei_xml == "":
+                metadata_index.set_status(pdf_folder, pdf_file, metadata_index.STATUS_NO_CONTENT)
+                return tei_xml
+            if tei_xml is None:
+                metadata_index.set_status(pdf_folder, pdf_file, metadata_index.STATUS_FAILED,
+                                          "No se pudo obtener el TEI XML de Grobid")
+                return tei_xml
+            tei_cache.put(cache_dir, key, tei_xml)
+        source = tei_cache.entry_path(cache_dir, key)
+    tei_output_path = _store_fulltext(pdf_folder, pdf_file, key, tei_xml, source)
+    print(f"TEI XML guardado en: {tei_output_path}")
+    return tei_xml
+
+def extract_abstract(tei_xml):
+    """Extrae el texto del abstract (teiHeader/profileDesc/abstract) del TEI XML completo."""
+    abstract_text = summarize_tei_string(tei_xml)["abstract"]
+    if abstract_text is None:
+        print("No se encontró el elemento <abstract> en el TEI XML.")
+    return abstract_text
@@ -0,0 +1,188 @@
+import os
+import threading
+import instrumentation
+
+DEFAULT_URL = "http://grobid:8070"
+# Segundos entre comprobaciones de /api/isalive de cada backend (GROBID_HEALTH_INTERVAL)
+DEFAULT_HEALTH_INTERVAL = 5.0
+# Fallos seguidos (errores de conexión, timeouts o 5xx distintos de 503) tras los que se expulsa un backend
+DEFAULT_EJECT_FAILURES = 3
+
+def get_urls():
+    """
+    URLs de los backends de Grobid: GROBID_URLS (separadas por comas) o, si no se indica, GROBID_URL.
+    El orden se conserva y se eliminan duplicados y barras finales.
+    """
+    value = os.environ.get("GROBID_URLS") or os.environ.get("GROBID_URL", DEFAULT_URL)
+    urls = []
+    for url in value.split(","):
+        url = url.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls or [DEFAULT_URL]
+
+def get_base_url():
+    """URL con la que se identifica a Grobid en el resto de scripts: la del primer backend."""
+    return get_urls()[0]
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class Backend:
+    def __init__(self, url, concurrency):
+        from grobid_pool import AdaptiveLimiter
+        self.url = url
+        # Peticiones en curso a este backend, acotadas y ajustadas a su capacidad (AIMD) por su propio limitador
+        self.limiter = AdaptiveLimiter(concurrency, name=url)
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.healthy = True
+
+class BackendPool:
+    """
+    Reparte las peticiones entre varios backends de Grobid eligiendo el sano con menos peticiones en curso
+    (least outstanding requests) en proporción a su límite de concurrencia; en caso de empate, el que ha
+    atendido menos. Cada backend tiene su propio limitador AIMD, cuyo hueco se toma después de elegirlo
+    (grobid_client.post_pdf), de modo que un backend que responde 503 recibe menos peticiones. Un backend se expulsa tras
+    eject_failures fallos seguidos o si falla la comprobación de /api/isalive, y se readmite cuando esta
+    vuelve a responder 'true'. Si todos están expulsados se siguen usando todos, para que las peticiones
+    fallen con sus propios reintentos en lugar de quedar bloqueadas.
+    """
+    def __init__(self, urls, eject_failures=DEFAULT_EJECT_FAILURES, health_interval=DEFAULT_HEALTH_INTERVAL,
+                 concurrency=None):
+        from grobid_pool import get_backend_concurrency
+        self.concurrency = concurrency or get_backend_concurrency()
+        self.backends = [Backend(url, self.concurrency) for url in urls]
+        self._by_url = {backend.url: backend for backend in self.backends}
+        # URLs fuera del pool a las que se envían peticiones (p. ej. la prueba de un backend concreto)
+        self._others = {}
+        self.eject_failures = max(1, eject_failures)
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def __contains__(self, url):
+        return url.rstrip("/") in self._by_url
+
+    def acquire(self):
+        """Elige un backend y cuenta la petición como en curso. Debe liberarse con release()."""
+        self.start_health_checks()
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy] or self.backends
+            backend = min(candidates, key=lambda b: (b.outstanding / b.limiter.limit, b.requests))
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, failed=False):
+        """Libera la petición; failed indica un error de conexión, timeout o 5xx distinto de 503."""
+        with self._lock:
+            backend.outstanding -= 1
+            if not failed:
+                backend.failures = 0
+                return
+            backend.failures += 1
+            eject = backend.healthy and backend.failures >= self.eject_failures
+        if eject:
+            self.eject(backend, f"{backend.failures} fallos seguidos")
+
+    def limiter(self, url):
+        """Limitador del backend url; una URL fuera del pool tiene también el suyo, creado con el primer uso."""
+        url = url.rstrip("/")
+        with self._lock:
+            backend = self._by_url.get(url)
+            if backend is None:
+                backend = self._others.setdefault(url, Backend(url, self.concurrency))
+            return backend.limiter
+
+    def eject(self, backend, reason):
+        with self._lock:
+            if not backend.healthy:
+                return
+            backend.healthy = False
+        print(f"Backend de Grobid {backend.url} expulsado ({reason}).")
+        instrumentation.emit("backend", backend=backend.url, state="ejected", reason=reason)
+
+    def admit(self, backend):
+        with self._lock:
+            if backend.healthy:
+                return
+            backend.healthy = True
+            backend.failures = 0
+        print(f"Backend de Grobid {backend.url} readmitido.")
+        instrumentation.emit("backend", backend=backend.url, state="admitted")
+
+    def check_health(self):
+        """Comprueba /api/isalive de cada backend (la misma prueba que tester_inicial) y lo expulsa o readmite."""
+        import grobid_readiness
+        for backend in self.backends:
+            alive, reason = grobid_readiness.is_alive(backend.url)
+            if alive:
+                self.admit(backend)
+            else:
+                self.eject(backend, f"isalive: {reason}")
+
+    def healthy_urls(self):
+        with self._lock:
+            return [backend.url for backend in self.backends if backend.healthy]
+
+    def start_health_checks(self):
+        """Arranca (una vez) el hilo que comprueba los backends cada health_interval segundos."""
+        if len(self.backends) < 2 or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def stop(self):
+        self._stop.set()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Pool de backends del proceso, construido a partir de GROBID_URLS (o GROBID_URL)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BackendPool(get_urls(),
+                                int(_env_float("GROBID_EJECT_FAILURES", DEFAULT_EJECT_FAILURES)),
+                                _env_float("GROBID_HEALTH_INTERVAL", DEFAULT_HEALTH_INTERVAL))
+        return _pool
+
+def select(base_url):
+    """
+    Backend al que enviar una petición dirigida a base_url: si base_url pertenece al pool y hay varios
+    backends, se reparte con acquire() y se retorna el Backend elegido; si no, None (se usa base_url tal cual,
+    p. ej. en las pruebas de un backend concreto).
+    """
+    pool = get_pool()
+    if len(pool.backends) < 2 or base_url not in pool:
+        return None
+    return pool.acquire()
+
+def candidate_urls(base_url):
+    """URLs que pueden responder por base_url: la propia y, si pertenece al pool, los demás backends sanos."""
+    pool = get_pool()
+    if base_url not in pool:
+        return [base_url]
+    return [base_url] + [url for url in pool.healthy_urls() if url != base_url.rstrip("/")]
+
+def limiter(url):
+    """Limitador AIMD del backend url (BackendPool.limiter)."""
+    return get_pool().limiter(url)
+
+def release(backend, failed=False):
+    if backend is not None:
+        get_pool().release(backend, failed)
@@ -0,0 +1,190 @@
+import os
+import mmap
+import time
+import uuid
+import random
+import threading
+import instrumentation
+import grobid_backends
+
+# Tiempos máximos (segundos) de conexión y de lectura de la respuesta de Grobid
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 300.0
+# Tiempos para las comprobaciones rápidas (/api/version, /api/isalive): cortos para no quedar bloqueados
+# en un socket medio abierto mientras Grobid arranca
+PROBE_TIMEOUT = (2.0, 5.0)
+# Reintentos ante errores de conexión y respuestas 5xx (salvo 503, que se gestiona como contrapresión en grobid_pool)
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 30.0
+# Tamaño de cada bloque del PDF entregado al socket durante la subida
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def get_timeout():
+    """Tupla (conexión, lectura) leída de GROBID_CONNECT_TIMEOUT y GROBID_READ_TIMEOUT."""
+    return (_env_float("GROBID_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+            _env_float("GROBID_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))
+
+def get_retries():
+    return max(0, int(_env_float("GROBID_RETRIES", DEFAULT_RETRIES)))
+
+def get_session():
+    """
+    Devuelve la sesión HTTP compartida del proceso. Mantiene las conexiones abiertas (keep-alive) y su pool
+    tiene tantos huecos como peticiones simultáneas permitidas (get_concurrency()).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests se importa con la primera petición: los subcomandos que no llaman a Grobid no lo cargan
+            import requests
+            from requests.adapters import HTTPAdapter
+            from grobid_pool import get_concurrency
+            pool_size = max(10, get_concurrency())
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+class MultipartPdfUpload:
+    """
+    Cuerpo multipart/form-data para subir un PDF a Grobid sin copiarlo en memoria: el PDF se proyecta con
+    mmap y se envía por bloques como memoryview del archivo proyectado, que el socket escribe directamente
+    desde la caché de páginas del sistema. Se conoce su longitud de antemano, por lo que requests envía
+    Content-Length. finished_at guarda el instante (perf_counter) en que se terminó de enviar el cuerpo.
+    Solo expone __iter__ (no read) para que urllib3 envíe cada bloque tal cual en lugar de copiarlo con read().
+    """
+    def __init__(self, pdf_path, fields=None, file_field="input"):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        head = b""
+        for name, value in (fields or {}).items():
+            head += (f"--{self.boundary}\r\n"
+                     f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                     f"{value}\r\n").encode("utf-8")
+        filename = os.path.basename(pdf_path).replace('"', "")
+        head += (f"--{self.boundary}\r\n"
+                 f"Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: application/pdf\r\n\r\n").encode("utf-8")
+        self._head = head
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        with open(pdf_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap no admite archivos vacíos; el descriptor puede cerrarse, el mapa mantiene su propia referencia
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._length = len(self._head) + size + len(self._tail)
+        self.finished_at = None
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        yield self._head
+        if self._map is not None:
+            with memoryview(self._map) as view:
+                for offset in range(0, len(view), UPLOAD_CHUNK_SIZE):
+                    yield view[offset:offset + UPLOAD_CHUNK_SIZE]
+        yield self._tail
+        self.finished_at = time.perf_counter()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Un bloque sigue referenciado (subida interrumpida): el mapa se libera al recogerse el bloque
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _backoff(attempt):
+    delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)
+    time.sleep(delay * random.uniform(0.5, 1.5))
+
+def _should_retry(response):
+    return response.status_code >= 500 and response.status_code != 503
+
+def get(base_url, path, timeout=None, retries=None):
+    """GET a Grobid con la sesión compartida, timeouts y reintentos con espera exponencial y jitter."""
+    import requests
+    retries = get_retries() if retries is None else retries
+    url = f"{base_url}{path}"
+    for attempt in range(retries + 1):
+        try:
+            response = get_session().get(url, timeout=timeout or get_timeout())
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                raise
+        else:
+            if not _should_retry(response) or attempt >= retries:
+                return response
+        _backoff(attempt)
+
+def post_pdf(base_url, endpoint, pdf_path, options=None, timeout=None, retries=None, balanced=True,
+             count_document=True):
+    """
+    Sube el PDF a /api/<endpoint> de Grobid en streaming (MultipartPdfUpload) con la sesión compartida.
+    Reintenta ante errores de conexión, timeouts y respuestas 5xx distintas de 503; la respuesta 503
+    se devuelve al llamador para que actúe como señal de contrapresión.
+    Cada intento se registra en instrumentation con su tiempo de subida, de respuesta y los bytes enviados y recibidos.
+    Si base_url es uno de los backends de GROBID_URLS (y balanced no es False), cada intento se envía al backend sano con menos
+    peticiones en curso (grobid_backends), de modo que un reintento puede atenderlo otra réplica.
+    Cada intento ocupa, mientras dura, un hueco del limitador del backend elegido, que se reduce si este responde 503.
+    Con count_document=False (p. ej. la petición de calentamiento) los intentos se registran sin asociarlos
+    a un documento, de modo que no cuentan entre los documentos procesados.
+    """
+    import requests
+    retries = get_retries() if retries is None else retries
+    document = os.path.basename(pdf_path) if count_document else None
+    for attempt in range(retries + 1):
+        backend = grobid_backends.select(base_url) if balanced else None
+        target = backend.url if backend is not None else base_url
+        url = f"{target}/api/{endpoint}"
+        limiter = grobid_backends.limiter(target)
+        limiter.acquire()
+        start = time.perf_counter()
+        body = None
+        response = None
+        failed = True
+        try:
+            with MultipartPdfUpload(pdf_path, options) as body:
+                response = get_session().post(url, data=body, headers={"Content-Type": body.content_type},
+                                              timeout=timeout or get_timeout())
+            failed = _should_retry(response)
+            _record_attempt(endpoint, document, response.status_code, start, body, len(response.content), backend)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record_attempt(endpoint, document, "error", start, body, 0, backend)
+            if attempt >= retries:
+                raise
+            print(f"Error de conexión con Grobid ({e}). Reintento {attempt + 1}/{retries}...")
+        else:
+            if not failed or attempt >= retries:
+                return response
+            print(f"Grobid respondió {response.status_code}. Reintento {attempt + 1}/{retries}...")
+        finally:
+            limiter.release(busy=response is not None and response.status_code == 503)
+            grobid_backends.release(backend, failed)
+        _backoff(attempt)
+
+def _record_attempt(endpoint, document, status, start, body, bytes_in, backend=None):
+    end = time.perf_counter()
+    sent = body.finished_at if body is not None and body.finished_at is not None else end
+    instrumentation.record_grobid_request(endpoint, document, status, sent - start, end - sent,
+                                          len(body) if body is not None else 0, bytes_in,
+                                          backend.url if backend is not None else None)
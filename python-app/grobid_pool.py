@@ -0,0 +1,111 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+from grobid_backends import get_urls
+
+# Número máximo de peticiones simultáneas a cada backend de Grobid (configurable con GROBID_CONCURRENCY)
+DEFAULT_CONCURRENCY = 4
+# Reintentos y espera base (segundos) cuando Grobid responde 503
+BUSY_RETRIES = 8
+BUSY_BACKOFF = 1.0
+BUSY_BACKOFF_MAX = 30.0
+
+class GrobidBusyError(Exception):
+    """Grobid respondió 503 (servidor ocupado): la petición debe reintentarse más tarde."""
+
+class AdaptiveLimiter:
+    """
+    Limita el número de peticiones en curso a un backend de Grobid y lo ajusta a su capacidad real (AIMD):
+      - Cada 503 reduce el límite a la mitad (como mucho una vez por 'cooldown' segundos).
+      - Tras 'limit' respuestas correctas seguidas el límite crece en 1, hasta max_limit.
+    Cada backend tiene el suyo (grobid_backends.BackendPool), de modo que un 503 de una réplica no reduce
+    la concurrencia de las demás; name identifica al backend en los mensajes.
+    """
+    def __init__(self, max_limit, min_limit=1, cooldown=1.0, name=None):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.cooldown = cooldown
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, busy=False):
+        with self._cond:
+            self.in_flight -= 1
+            if busy:
+                self._successes = 0
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown and self.limit > self.min_limit:
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self._last_decrease = now
+                    backend = f" en {self.name}" if self.name else ""
+                    print(f"Grobid ocupado (503){backend}: se reducen las peticiones simultáneas a {self.limit}.")
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+def get_backend_concurrency():
+    """Peticiones simultáneas máximas a cada backend de Grobid: GROBID_CONCURRENCY (por defecto DEFAULT_CONCURRENCY)."""
+    try:
+        return max(1, int(os.environ.get("GROBID_CONCURRENCY", DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_CONCURRENCY
+
+def get_concurrency():
+    """
+    Peticiones simultáneas a Grobid en total: GROBID_CONCURRENCY por cada backend de GROBID_URLS, de modo
+    que el rendimiento crece con el número de réplicas.
+    """
+    return get_backend_concurrency() * len(get_urls())
+
+def retry_when_busy(func, item):
+    """
+    Ejecuta func(item); si lanza GrobidBusyError, se reintenta con espera exponencial y jitter hasta
+    BUSY_RETRIES veces. Las demás excepciones se informan y se retorna None. Si item es el nombre de un PDF,
+    el error se registra para él (y el pipeline lo anota como motivo del fallo en el diario).
+    """
+    document = item if isinstance(item, str) else None
+    attempt = 0
+    while True:
+        try:
+            return func(item)
+        except GrobidBusyError:
+            attempt += 1
+            if attempt > BUSY_RETRIES:
+                print(f"Grobid sigue ocupado tras {BUSY_RETRIES} reintentos. Se omite {item}.")
+                instrumentation.record_error("grobid", document, f"Grobid ocupado tras {BUSY_RETRIES} reintentos")
+                return None
+            delay = min(BUSY_BACKOFF_MAX, BUSY_BACKOFF * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1.5))
+        except Exception as e:
+            print(f"Excepción al procesar {item}: {e}")
+            instrumentation.record_error("grobid", document, f"{type(e).__name__}: {e}")
+            return None
+
+def process_concurrently(items, func):
+    """
+    Ejecuta func(item) para cada elemento con un pool de hilos del tamaño de get_concurrency().
+    Las peticiones a Grobid quedan acotadas por el limitador de cada backend; si func lanza GrobidBusyError,
+    el elemento se reintenta con espera exponencial y jitter hasta BUSY_RETRIES veces.
+    Las excepciones de un elemento no detienen al resto. Retorna los resultados en el orden de items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(items), get_concurrency())) as executor:
+        return list(executor.map(lambda item: retry_when_busy(func, item), items))
@@ -0,0 +1,131 @@
+import os
+import time
+import random
+import grobid_client
+import instrumentation
+
+# Espera inicial y máxima (segundos) entre comprobaciones: crece exponencialmente hasta el máximo
+DEFAULT_INITIAL_DELAY = 0.25
+DEFAULT_MAX_DELAY = 2.0
+# PDF de una página incluido en el repositorio que se envía una vez para cargar los modelos de Grobid
+WARMUP_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "grobid_warmup.pdf")
+WARMUP_ENDPOINT = "processFulltextDocument"
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def get_delays():
+    """(espera inicial, espera máxima) leídas de READINESS_INITIAL_DELAY y READINESS_MAX_DELAY."""
+    initial = max(0.01, _env_float("READINESS_INITIAL_DELAY", DEFAULT_INITIAL_DELAY))
+    return initial, max(initial, _env_float("READINESS_MAX_DELAY", DEFAULT_MAX_DELAY))
+
+def get_deadline():
+    """Tiempo máximo de espera (READINESS_TIMEOUT, en segundos); 0 o sin definir espera indefinidamente."""
+    timeout = _env_float("READINESS_TIMEOUT", 0)
+    return time.monotonic() + timeout if timeout > 0 else None
+
+def warmup_enabled():
+    """La petición de calentamiento está activada por defecto; GROBID_WARMUP=0 la desactiva."""
+    return os.environ.get("GROBID_WARMUP", "1").lower() not in ("0", "false", "no", "off")
+
+def backoff_delays():
+    """Generador de esperas con crecimiento exponencial, acotadas por el máximo y con jitter."""
+    initial, maximum = get_delays()
+    delay = initial
+    while True:
+        yield delay * random.uniform(0.8, 1.2)
+        delay = min(maximum, delay * 2)
+
+def is_alive(base_url):
+    """Una comprobación de /api/isalive con timeouts cortos y sin reintentos. Retorna (listo, motivo)."""
+    try:
+        response = grobid_client.get(base_url, "/api/isalive", timeout=grobid_client.PROBE_TIMEOUT, retries=0)
+    except Exception as e:
+        return False, type(e).__name__
+    if response.status_code != 200:
+        return False, f"código {response.status_code}"
+    if response.text.strip().lower() != "true":
+        return False, f"isalive = {response.text.strip()!r}"
+    return True, None
+
+def wait_until_alive(base_urls, deadline=None):
+    """
+    Comprueba /api/isalive de base_urls (una URL o una lista de backends) hasta que alguno responda 'true',
+    con espera exponencial acotada entre rondas. Solo se informa cuando cambia el motivo del fallo, para no
+    llenar el log mientras Grobid arranca. Retorna la primera URL disponible o None si se alcanza deadline.
+    """
+    urls = [base_urls] if isinstance(base_urls, str) else list(base_urls)
+    last_reason = None
+    for delay in backoff_delays():
+        reasons = []
+        for url in urls:
+            alive, reason = is_alive(url)
+            if alive:
+                return url
+            reasons.append(reason if len(urls) == 1 else f"{url}: {reason}")
+        reason = ", ".join(reasons)
+        if reason != last_reason:
+            print(f"Grobid aún no está disponible ({reason}). Reintentando...")
+            last_reason = reason
+        if deadline is not None and time.monotonic() + delay > deadline:
+            return None
+        time.sleep(delay)
+
+def warm_up(base_url, deadline=None, pdf_path=WARMUP_PDF):
+    """
+    Envía el PDF de calentamiento a processFulltextDocument para que Grobid cargue sus modelos antes del
+    primer artículo real. Se considera listo con 200 o 204; solo ante 503, errores de conexión o timeouts
+    (Grobid sigue arrancando) se reintenta con la misma espera acotada. Cualquier otra respuesta es definitiva:
+    se informa y se da el calentamiento por terminado, ya que repetirla no cambiaría el resultado.
+    Retorna False si se alcanza deadline.
+    """
+    import requests
+    for delay in backoff_delays():
+        start = time.perf_counter()
+        try:
+            response = grobid_client.post_pdf(base_url, WARMUP_ENDPOINT, pdf_path, retries=0, balanced=False,
+                                              count_document=False)
+            status = response.status_code
+        except (requests.ConnectionError, requests.Timeout) as e:
+            status = type(e).__name__
+        except Exception as e:
+            print(f"No se pudo enviar la petición de calentamiento ({type(e).__name__}: {e}). Se continúa sin ella.")
+            return True
+        if status in (200, 204):
+            print(f"Petición de calentamiento completada en {time.perf_counter() - start:.1f} s.")
+            return True
+        if status != 503 and not isinstance(status, str):  # str: nombre del error de conexión o timeout
+            print(f"La petición de calentamiento respondió {status}. Se continúa sin calentamiento.")
+            return True
+        print(f"Petición de calentamiento no completada ({status}). Reintentando...")
+        if deadline is not None and time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+
+def wait_until_ready(base_urls, check=None, deadline=None):
+    """
+    Espera a que Grobid pueda atender peticiones reales en alguno de base_urls (una URL o una lista de backends):
+      1. /api/isalive responde 'true' (comprobaciones rápidas con espera exponencial acotada);
+      2. check(url), si se indica (p. ej. los test de tester_inicial), pasa; si no, se vuelve al paso 1;
+      3. si GROBID_WARMUP está activado, la petición de calentamiento a ese backend se completa.
+    Retorna True en cuanto un backend está listo o False si se alcanza deadline.
+    """
+    start = time.perf_counter()
+    delays = backoff_delays()
+    while True:
+        base_url = wait_until_alive(base_urls, deadline)
+        if base_url is None:
+            return False
+        if check is None or check(base_url):
+            break
+        delay = next(delays)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+    if warmup_enabled() and not warm_up(base_url, deadline):
+        return False
+    instrumentation.record_stage("readiness", time.perf_counter() - start)
+    return True
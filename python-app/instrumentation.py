@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import atomic_files
+
+# Muestras que se conservan por serie (ventana deslizante, para que el modo demonio no crezca sin límite)
+MAX_SAMPLES = 10000
+# Documentos más lentos listados en el resumen
+SLOWEST_DOCUMENTS = 10
+QUANTILES = (0.5, 0.9, 0.99)
+
+def percentile(values, q):
+    """Percentil q (0-1) por rango más cercano de una lista de valores; None si está vacía."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+class Metrics:
+    """
+    Tiempos por documento de las etapas upload (subida del PDF), grobid (respuesta de Grobid), parse (TEI),
+    render (nubes) y write (artefactos e índice), y de las etapas de corpus (p. ej. chart). Agrega los eventos de instrumentación de un proceso. Todos los eventos pasan por observe(), tanto los
+    emitidos en vivo como los releídos de un archivo JSON lines, de modo que el resumen es el mismo en ambos casos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.run_id = uuid.uuid4().hex[:12]
+            self.started = time.time()
+            self.stage_seconds = {}
+            self.documents = {}
+            self.errors = Counter()
+            self.grobid_latencies = deque(maxlen=MAX_SAMPLES)
+            self.grobid_status = Counter()
+            self.bytes_out = 0
+            self.bytes_in = 0
+            self.backend_requests = Counter()
+            self.backend_ejections = Counter()
+            self.command = None
+            self.import_seconds = None
+
+    def observe(self, event):
+        with self._lock:
+            kind = event.get("event")
+            document = event.get("document")
+            if kind == "run_start" and "import_seconds" in event:
+                self.command = event.get("command")
+                self.import_seconds = event["import_seconds"]
+            elif kind == "stage":
+                stage = event["stage"]
+                self.stage_seconds.setdefault(stage, deque(maxlen=MAX_SAMPLES)).append(event["seconds"])
+                if document is not None:
+                    stages = self.documents.setdefault(document, Counter())
+                    stages[stage] += event["seconds"]
+                if not event.get("ok", True):
+                    self.errors[stage] += 1
+            elif kind == "grobid_request":
+                self.grobid_status[str(event["status"])] += 1
+                self.bytes_out += event.get("bytes_out", 0)
+                self.bytes_in += event.get("bytes_in", 0)
+                if event.get("backend"):
+                    self.backend_requests[event["backend"]] += 1
+                if event["status"] != "error":
+                    self.grobid_latencies.append(event["upload_seconds"] + event["response_seconds"])
+                if document is not None:
+                    stages = self.documents.setdefault(document, Counter())
+                    stages["upload"] += event["upload_seconds"]
+                    stages["grobid"] += event["response_seconds"]
+                for stage, seconds in (("upload", event["upload_seconds"]), ("grobid", event["response_seconds"])):
+                    self.stage_seconds.setdefault(stage, deque(maxlen=MAX_SAMPLES)).append(seconds)
+            elif kind == "error":
+                self.errors[event["stage"]] += 1
+            elif kind == "backend" and event.get("state") == "ejected":
+                self.backend_ejections[event["backend"]] += 1
+
+    def summary(self, top=SLOWEST_DOCUMENTS):
+        """Resumen de la ejecución: tiempos por etapa, latencias y tasas de Grobid, bytes y documentos más lentos."""
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            requests_total = sum(self.grobid_status.values())
+            slowest = sorted(self.documents.items(), key=lambda item: -sum(item[1].values()))[:top]
+            return {
+                "run": self.run_id,
+                "elapsed_seconds": elapsed,
+                "documents": len(self.documents),
+                "documents_per_second": len(self.documents) / elapsed,
+                "command": self.command,
+                "import_seconds": self.import_seconds,
+                "stages": {
+                    stage: {"count": len(values), "total": sum(values),
+                            **{f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES},
+                            "max": max(values) if values else None}
+                    for stage, values in sorted(self.stage_seconds.items())
+                },
+                "grobid": {
+                    "requests": requests_total,
+                    "status": dict(self.grobid_status),
+                    **{f"latency_p{int(q * 100)}": percentile(self.grobid_latencies, q) for q in QUANTILES},
+                    "busy_rate": self.grobid_status["503"] / requests_total if requests_total else 0.0,
+                    "error_rate": sum(n for status, n in self.grobid_status.items()
+                                      if status not in ("200", "204", "503")) / requests_total
+                                  if requests_total else 0.0,
+                    "bytes_out": self.bytes_out,
+                    "bytes_in": self.bytes_in,
+                    "backends": {backend: {"requests": self.backend_requests[backend],
+                                           "ejections": self.backend_ejections[backend]}
+                                 for backend in sorted(set(self.backend_requests) | set(self.backend_ejections))},
+                },
+                "errors": dict(self.errors),
+                "slowest": [{"document": document, "seconds": sum(stages.values()), "stages": dict(stages)}
+                            for document, stages in slowest],
+            }
+
+    def prometheus(self):
+        """Métricas en el formato de texto de Prometheus."""
+        summary = self.summary()
+        lines = [
+            "# HELP pipeline_stage_seconds Duración de cada etapa por documento.",
+            "# TYPE pipeline_stage_seconds summary",
+        ]
+        for stage, values in summary["stages"].items():
+            for q in QUANTILES:
+                value = values[f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f'pipeline_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'pipeline_stage_seconds_sum{{stage="{stage}"}} {values["total"]:.6f}')
+            lines.append(f'pipeline_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        grobid = summary["grobid"]
+        lines += [
+            "# HELP grobid_request_seconds Latencia de las peticiones a Grobid (subida y respuesta).",
+            "# TYPE grobid_request_seconds summary",
+        ]
+        for q in QUANTILES:
+            value = grobid[f"latency_p{int(q * 100)}"]
+            if value is not None:
+                lines.append(f'grobid_request_seconds{{quantile="{q}"}} {value:.6f}')
+        lines += ["# HELP grobid_requests_total Peticiones a Grobid por código de respuesta.",
+                  "# TYPE grobid_requests_total counter"]
+        for status, n in sorted(grobid["status"].items()):
+            lines.append(f'grobid_requests_total{{status="{status}"}} {n}')
+        lines += ["# TYPE grobid_bytes_sent_total counter", f"grobid_bytes_sent_total {grobid['bytes_out']}",
+                  "# TYPE grobid_bytes_received_total counter", f"grobid_bytes_received_total {grobid['bytes_in']}",
+                  "# HELP grobid_backend_requests_total Peticiones enviadas a cada backend de Grobid.",
+                  "# TYPE grobid_backend_requests_total counter"]
+        for backend, values in grobid["backends"].items():
+            lines.append(f'grobid_backend_requests_total{{backend="{backend}"}} {values["requests"]}')
+        lines += ["# HELP grobid_backend_ejections_total Expulsiones de cada backend de Grobid del pool.",
+                  "# TYPE grobid_backend_ejections_total counter"]
+        for backend, values in grobid["backends"].items():
+            lines.append(f'grobid_backend_ejections_total{{backend="{backend}"}} {values["ejections"]}')
+        lines += ["# TYPE pipeline_errors_total counter"]
+        for stage, n in sorted(summary["errors"].items()):
+            lines.append(f'pipeline_errors_total{{stage="{stage}"}} {n}')
+        lines += ["# TYPE pipeline_documents gauge", f"pipeline_documents {summary['documents']}"]
+        if summary.get("import_seconds") is not None:
+            lines += ["# HELP pipeline_import_seconds Tiempo de importación de los módulos del subcomando de cli.py.",
+                      "# TYPE pipeline_import_seconds gauge",
+                      f'pipeline_import_seconds{{command="{summary["command"]}"}} {summary["import_seconds"]:.6f}']
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+_log = None
+_log_lock = threading.Lock()
+_prometheus_path = None
+_startup = {}
+# Último error registrado de cada documento, que el pipeline anota como motivo del fallo en el diario
+_last_errors = {}
+
+def _disabled(value):
+    return value.lower() in ("0", "off", "false", "no")
+
+def configure(pdf_folder):
+    """
+    Empieza una ejecución instrumentada:
+      - METRICS_LOG: archivo JSON lines de eventos (por defecto <pdf_folder>/metrics/events.jsonl; 'off' lo desactiva).
+      - METRICS_PROMETHEUS: archivo en formato de texto de Prometheus que se escribe al terminar
+        (por defecto <pdf_folder>/metrics/metrics.prom; 'off' lo desactiva).
+      - METRICS_PORT: si se indica, sirve las métricas en http://0.0.0.0:<puerto>/metrics.
+    """
+    global _log, _prometheus_path
+    metrics.reset()
+    log_path = os.environ.get("METRICS_LOG", os.path.join(pdf_folder, "metrics", "events.jsonl"))
+    prometheus_path = os.environ.get("METRICS_PROMETHEUS", os.path.join(pdf_folder, "metrics", "metrics.prom"))
+    with _log_lock:
+        if _log is not None:
+            _log.close()
+            _log = None
+        if not _disabled(log_path):
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            _log = open(log_path, "a", encoding="utf-8", buffering=1)
+    _prometheus_path = None if _disabled(prometheus_path) else prometheus_path
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        start_http_server(int(port))
+    emit("run_start", pid=os.getpid(), script=os.path.basename(sys.argv[0]), **_startup)
+
+def record_import(command, seconds):
+    """Tiempo de importación del subcomando de cli.py; se registra en el evento run_start de la ejecución."""
+    _startup.update(command=command, import_seconds=round(seconds, 6))
+
+def emit(kind, **fields):
+    """Registra un evento: se agrega en memoria y, si hay archivo configurado, se añade como una línea JSON."""
+    event = {"ts": round(time.time(), 6), "run": metrics.run_id, "event": kind, **fields}
+    metrics.observe(event)
+    with _log_lock:
+        if _log is not None:
+            _log.write(json.dumps(event, ensure_ascii=False) + "\n")
+    return event
+
+def record_stage(stage, seconds, document=None, ok=True, **fields):
+    return emit("stage", stage=stage, document=document, seconds=round(seconds, 6), ok=ok, **fields)
+
+@contextmanager
+def stage_timer(stage, document=None, **fields):
+    """
+    Mide la duración del bloque como la etapa 'stage' del documento. Si el bloque lanza una excepción,
+    el evento se registra con ok=false y el tipo de error, y la excepción se propaga.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record_stage(stage, time.perf_counter() - start, document, ok=False, error=f"{type(e).__name__}: {e}", **fields)
+        raise
+    record_stage(stage, time.perf_counter() - start, document, **fields)
+
+def record_grobid_request(endpoint, document, status, upload_seconds, response_seconds, bytes_out, bytes_in,
+                          backend=None):
+    """
+    Una petición a Grobid: código (o 'error' si no hubo respuesta), tiempos de subida y de respuesta, bytes
+    y backend que la atendió (solo con varios backends en GROBID_URLS).
+    """
+    return emit("grobid_request", endpoint=endpoint, document=document, status=status,
+                upload_seconds=round(upload_seconds, 6), response_seconds=round(response_seconds, 6),
+                bytes_out=bytes_out, bytes_in=bytes_in, backend=backend)
+
+def record_error(stage, document, error):
+    """Error que no interrumpe la ejecución (p. ej. una excepción capturada al procesar un PDF)."""
+    if document is not None:
+        _last_errors[document] = str(error)
+    return emit("error", stage=stage, document=document, error=str(error))
+
+def pop_last_error(document):
+    """Último error registrado para el documento (y lo olvida), o None."""
+    return _last_errors.pop(document, None)
+
+def write_prometheus(path=None):
+    path = path or _prometheus_path
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    atomic_files.atomic_write(path, metrics.prometheus())
+
+def start_http_server(port):
+    """Sirve las métricas en formato Prometheus en /metrics desde un hilo en segundo plano."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Métricas disponibles en http://0.0.0.0:{port}/metrics")
+    return server
+
+def print_report(summary):
+    """Imprime el resumen de la ejecución con los documentos más lentos."""
+    grobid = summary["grobid"]
+    print(f"{'-' * 20}")
+    print(f"Métricas de la ejecución {summary['run']}: {summary['documents']} documentos en "
+          f"{summary['elapsed_seconds']:.1f} s ({summary['documents_per_second']:.2f} documentos/s)")
+    if summary.get("import_seconds") is not None:
+        print(f"  Importación del subcomando '{summary['command']}': {summary['import_seconds'] * 1000:.0f} ms")
+    print(f"  {'etapa':<14} {'n':>6} {'total (s)':>10} {'p50 (s)':>9} {'p99 (s)':>9} {'máx (s)':>9}")
+    for stage, values in summary["stages"].items():
+        print(f"  {stage:<14} {values['count']:>6} {values['total']:>10.2f} {values['p50']:>9.3f} "
+              f"{values['p99']:>9.3f} {values['max']:>9.3f}")
+    if grobid["requests"]:
+        print(f"  Grobid: {grobid['requests']} peticiones, latencia p50/p90/p99 = "
+              + "/".join("-" if grobid[k] is None else f"{grobid[k]:.2f}"
+                         for k in ("latency_p50", "latency_p90", "latency_p99"))
+              + f" s, 503: {grobid['busy_rate']:.1%}, errores: {grobid['error_rate']:.1%}, "
+              f"enviados {grobid['bytes_out'] / 1e6:.1f} MB, recibidos {grobid['bytes_in'] / 1e6:.1f} MB")
+    if len(grobid.get("backends", {})) > 1:
+        print("  Backends: " + ", ".join(f"{backend} {values['requests']} peticiones"
+                                        + (f" ({values['ejections']} expulsiones)" if values["ejections"] else "")
+                                        for backend, values in grobid["backends"].items()))
+    if summary["errors"]:
+        print("  Errores por etapa: " + ", ".join(f"{stage}={n}" for stage, n in sorted(summary["errors"].items())))
+    if summary["slowest"]:
+        print("  Documentos más lentos:")
+        for item in summary["slowest"]:
+            stages = ", ".join(f"{stage} {seconds:.2f}" for stage, seconds in sorted(item["stages"].items()))
+            print(f"    {item['seconds']:>8.2f} s  {item['document']}  ({stages})")
+    print(f"{'-' * 20}")
+
+def finish():
+    """Termina la ejecución instrumentada: registra el resumen, escribe el archivo Prometheus e imprime el informe."""
+    summary = metrics.summary()
+    emit("run_summary", summary=summary)
+    write_prometheus()
+    print_report(summary)
+    return summary
+
+def load_events(path, run=None):
+    """
+    Relee un archivo JSON lines y agrega los eventos de una ejecución (por defecto, la última registrada).
+    Retorna (Metrics con los eventos agregados, marca de tiempo del último evento).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if run is None:
+        runs = [event["run"] for event in events if event.get("event") == "run_start"]
+        run = runs[-1] if runs else None
+    loaded = Metrics()
+    selected = [event for event in events if run is None or event.get("run") == run]
+    if selected:
+        loaded.run_id = selected[0]["run"]
+        loaded.started = selected[0]["ts"]
+    for event in selected:
+        loaded.observe(event)
+    return loaded, (selected[-1]["ts"] if selected else time.time())
+
+def main():
+    """
+    Resumen de una ejecución a partir de su archivo de eventos:
+      python instrumentation.py [events.jsonl] [id de ejecución]
+    """
+    pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get(
+        "METRICS_LOG", os.path.join(pdf_folder, "metrics", "events.jsonl"))
+    if not os.path.exists(path):
+        print(f"No se encontró el archivo de eventos {path}.")
+        return 1
+    loaded, last_ts = load_events(path, sys.argv[2] if len(sys.argv) > 2 else None)
+    summary = loaded.summary()
+    summary["elapsed_seconds"] = max(last_ts - loaded.started, 1e-9)
+    summary["documents_per_second"] = summary["documents"] / summary["elapsed_seconds"]
+    print_report(summary)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,111 +1,231 @@
 import os
 import time
-import re
-import requests
-import xml.etree.ElementTree as ET
-from wordcloud import WordCloud
+from concurrent.futures import ProcessPoolExecutor
 import sys
+from fulltext_extraction import get_fulltext_tei, fulltext_is_current, extract_abstract
+from grobid_pool import process_concurrently
+import metadata_index
+import instrumentation
+import atomic_files
+import grobid_backends
+from text_frequencies import term_frequencies, get_tokenizer_config, config_signature
 
-def generate_keyword_cloud(text, output_folder):
-    """Genera una nube de palabras a partir del texto del abstract y la guarda como 'keyword_cloud.png'."""
-    wordcloud = WordCloud(width=800, height=400, background_color='white').generate(text)
-    output_path = os.path.join(output_folder, "keyword_cloud.png")
-    wordcloud.to_file(output_path)
-    print(f"Keyword cloud guardado en: {output_path}")
+# Tamaño (ancho, alto) de las nubes por documento, en modo previsualización y de la nube agregada del corpus
+KEYWORD_CLOUD_SIZE = (800, 400)
+PREVIEW_SIZE = (400, 200)
+CORPUS_CLOUD_SIZE = (1600, 800)
+# Número de palabras clave TF-IDF de la nube del corpus
+CORPUS_KEYWORDS = 300
+
+# WordCloud configuradas una sola vez por proceso (ver init_render_worker)
+_wordclouds = {}
+
+def get_render_options():
+    """
+    Opciones de renderizado leídas del entorno:
+      - KEYWORD_CLOUD_PREVIEW=1: imágenes de baja resolución (keyword_cloud_preview.png) para una revisión rápida.
+      - KEYWORD_CLOUD_FONT / KEYWORD_CLOUD_MASK: fuente TrueType e imagen de máscara comunes a todas las nubes.
+      - KEYWORD_CLOUD_CORPUS=1: genera además una nube agregada de todo el corpus (keyword_cloud_corpus.png).
+    """
+    return {
+        "preview": os.environ.get("KEYWORD_CLOUD_PREVIEW", "0").lower() in ("1", "true", "yes"),
+        "font_path": os.environ.get("KEYWORD_CLOUD_FONT") or None,
+        "mask_path": os.environ.get("KEYWORD_CLOUD_MASK") or None,
+        "corpus": os.environ.get("KEYWORD_CLOUD_CORPUS", "0").lower() in ("1", "true", "yes"),
+    }
 
-def extract_abstract_from_xml(tei_xml):
-    """Extrae el contenido del abstract a partir del TEI XML."""
+def keyword_cloud_filename(options):
+    return "keyword_cloud_preview.png" if options["preview"] else "keyword_cloud.png"
+
+def get_render_workers():
+    """Número de procesos de renderizado (KEYWORD_CLOUD_WORKERS, por defecto uno por núcleo)."""
     try:
-        root = ET.fromstring(tei_xml)
-        abstract_elem = root.find(".//abstract")
-        if abstract_elem is not None:
-            abstract_text = "".join(abstract_elem.itertext()).strip()
-            return abstract_text
-        else:
-            print("No se encontró el elemento <abstract> en el TEI XML.")
-    except ET.ParseError as e:
-        print("Error al parsear el TEI XML:", e)
-    return None
-
-def extract_abstract_from_bibtex(bibtex_text):
-    """Extrae el campo abstract del texto en formato BibTeX."""
-    match = re.search(r'abstract\s*=\s*\{(.*?)\}', bibtex_text, re.DOTALL | re.IGNORECASE)
-    if match:
-        abstract_text = match.group(1).strip()
-        return abstract_text
-    else:
-        print("No se encontró el campo 'abstract' en el BibTeX.")
-    return None
-
-def process_pdf_generate_keyword_cloud(pdf_path, base_url, output_folder):
-    """
-    Envía el PDF al endpoint /api/processHeaderDocument de Grobid para obtener el TEI XML,
-    guarda el XML en output_folder y genera una keyword cloud a partir del abstract.
-    """
-    url = f"{base_url}/api/processHeaderDocument"
+        return max(1, int(os.environ.get("KEYWORD_CLOUD_WORKERS", os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+def init_render_worker(options):
+    """
+    Inicializador de cada proceso de renderizado: carga la máscara una sola vez y deja preparadas
+    las WordCloud (por documento y de corpus) con la fuente y la configuración, que se reutilizan en cada nube.
+    wordcloud (y con ella matplotlib) se importa aquí, solo en los procesos que renderizan.
+    """
+    global _wordclouds
+    from wordcloud import WordCloud
+    mask = None
+    if options["mask_path"]:
+        import numpy as np
+        from PIL import Image
+        mask = np.array(Image.open(options["mask_path"]))
+    width, height = PREVIEW_SIZE if options["preview"] else KEYWORD_CLOUD_SIZE
+    max_words = 100 if options["preview"] else 200
+    _wordclouds = {
+        "document": WordCloud(width=width, height=height, background_color='white', font_path=options["font_path"],
+                              mask=mask, max_words=max_words),
+        "corpus": WordCloud(width=CORPUS_CLOUD_SIZE[0], height=CORPUS_CLOUD_SIZE[1], background_color='white',
+                            font_path=options["font_path"], mask=mask, max_words=300),
+    }
+
+def render_keyword_cloud(job):
+    """
+    Renderiza un trabajo (tipo, frecuencias, ruta de salida, PDF) con la WordCloud ya configurada del proceso.
+    Las frecuencias ya vienen calculadas, por lo que no se vuelve a tokenizar ningún texto.
+    Retorna (PDF, ruta de salida, error o None, segundos empleados); los tiempos se registran en el proceso principal.
+    """
+    kind, frequencies, output_path, document = job
+    start = time.perf_counter()
     try:
-        with open(pdf_path, "rb") as pdf_file:
-            files = {"input": pdf_file}
-            response = requests.post(url, files=files)
-        if response.status_code == 200:
-            response_text = response.text
-            
-            # Guarda el TEI XML en un archivo
-            tei_output_path = os.path.join(output_folder, "tei.xml")
-            with open(tei_output_path, "w", encoding="utf-8") as f:
-                f.write(response_text)
-            print(f"TEI XML guardado en: {tei_output_path}")
-            
-            abstract_text = None
-            if response_text.lstrip().startswith("<"):
-                abstract_text = extract_abstract_from_xml(response_text)
-            elif response_text.lstrip().startswith("@"):
-                abstract_text = extract_abstract_from_bibtex(response_text)
-            else:
-                print("Formato de respuesta desconocido.")
-            
-            if abstract_text:
-                print("Texto del abstract extraído.")
-                generate_keyword_cloud(abstract_text, output_folder)
-            else:
-                print("No se pudo extraer el abstract.")
-        else:
-            print("Error en el procesamiento del PDF. Código:", response.status_code)
-            print(response.text)
+        with atomic_files.atomic_path(output_path) as tmp_path:
+            _wordclouds[kind].generate_from_frequencies(frequencies).to_file(tmp_path)
+        return document, output_path, None, time.perf_counter() - start
     except Exception as e:
-        print("Excepción al enviar el PDF:", e)
+        return document, output_path, str(e), time.perf_counter() - start
+
+def render_keyword_clouds(jobs, options=None, workers=None, pdf_folder=None):
+    """
+    Renderiza por lotes las nubes de palabras repartiendo los trabajos entre un pool de procesos
+    (el algoritmo de colocación de wordcloud es Python puro y usa un solo núcleo por nube).
+    Si se indica pdf_folder, cada nube generada se registra en el manifiesto de artefactos del índice.
+    Retorna el número de nubes generadas correctamente.
+    """
+    options = options or get_render_options()
+    workers = min(workers or get_render_workers(), len(jobs))
+    if not jobs:
+        return 0
+    if workers <= 1:
+        # En el propio proceso las WordCloud se configuran una sola vez y se reutilizan entre llamadas
+        if not _wordclouds:
+            init_render_worker(options)
+        results = map(render_keyword_cloud, jobs)
+        return _report_renders(results, pdf_folder)
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker, initargs=(options,)) as executor:
+        return _report_renders(executor.map(render_keyword_cloud, jobs, chunksize=chunksize), pdf_folder)
+
+def _report_renders(results, pdf_folder=None):
+    rendered = 0
+    for result in results:
+        if report_render(result, pdf_folder):
+            rendered += 1
+    return rendered
+
+def report_render(result, pdf_folder=None):
+    """
+    Informa del resultado de render_keyword_cloud en el proceso principal: registra su tiempo y, si se indica
+    pdf_folder, añade la imagen al manifiesto de artefactos. Retorna True si la nube se generó.
+    """
+    document, output_path, error, seconds = result
+    instrumentation.record_stage("render", seconds, document, ok=error is None, output=output_path)
+    if error:
+        print(f"Error al generar la keyword cloud {output_path}: {error}")
+        return False
+    print(f"Keyword cloud guardado en: {output_path}")
+    if pdf_folder is not None:
+        kind = metadata_index.ARTIFACT_KEYWORD_CLOUD if document else metadata_index.ARTIFACT_KEYWORD_CLOUD_CORPUS
+        metadata_index.record_artifact(pdf_folder, document, kind, output_path)
+    return True
+
+def get_abstract(pdf_folder, pdf_file, base_url):
+    """Obtiene el abstract del PDF a partir de la etapa de extracción compartida (índice o TEI XML)."""
+    tei_xml = get_fulltext_tei(pdf_folder, pdf_file, base_url)
+    if not tei_xml:
+        print(f"No se pudo obtener el TEI XML para {pdf_file}.")
+        return None
+    document = metadata_index.get_document(pdf_folder, os.path.splitext(pdf_file)[0])
+    if document is not None and document["status"] == metadata_index.STATUS_DONE:
+        return document["abstract"]
+    return extract_abstract(tei_xml)
+
+def get_term_counts(pdf_folder, pdf_file, base_url, document=None):
+    """
+    Devuelve las frecuencias de términos del abstract del PDF guardadas en el índice. Si aún no existen
+    (documentos indexados antes de calcularlas o tras cambiar la configuración), se calculan una vez y se guardan.
+    Si se indica document (la fila 'done' del índice que dejó la etapa fetch), no se vuelve a leer el TEI:
+    el abstract se toma de la fila.
+    """
+    if document is None and not get_fulltext_tei(pdf_folder, pdf_file, base_url):
+        print(f"No se pudo obtener el TEI XML para {pdf_file}.")
+        return {}
+    counts = metadata_index.get_term_counts(pdf_folder, os.path.splitext(pdf_file)[0])
+    if not counts:
+        abstract_text = document["abstract"] if document is not None else get_abstract(pdf_folder, pdf_file, base_url)
+        counts = term_frequencies(abstract_text) if abstract_text else {}
+        if counts:
+            metadata_index.record_term_counts(pdf_folder, pdf_file, counts)
+    return counts
+
+def ensure_term_counts_config(pdf_folder):
+    """Si cambian los idiomas o los bigramas (KEYWORD_LANGUAGES, KEYWORD_BIGRAMS), se descartan las frecuencias guardadas."""
+    signature = config_signature(get_tokenizer_config())
+    if metadata_index.get_meta(pdf_folder, "term_counts_config") != signature:
+        metadata_index.clear_term_counts(pdf_folder)
+        metadata_index.set_meta(pdf_folder, "term_counts_config", signature)
+        return True
+    return False
+
+def keyword_cloud_job(pdf_folder, pdf_file, base_url, options, force=False, document=None):
+    """
+    Prepara el trabajo de renderizado de la keyword cloud de un PDF: ("document", frecuencias, ruta de salida, PDF).
+    Se crea la carpeta 'keyword_cloud' dentro de la carpeta del PDF. Retorna None si la imagen ya está
+    al día (y no se fuerza) o si no se pudo extraer el abstract. document es la fila 'done' del índice, si
+    ya se tiene (get_term_counts).
+    """
+    pdf_path = os.path.join(pdf_folder, pdf_file)
+    base_name = os.path.splitext(pdf_file)[0]
+    output_folder = os.path.join(pdf_folder, base_name, "keyword_cloud")
+    
+    keyword_cloud_file = os.path.join(output_folder, keyword_cloud_filename(options))
+    if not force and fulltext_is_current(pdf_folder, pdf_file, base_url, keyword_cloud_file):
+        print(f"Resultados ya generados para {pdf_file}. Se omite el procesamiento.")
+        return None
+
+    os.makedirs(output_folder, exist_ok=True)
+    print(f"\nProcesando el archivo PDF: {pdf_path}")
+    counts = get_term_counts(pdf_folder, pdf_file, base_url, document)
+    if not counts:
+        print(f"No se pudo extraer el abstract de {pdf_file}.")
+        return None
+    return ("document", counts, keyword_cloud_file, pdf_file)
 
 def main():
     """
     Procesa todos los archivos PDF en el directorio definido por PDF_FOLDER.
     Para cada PDF se crea una carpeta (con el mismo nombre del archivo sin extensión)
-    y dentro de ella se crea la carpeta 'keyword_cloud', donde se guardan los resultados:
-    el TEI XML y la imagen de la keyword cloud.
-    Si ya existen ambos archivos en dicha carpeta, se omite el procesamiento para ese PDF.
+    y dentro de ella se crea la carpeta 'keyword_cloud', donde se guarda la imagen de la keyword cloud.
+    El TEI XML se comparte con el resto de generadores en la carpeta 'pdf_full_text_document'.
+    Si ya existe la imagen y el PDF no ha cambiado desde que se generó, se omite el procesamiento para ese PDF.
+    Primero se obtienen las frecuencias de términos de cada abstract (en paralelo con Grobid, calculadas una
+    sola vez y guardadas en el índice) y después se renderizan todas las nubes en un pool de procesos
+    con generate_from_frequencies.
     """
-    base_url = os.environ.get("GROBID_URL", "http://grobid:8070")
+    base_url = grobid_backends.get_base_url()
     pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    options = get_render_options()
+    config_changed = ensure_term_counts_config(pdf_folder)
     
     pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
     if not pdf_files:
         print(f"No se encontraron archivos PDF en el directorio {pdf_folder}.")
         return
+    instrumentation.configure(pdf_folder)
+
+    def collect(pdf_file):
+        return keyword_cloud_job(pdf_folder, pdf_file, base_url, options, force=config_changed)
+
+    # Los PDFs se envían a Grobid en paralelo (GROBID_CONCURRENCY), adaptándose a sus respuestas 503
+    jobs = [job for job in process_concurrently(pdf_files, collect) if job]
+
+    # La nube del corpus usa las palabras clave TF-IDF calculadas a partir de las frecuencias guardadas,
+    # solo de los PDFs que siguen en la carpeta
+    corpus_file = os.path.join(pdf_folder, "keyword_cloud_corpus.png")
+    pruned = metadata_index.prune_documents(pdf_folder, pdf_files)
+    if options["corpus"] and (jobs or config_changed or pruned or not os.path.exists(corpus_file)):
+        keywords = dict(metadata_index.corpus_tfidf_keywords(pdf_folder, CORPUS_KEYWORDS))
+        if keywords:
+            jobs.append(("corpus", keywords, corpus_file, None))
 
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_folder, pdf_file)
-        base_name = os.path.splitext(pdf_file)[0]
-        # Se crea la carpeta 'keyword_cloud' dentro de la carpeta del PDF
-        output_folder = os.path.join(pdf_folder, base_name, "keyword_cloud")
-        
-        tei_file = os.path.join(output_folder, "tei.xml")
-        keyword_cloud_file = os.path.join(output_folder, "keyword_cloud.png")
-        if os.path.exists(tei_file) and os.path.exists(keyword_cloud_file):
-            print(f"Resultados ya generados para {pdf_file}. Se omite el procesamiento.")
-            continue
-
-        os.makedirs(output_folder, exist_ok=True)
-        print(f"\nProcesando el archivo PDF: {pdf_path}")
-        process_pdf_generate_keyword_cloud(pdf_path, base_url, output_folder)
+    render_keyword_clouds(jobs, options, pdf_folder=pdf_folder)
+    instrumentation.finish()
 
 if __name__ == "__main__":
     print("Ejecutando archivo keyword_cloud_generator.py")
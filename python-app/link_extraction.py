@@ -0,0 +1,151 @@
+import re
+import html
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Tipos de link del índice invertido
+KIND_URL = "url"
+KIND_DOI = "doi"
+KIND_ARXIV = "arxiv"
+
+# Parte del TEI donde aparece cada link
+SOURCE_TEXT = "text"
+SOURCE_NOTE = "note"
+SOURCE_REFERENCE = "reference"
+
+# Una sola expresión compilada que, en una pasada sobre el TEI, reconoce URLs, DOIs e identificadores arXiv,
+# además de la apertura y el cierre de <listBibl> y <note> para saber en qué parte del documento está cada link.
+# Las URLs se buscan tanto en el texto como en los atributos (p. ej. target), ya que se recorre el XML en bruto.
+# La comprobación anticipada del primer carácter descarta casi todas las posiciones sin probar cada alternativa.
+LINK_PATTERN = re.compile(r"""
+    (?=[hw1a<])
+    (?:
+    (?P<url>\b(?:https?://|www\.)[^\s<>"'{}|\\^`\[\]]+)
+  | (?P<doi>\b10\.\d{4,9}/[^\s<>"']+)
+  | (?P<arxiv>\barXiv:\s?(?P<arxiv_id>\d{4}\.\d{4,5}|[a-z][a-z.\-]*/\d{7})(?:v\d+)?)
+  | (?P<open><(?:listBibl|note)\b[^>]*?(?P<self_closing>/)?>)
+  | (?P<close></(?:listBibl|note)>)
+    )
+""", re.VERBOSE | re.IGNORECASE)
+HEADER_END = "</teiHeader>"
+# Partes de la cabecera que se omiten: fileDesc (título, DOI del propio artículo, fuente) y encodingDesc
+# (versión y URL de Grobid). El resto (profileDesc, con el abstract y las palabras clave) sí se recorre.
+HEADER_SKIP = re.compile(r"<(fileDesc|encodingDesc)\b(?:[^>]*?/>|.*?</\1>)", re.DOTALL | re.IGNORECASE)
+ARXIV_URL = re.compile(r"^/(?:abs|pdf)/(?P<id>\d{4}\.\d{4,5}|[a-z][a-z.\-]*/\d{7})(?:v\d+)?(?:\.pdf)?$", re.IGNORECASE)
+DOI_HOSTS = ("doi.org", "dx.doi.org")
+# Puntuación que suele quedar pegada al final de un link en el texto y no forma parte de él
+TRAILING_PUNCTUATION = ".,;:!?'\")]}>"
+TRACKING_PARAMETERS = ("utm_", "fbclid", "gclid")
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+def _strip_trailing(value):
+    """Quita la puntuación final, conservando un ')' si la URL tiene su '(' (p. ej. en Wikipedia)."""
+    while value and value[-1] in TRAILING_PUNCTUATION:
+        if value[-1] == ")" and value.count("(") >= value.count(")"):
+            break
+        value = value[:-1]
+    return value
+
+def canonical_doi(doi):
+    """DOI en su forma canónica: https://doi.org/<doi en minúsculas> (los DOI no distinguen mayúsculas)."""
+    doi = _strip_trailing(html.unescape(doi).strip())
+    return f"https://doi.org/{doi.lower()}" if doi else None
+
+def canonical_arxiv(arxiv_id):
+    """Identificador arXiv en su forma canónica: https://arxiv.org/abs/<id> sin versión."""
+    arxiv_id = re.sub(r"v\d+$", "", arxiv_id.strip())
+    return f"https://arxiv.org/abs/{arxiv_id.lower()}" if arxiv_id else None
+
+def canonical_url(url):
+    """
+    Forma canónica de una URL para deduplicar: https en lugar de http, host en minúsculas y sin 'www.' ni
+    puerto por defecto, sin fragmento, sin parámetros de seguimiento (utm_*, fbclid, gclid) y sin barra final.
+    Las URLs de doi.org y de arXiv (abs o pdf, con cualquier versión) se reducen a su DOI o identificador.
+    Retorna (tipo, link canónico) o None si no es una URL válida.
+    """
+    url = _strip_trailing(html.unescape(url).strip())
+    if url.lower().startswith("www."):
+        url = f"http://{url}"
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if scheme not in DEFAULT_PORTS or "." not in host:
+        return None
+    if host.startswith("www."):
+        host = host[4:]
+    if host in DOI_HOSTS and parts.path.startswith("/10."):
+        return KIND_DOI, canonical_doi(parts.path[1:])
+    if host in ("arxiv.org", "export.arxiv.org"):
+        match = ARXIV_URL.match(parts.path)
+        if match:
+            return KIND_ARXIV, canonical_arxiv(match.group("id"))
+    netloc = host if port is None or str(port) == DEFAULT_PORTS[scheme] else f"{host}:{port}"
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if not key.lower().startswith(TRACKING_PARAMETERS)])
+    return KIND_URL, urlunsplit(("https", netloc, parts.path.rstrip("/"), query, ""))
+
+def canonical_link(value):
+    """
+    Link canónico de un valor escrito por el usuario (URL, DOI con o sin 'doi:' o identificador arXiv con o
+    sin 'arXiv:'), para consultar el índice con la misma forma con la que se guardó. Retorna None si no se reconoce.
+    """
+    value = value.strip()
+    if re.match(r"^(?:doi:\s*)?10\.\d{4,9}/", value, re.IGNORECASE):
+        return canonical_doi(value.split(":", 1)[1] if value.lower().startswith("doi:") else value)
+    match = re.match(r"^(?:arXiv:\s*)?(\d{4}\.\d{4,5}|[a-z][a-z.\-]*/\d{7})(?:v\d+)?$", value, re.IGNORECASE)
+    if match:
+        return canonical_arxiv(match.group(1))
+    result = canonical_url(value if "://" in value or value.lower().startswith("www.") else f"https://{value}")
+    return result[1] if result else None
+
+def _scan(tei_xml):
+    """Coincidencias de LINK_PATTERN en el TEI, saltando las partes de la cabecera de HEADER_SKIP."""
+    header_end = tei_xml.find(HEADER_END)
+    position = 0
+    if header_end >= 0:
+        for skipped in HEADER_SKIP.finditer(tei_xml, 0, header_end):
+            yield from LINK_PATTERN.finditer(tei_xml, position, skipped.start())
+            position = skipped.end()
+    yield from LINK_PATTERN.finditer(tei_xml, position)
+
+def extract_links(tei_xml):
+    """
+    Extrae en una sola pasada los URLs, DOIs e identificadores arXiv del TEI XML completo (abstract, cuerpo,
+    notas al pie y referencias). De la cabecera solo se omiten fileDesc y encodingDesc (HEADER_SKIP), que
+    contienen el DOI del propio artículo y la URL de Grobid; los links del abstract cuentan como texto.
+    Retorna {link canónico: {"kind": tipo, "sources": conjunto de SOURCE_TEXT, SOURCE_NOTE o SOURCE_REFERENCE}}.
+    """
+    links = {}
+    in_list_bibl = 0
+    in_note = 0
+    for match in _scan(tei_xml):
+        group = match.lastgroup
+        if group == "open":
+            if match.group("self_closing"):
+                continue
+            if match.group("open")[1:].lower().startswith("listbibl"):
+                in_list_bibl += 1
+            else:
+                in_note += 1
+            continue
+        if group == "close":
+            if match.group("close")[2:].lower().startswith("listbibl"):
+                in_list_bibl = max(0, in_list_bibl - 1)
+            else:
+                in_note = max(0, in_note - 1)
+            continue
+        if group == "url":
+            result = canonical_url(match.group("url"))
+        elif group == "doi":
+            result = KIND_DOI, canonical_doi(match.group("doi"))
+        else:
+            result = KIND_ARXIV, canonical_arxiv(match.group("arxiv_id"))
+        if result is None or result[1] is None:
+            continue
+        kind, link = result
+        source = SOURCE_REFERENCE if in_list_bibl else SOURCE_NOTE if in_note else SOURCE_TEXT
+        links.setdefault(link, {"kind": kind, "sources": set()})["sources"].add(source)
+    return links
@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+from text_frequencies import tfidf_scores
+from link_extraction import canonical_link
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    pdf_file TEXT NOT NULL,
+    sha256 TEXT,
+    tei_key TEXT,
+    abstract TEXT,
+    figure_count INTEGER,
+    table_count INTEGER,
+    links TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS doc_references (
+    document TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    ref_id TEXT,
+    title TEXT,
+    doi TEXT,
+    target TEXT,
+    domain TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_references_document ON doc_references(document);
+CREATE INDEX IF NOT EXISTS idx_references_domain ON doc_references(domain);
+CREATE INDEX IF NOT EXISTS idx_references_doi ON doc_references(doi);
+CREATE TABLE IF NOT EXISTS links (
+    link TEXT NOT NULL,
+    document TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    domain TEXT,
+    PRIMARY KEY (link, document)
+);
+CREATE INDEX IF NOT EXISTS idx_links_document ON links(document);
+CREATE INDEX IF NOT EXISTS idx_links_domain ON links(domain);
+CREATE TABLE IF NOT EXISTS term_counts (
+    document TEXT NOT NULL,
+    term TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (document, term)
+);
+CREATE INDEX IF NOT EXISTS idx_term_counts_term ON term_counts(term);
+CREATE TABLE IF NOT EXISTS artifacts (
+    document TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (document, kind)
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Estados de un documento en el índice
+STATUS_DONE = "done"
+STATUS_NO_CONTENT = "no_content"
+STATUS_FAILED = "failed"
+
+# Tipos de artefacto del manifiesto (los de corpus se registran con documento '')
+ARTIFACT_TEI = "tei"
+ARTIFACT_LINKS = "links"
+ARTIFACT_KEYWORD_CLOUD = "keyword_cloud"
+ARTIFACT_KEYWORD_CLOUD_CORPUS = "keyword_cloud_corpus"
+ARTIFACT_FIGURES_SUMMARY = "figures_summary"
+
+_local = threading.local()
+
+def get_index_path(pdf_folder):
+    """Ruta de la base de datos SQLite: INDEX_DB o, por defecto, <pdf_folder>/metadata_index.sqlite."""
+    return os.environ.get("INDEX_DB", os.path.join(pdf_folder, "metadata_index.sqlite"))
+
+def connect(pdf_folder):
+    """
+    Devuelve la conexión al índice para el hilo actual (una por hilo y base de datos) y crea el esquema
+    si no existe. Se usa el modo WAL para que las lecturas no bloqueen a los escritores concurrentes.
+    """
+    path = get_index_path(pdf_folder)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _upgrade_schema(conn)
+        connections[path] = conn
+    return connections[path]
+
+def _upgrade_schema(conn):
+    """Añade las columnas nuevas a los índices creados con una versión anterior del esquema."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(documents)")}
+    if "last_error" not in columns:
+        conn.execute("ALTER TABLE documents ADD COLUMN last_error TEXT")
+
+def link_domain(url):
+    """Dominio de un link en minúsculas y sin el prefijo 'www.'."""
+    netloc = urlsplit(url).netloc.lower().split("@")[-1].split(":")[0]
+    return netloc[4:] if netloc.startswith("www.") else netloc
+
+def record_document(pdf_folder, pdf_file, summary, sha256=None, tei_key=None, links=None):
+    """
+    Guarda (o reemplaza) la fila del documento con los datos extraídos de su TEI (resumen de tei_stream)
+    y sus referencias, con estado 'done'. Si se indican links (resultado de link_extraction.extract_links),
+    se guardan como los links del documento y en el índice invertido, en la misma transacción.
+    """
+    if links is not None:
+        summary = dict(summary, links=sorted(links))
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (name, pdf_file, sha256, tei_key, abstract, figure_count, table_count,"
+            " links, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+            (name, pdf_file, sha256, tei_key, summary["abstract"], summary["figures"], summary["tables"],
+             json.dumps(summary["links"]), STATUS_DONE, time.time()))
+        conn.execute("DELETE FROM doc_references WHERE document = ?", (name,))
+        rows = []
+        for position, ref in enumerate(summary["references"]):
+            for target in ref["targets"] or [None]:
+                rows.append((name, position, ref["id"], ref["title"], ref["doi"], target,
+                             link_domain(target) if target else None))
+        conn.executemany(
+            "INSERT INTO doc_references (document, position, ref_id, title, doi, target, domain)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        if links is not None:
+            _replace_links(conn, name, links)
+
+def _replace_links(conn, name, links):
+    conn.execute("DELETE FROM links WHERE document = ?", (name,))
+    conn.executemany(
+        "INSERT INTO links (link, document, kind, sources, domain) VALUES (?, ?, ?, ?, ?)",
+        [(link, name, value["kind"], ",".join(sorted(value["sources"])), link_domain(link))
+         for link, value in links.items()])
+
+def record_links(pdf_folder, pdf_file, links):
+    """Reemplaza los links de un documento (columna links y índice invertido) sin tocar el resto de su fila."""
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("UPDATE documents SET links = ?, updated_at = ? WHERE name = ?",
+                     (json.dumps(sorted(links)), time.time(), name))
+        _replace_links(conn, name, links)
+
+def _tei_on_disk(conn, pdf_folder, name):
+    """Indica si el documento está 'done' y el TEI registrado en el manifiesto sigue en disco."""
+    row = conn.execute(
+        "SELECT d.status, a.path FROM documents d LEFT JOIN artifacts a ON a.document = d.name AND a.kind = ?"
+        " WHERE d.name = ?", (ARTIFACT_TEI, name)).fetchone()
+    return (row is not None and row["status"] == STATUS_DONE and row["path"] is not None
+            and os.path.exists(os.path.join(pdf_folder, row["path"])))
+
+def set_status(pdf_folder, pdf_file, status, error=None):
+    """
+    Actualiza solo el estado (y el motivo del error, si lo hay) de un documento. Un fallo no rebaja un
+    documento 'done' cuyo TEI sigue en disco (p. ej. si Grobid no responde al volver a pedirlo): el estado se
+    conserva y el error solo se anota en last_error.
+    """
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        if status == STATUS_FAILED and _tei_on_disk(conn, pdf_folder, name):
+            conn.execute("UPDATE documents SET last_error = ?, updated_at = ? WHERE name = ?",
+                         (error, time.time(), name))
+            return
+        conn.execute(
+            "INSERT INTO documents (name, pdf_file, status, error, updated_at, last_error) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(name) DO UPDATE SET status = excluded.status, error = excluded.error,"
+            " updated_at = excluded.updated_at, last_error = excluded.last_error",
+            (name, pdf_file, status, error, time.time(), error))
+
+def mark_done(pdf_folder, pdf_file):
+    """Devuelve a 'done' un documento cuyo TEI se ha vuelto a servir desde disco (sin tocar sus metadatos)."""
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("UPDATE documents SET status = ?, error = NULL, updated_at = ? WHERE name = ? AND status != ?",
+                     (STATUS_DONE, time.time(), name, STATUS_DONE))
+
+def list_pdfs(pdf_folder):
+    """PDFs que hay ahora en pdf_folder."""
+    return [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
+
+def prune_documents(pdf_folder, pdf_files=None):
+    """
+    Elimina del índice los documentos cuyo PDF ya no está en pdf_folder (borrados o renombrados) con sus
+    referencias, links, frecuencias de términos, artefactos y hashes, para que las consultas de links y las
+    palabras clave del corpus solo incluyan los PDFs actuales. pdf_files es la lista de PDFs actuales (por
+    defecto, list_pdfs). Retorna el número de documentos eliminados.
+    """
+    pdf_files = list_pdfs(pdf_folder) if pdf_files is None else pdf_files
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS current_pdfs (pdf_file TEXT PRIMARY KEY, name TEXT NOT NULL)")
+        conn.execute("DELETE FROM current_pdfs")
+        conn.executemany("INSERT OR IGNORE INTO current_pdfs (pdf_file, name) VALUES (?, ?)",
+                         [(pdf_file, os.path.splitext(pdf_file)[0]) for pdf_file in pdf_files])
+        removed = conn.execute(
+            "DELETE FROM documents WHERE name NOT IN (SELECT name FROM current_pdfs)").rowcount
+        for table in ("doc_references", "links", "term_counts"):
+            conn.execute(f"DELETE FROM {table} WHERE document NOT IN (SELECT name FROM current_pdfs)")
+        # Los artefactos del corpus se registran con documento ''
+        conn.execute("DELETE FROM artifacts WHERE document != '' AND document NOT IN (SELECT name FROM current_pdfs)")
+        conn.execute("DELETE FROM file_hashes WHERE path NOT IN (SELECT pdf_file FROM current_pdfs)")
+    return removed
+
+def get_document(pdf_folder, name):
+    row = connect(pdf_folder).execute("SELECT * FROM documents WHERE name = ?", (name,)).fetchone()
+    return dict(row) if row is not None else None
+
+def get_documents(pdf_folder):
+    """Devuelve {nombre: fila} de todos los documentos del índice."""
+    rows = connect(pdf_folder).execute("SELECT * FROM documents ORDER BY name").fetchall()
+    return {row["name"]: dict(row) for row in rows}
+
+def current_documents(pdf_folder, signatures):
+    """
+    PDFs ya procesados cuyo contenido no ha cambiado: documento en 'done' o 'no_content' cuyo SHA-256 coincide
+    con el hash memorizado del PDF para su tamaño y mtime actuales. signatures es {PDF: (tamaño, mtime_ns)}.
+    """
+    rows = connect(pdf_folder).execute(
+        "SELECT d.pdf_file, h.size, h.mtime_ns FROM documents d JOIN file_hashes h"
+        " ON h.path = d.pdf_file AND h.sha256 = d.sha256 WHERE d.status IN (?, ?)",
+        (STATUS_DONE, STATUS_NO_CONTENT)).fetchall()
+    return [row["pdf_file"] for row in rows if signatures.get(row["pdf_file"]) == (row["size"], row["mtime_ns"])]
+
+def get_figure_counts(pdf_folder):
+    """Devuelve {nombre: número de figuras} de los documentos procesados correctamente."""
+    rows = connect(pdf_folder).execute(
+        "SELECT name, figure_count FROM documents WHERE status = ? ORDER BY name", (STATUS_DONE,)).fetchall()
+    return {row["name"]: row["figure_count"] for row in rows}
+
+def record_figure_counts(pdf_folder, pdf_file, figures, tables):
+    """Actualiza solo el número de figuras y tablas de un documento ya registrado."""
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("UPDATE documents SET figure_count = ?, table_count = ?, updated_at = ? WHERE name = ?",
+                     (figures, tables, time.time(), name))
+
+def documents_citing_domain(pdf_folder, domain):
+    """
+    Documentos con algún link (en las referencias, el texto o las notas) que pertenece al dominio indicado
+    (o a un subdominio).
+    """
+    domain = link_domain(f"//{domain}")
+    rows = connect(pdf_folder).execute(
+        "SELECT document FROM doc_references WHERE domain = ? OR domain LIKE ?"
+        " UNION SELECT document FROM links WHERE domain = ? OR domain LIKE ? ORDER BY document",
+        (domain, f"%.{domain}", domain, f"%.{domain}")).fetchall()
+    return [row["document"] for row in rows]
+
+def documents_citing_doi(pdf_folder, doi):
+    doi = doi.strip()
+    rows = connect(pdf_folder).execute(
+        "SELECT document FROM doc_references WHERE lower(doi) = lower(?)"
+        " UNION SELECT document FROM links WHERE link = ? ORDER BY document",
+        (doi, canonical_link(doi))).fetchall()
+    return [row["document"] for row in rows]
+
+def documents_with_link(pdf_folder, value):
+    """
+    Consulta del índice invertido: documentos que contienen el link (URL, DOI o identificador arXiv, que se
+    normaliza como al extraerlo) o una URL bajo él (p. ej. los archivos de un dataset). Retorna una lista
+    de (documento, link, partes del TEI donde aparece).
+    """
+    link = canonical_link(value)
+    if link is None:
+        return []
+    # link/... ocupa el rango [link + '/', link + '0') en el orden del índice, ya que '0' sigue a '/'
+    rows = connect(pdf_folder).execute(
+        "SELECT document, link, sources FROM links WHERE link = ? OR (link >= ? AND link < ?)"
+        " ORDER BY document, link", (link, f"{link}/", f"{link}0")).fetchall()
+    return [(row["document"], row["link"], row["sources"]) for row in rows]
+
+def most_linked(pdf_folder, top_n=20, kind=None):
+    """Links que aparecen en más documentos del corpus: lista de (link, tipo, número de documentos)."""
+    rows = connect(pdf_folder).execute(
+        "SELECT link, kind, COUNT(*) AS n FROM links" + (" WHERE kind = ?" if kind else "")
+        + " GROUP BY link ORDER BY n DESC, link LIMIT ?", ((kind, top_n) if kind else (top_n,))).fetchall()
+    return [(row["link"], row["kind"], row["n"]) for row in rows]
+
+def record_term_counts(pdf_folder, pdf_file, counts):
+    """Guarda (reemplazando las anteriores) las frecuencias de términos del abstract de un documento."""
+    name = os.path.splitext(pdf_file)[0]
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("DELETE FROM term_counts WHERE document = ?", (name,))
+        conn.executemany("INSERT INTO term_counts (document, term, count) VALUES (?, ?, ?)",
+                         [(name, term, count) for term, count in counts.items()])
+
+def get_term_counts(pdf_folder, name):
+    """Devuelve {término: frecuencia} del documento ({} si aún no se han calculado)."""
+    rows = connect(pdf_folder).execute(
+        "SELECT term, count FROM term_counts WHERE document = ?", (name,)).fetchall()
+    return {row["term"]: row["count"] for row in rows}
+
+def clear_term_counts(pdf_folder):
+    """Elimina todas las frecuencias (p. ej. al cambiar los idiomas o los bigramas), que se recalculan a demanda."""
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("DELETE FROM term_counts")
+
+def corpus_tfidf_keywords(pdf_folder, top_n=50):
+    """
+    Palabras clave del corpus por TF-IDF calculadas solo con las frecuencias guardadas, sin volver a leer
+    ningún texto. Retorna una lista [(término, puntuación)] ordenada de mayor a menor.
+    """
+    conn = connect(pdf_folder)
+    total_documents = conn.execute("SELECT COUNT(DISTINCT document) FROM term_counts").fetchone()[0]
+    rows = conn.execute(
+        "SELECT t.term, SUM(CAST(t.count AS REAL) / d.total) AS tf, COUNT(*) AS df FROM term_counts t"
+        " JOIN (SELECT document, SUM(count) AS total FROM term_counts GROUP BY document) d"
+        " ON t.document = d.document GROUP BY t.term").fetchall()
+    scores = tfidf_scores(((row["term"], row["tf"], row["df"]) for row in rows), total_documents)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+
+def record_artifact(pdf_folder, pdf_file, kind, path, data=None):
+    """
+    Registra en el manifiesto un artefacto recién escrito: ruta relativa a pdf_folder, tamaño y SHA-256.
+    pdf_file es None para los artefactos del corpus. Si el productor ya tiene el contenido en memoria (data,
+    en bytes) se usa para el checksum sin volver a leer el archivo.
+    """
+    if data is None:
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+                size += len(block)
+    else:
+        digest = hashlib.sha256(data)
+        size = len(data)
+    name = os.path.splitext(pdf_file)[0] if pdf_file else ""
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO artifacts (document, kind, path, size, sha256, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, kind, os.path.relpath(path, pdf_folder), size, digest.hexdigest(), time.time()))
+
+def get_artifacts(pdf_folder):
+    """Devuelve el manifiesto completo en una sola consulta: {(documento, tipo): fila}."""
+    rows = connect(pdf_folder).execute("SELECT * FROM artifacts").fetchall()
+    return {(row["document"], row["kind"]): dict(row) for row in rows}
+
+def get_file_hash(pdf_folder, path, size, mtime_ns):
+    """SHA-256 memorizado de un archivo de pdf_folder si su tamaño y mtime no han cambiado, o None."""
+    row = connect(pdf_folder).execute(
+        "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+        (os.path.relpath(path, pdf_folder), size, mtime_ns)).fetchone()
+    return row["sha256"] if row is not None else None
+
+def record_file_hash(pdf_folder, path, size, mtime_ns, sha256):
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                     (os.path.relpath(path, pdf_folder), size, mtime_ns, sha256))
+
+def get_meta(pdf_folder, key):
+    """Valor auxiliar guardado en el índice (p. ej. la firma del último gráfico generado) o None."""
+    row = connect(pdf_folder).execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row is not None else None
+
+def set_meta(pdf_folder, key, value):
+    conn = connect(pdf_folder)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def main():
+    """
+    Consultas rápidas sobre el índice:
+      python metadata_index.py summary        -> número de documentos por estado
+      python metadata_index.py doc <nombre>   -> fila de un documento
+      python metadata_index.py domain <dom>   -> documentos que citan un dominio
+      python metadata_index.py doi <doi>      -> documentos que citan un DOI
+      python metadata_index.py link <link>    -> documentos que contienen un link, DOI o arXiv (o URLs bajo él)
+      python metadata_index.py links [n]      -> n links que aparecen en más documentos
+      python metadata_index.py keywords [n]   -> n palabras clave del corpus por TF-IDF
+    """
+    pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    if len(sys.argv) < 2 or sys.argv[1] not in ("summary", "doc", "domain", "doi", "link", "links", "keywords") or \
+            (sys.argv[1] not in ("summary", "links", "keywords") and len(sys.argv) < 3):
+        print(main.__doc__)
+        return 1
+    command = sys.argv[1]
+    # Las consultas solo incluyen los PDFs que siguen en la carpeta
+    prune_documents(pdf_folder)
+    if command == "summary":
+        rows = connect(pdf_folder).execute(
+            "SELECT status, COUNT(*) AS n FROM documents GROUP BY status ORDER BY status").fetchall()
+        for row in rows:
+            print(f"{row['status']}: {row['n']}")
+    elif command == "doc":
+        print(json.dumps(get_document(pdf_folder, sys.argv[2]), indent=2, ensure_ascii=False))
+    elif command == "domain":
+        print("\n".join(documents_citing_domain(pdf_folder, sys.argv[2])))
+    elif command == "doi":
+        print("\n".join(documents_citing_doi(pdf_folder, sys.argv[2])))
+    elif command == "link":
+        for document, link, sources in documents_with_link(pdf_folder, sys.argv[2]):
+            print(f"{document}\t{link}\t{sources}")
+    elif command == "links":
+        top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+        for link, kind, n in most_linked(pdf_folder, top_n):
+            print(f"{n}\t{kind}\t{link}")
+    elif command == "keywords":
+        top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        for term, score in corpus_tfidf_keywords(pdf_folder, top_n):
+            print(f"{score:.4f}\t{term}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
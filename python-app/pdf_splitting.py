@@ -0,0 +1,179 @@
+import os
+import re
+import zlib
+import mmap
+import threading
+import xml.etree.ElementTree as ET
+from tei_stream import TEI, XML_ID
+
+# Páginas por fragmento al dividir PDFs grandes (GROBID_SPLIT_PAGES); 0 desactiva la división
+DEFAULT_SPLIT_PAGES = 0
+# Tamaño mínimo (MB) a partir del cual se divide un PDF (GROBID_SPLIT_MIN_MB)
+DEFAULT_SPLIT_MIN_MB = 50
+TEI_NAMESPACE = TEI.strip("{}")
+# Objetos /Type /Page del PDF (no /Pages), contados sobre el archivo proyectado con mmap
+PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+# Flujos de objetos comprimidos (PDF 1.5+), donde pueden estar los objetos /Type /Page
+OBJECT_STREAM = re.compile(rb"/Type\s*/ObjStm(?![A-Za-z])")
+STREAM_START = re.compile(rb"stream\r?\n")
+# Bytes de diccionario que se examinan alrededor de /Type /ObjStm y tamaño de los bloques al descomprimir
+STREAM_DICT_BYTES = 1024
+INFLATE_BLOCK = 64 * 1024
+
+_page_counts = {}
+_unsplittable = set()
+_lock = threading.Lock()
+
+ET.register_namespace("", TEI_NAMESPACE)
+
+def _env_number(name, default, cast=int):
+    try:
+        return max(0, cast(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+def get_split_pages():
+    return _env_number("GROBID_SPLIT_PAGES", DEFAULT_SPLIT_PAGES)
+
+def get_split_min_bytes():
+    return int(_env_number("GROBID_SPLIT_MIN_MB", DEFAULT_SPLIT_MIN_MB, float) * 1024 * 1024)
+
+def _inflate(data, start):
+    """Descomprime (Flate) en bloques el flujo que empieza en start, hasta su fin. Retorna None si no es válido."""
+    decompressor = zlib.decompressobj()
+    chunks = []
+    position = start
+    try:
+        while not decompressor.eof and position < len(data):
+            chunks.append(decompressor.decompress(data[position:position + INFLATE_BLOCK]))
+            position += INFLATE_BLOCK
+    except zlib.error:
+        return None
+    return b"".join(chunks)
+
+def _count_compressed_pages(data):
+    """
+    Objetos /Type /Page dentro de los flujos de objetos (/Type /ObjStm) comprimidos con FlateDecode, los
+    únicos que usan los PDF 1.5+ habituales. Solo se descomprimen esos flujos, no las imágenes de las páginas.
+    """
+    pages = 0
+    for match in OBJECT_STREAM.finditer(data):
+        begin = max(0, match.start() - STREAM_DICT_BYTES)
+        stream = STREAM_START.search(data, match.end(), match.end() + STREAM_DICT_BYTES)
+        if stream is None or b"/FlateDecode" not in data[begin:stream.start()]:
+            continue
+        content = _inflate(data, stream.end())
+        if content:
+            pages += sum(1 for _ in PAGE_OBJECT.finditer(content))
+    return pages
+
+def count_pages(pdf_path):
+    """
+    Número de páginas del PDF contando sus objetos /Type /Page sobre el archivo proyectado con mmap (sin
+    cargarlo en memoria). Si no aparece ninguno, las páginas están en flujos de objetos comprimidos
+    (PDF 1.5+) y se cuentan dentro de ellos (_count_compressed_pages). Retorna 0 si tampoco se encuentran.
+    Se memoriza por (ruta, tamaño, mtime), como los hashes de tei_cache.
+    """
+    stat = os.stat(pdf_path)
+    signature = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if signature in _page_counts:
+            return _page_counts[signature]
+    pages = 0
+    if stat.st_size:
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pages = sum(1 for _ in PAGE_OBJECT.finditer(data)) or _count_compressed_pages(data)
+    with _lock:
+        _page_counts[signature] = pages
+    return pages
+
+def page_ranges(pdf_path):
+    """
+    Rangos (start, end) de páginas, numeradas desde 1 como en los parámetros de Grobid, en los que se divide
+    el PDF. Retorna [] si no procede dividirlo: división desactivada, PDF menor que GROBID_SPLIT_MIN_MB,
+    número de páginas desconocido o no mayor que GROBID_SPLIT_PAGES.
+    """
+    split_pages = get_split_pages()
+    if not split_pages or os.path.getsize(pdf_path) < get_split_min_bytes():
+        return []
+    pages = count_pages(pdf_path)
+    if not pages:
+        # page_ranges se consulta varias veces por PDF (clave de caché y petición): se informa una sola vez
+        with _lock:
+            warn = pdf_path not in _unsplittable
+            _unsplittable.add(pdf_path)
+        if warn:
+            print(f"No se pudo contar las páginas de {os.path.basename(pdf_path)}. Se envía entero a Grobid.")
+        return []
+    if pages <= split_pages:
+        return []
+    return [(start, min(pages, start + split_pages - 1)) for start in range(1, pages + 1, split_pages)]
+
+def key_options(pdf_path, options=None):
+    """
+    Opciones con las que se calcula la clave de caché del TEI: si el PDF se divide, se añade el tamaño de
+    fragmento, ya que el TEI combinado no es idéntico al de una única petición.
+    """
+    split_pages = get_split_pages() if page_ranges(pdf_path) else 0
+    if not split_pages:
+        return options
+    return dict(options or {}, splitPages=split_pages)
+
+def _prefix_ids(root, prefix):
+    """Añade prefix a los xml:id del fragmento y a las referencias '#id' que apuntan a ellos."""
+    ids = {}
+    for elem in root.iter():
+        old = elem.get(XML_ID)
+        if old is not None:
+            ids[old] = prefix + old
+            elem.set(XML_ID, ids[old])
+    for elem in root.iter():
+        for name, value in elem.attrib.items():
+            if name != XML_ID and "#" in value:
+                tokens = [f"#{ids[t[1:]]}" if t.startswith("#") and t[1:] in ids else t for t in value.split()]
+                elem.set(name, " ".join(tokens))
+
+def _child(parent, tag, **attrib):
+    """Primer hijo tag de parent con los atributos indicados; se crea si no existe."""
+    path = f"{TEI}{tag}" + "".join(f"[@{name}='{value}']" for name, value in attrib.items())
+    elem = parent.find(path)
+    if elem is None:
+        elem = ET.SubElement(parent, f"{TEI}{tag}", attrib)
+    return elem
+
+def merge_tei(chunks):
+    """
+    Combina los TEI de processFulltextDocument obtenidos por rangos de páginas en un único documento.
+    chunks es una lista de (start, tei_xml) en orden de páginas; los vacíos (204) se ignoran.
+    Se conservan la cabecera (teiHeader) y el resto del documento del primer fragmento; de los siguientes
+    se añaden, en orden, las secciones de <body>, las divisiones de <back> y las referencias bibliográficas
+    a la <listBibl> del primero. Los xml:id de cada fragmento se prefijan con 'p<start>_' (junto con
+    las referencias que los usan) para que no colisionen. Retorna "" si todos los fragmentos están vacíos.
+    """
+    chunks = [(start, tei_xml) for start, tei_xml in chunks if tei_xml]
+    if not chunks:
+        return ""
+    if len(chunks) == 1:
+        return chunks[0][1]
+    root = ET.fromstring(chunks[0][1].encode("utf-8"))
+    text = _child(root, "text")
+    body = _child(text, "body")
+    back = _child(text, "back")
+    references = _child(back, "div", type="references")
+    bibliography = _child(references, "listBibl")
+    for start, tei_xml in chunks[1:]:
+        chunk = ET.fromstring(tei_xml.encode("utf-8"))
+        _prefix_ids(chunk, f"p{start}_")
+        chunk_body = chunk.find(f"{TEI}text/{TEI}body")
+        if chunk_body is not None:
+            body.extend(list(chunk_body))
+        chunk_back = chunk.find(f"{TEI}text/{TEI}back")
+        if chunk_back is None:
+            continue
+        for div in chunk_back:
+            if div.tag == f"{TEI}div" and div.get("type") == "references":
+                for listbibl in div.iter(f"{TEI}listBibl"):
+                    bibliography.extend(list(listbibl))
+            else:
+                back.append(div)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding="unicode")
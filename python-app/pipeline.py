@@ -0,0 +1,410 @@
+import os
+import sys
+import time
+import queue
+import threading
+import multiprocessing
+from collections import namedtuple, deque, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+# Los gráficos se dibujan desde un hilo de trabajo: se fija el backend sin ventana antes de que se importe
+# matplotlib, que solo se carga cuando una etapa dibuja un gráfico o renderiza una nube
+os.environ.setdefault("MPLBACKEND", "Agg")
+import tester_inicial
+import tester_final
+import metadata_index
+import instrumentation
+import run_journal
+import grobid_backends
+from grobid_pool import get_concurrency, retry_when_busy
+from fulltext_extraction import get_fulltext_tei
+from links_in_pdf_generator import process_pdf_extract_links
+from keyword_cloud_generator import (CORPUS_KEYWORDS, get_render_options, get_render_workers, init_render_worker,
+                                     render_keyword_cloud, render_keyword_clouds, report_render,
+                                     ensure_term_counts_config, keyword_cloud_job)
+from figures_visualization_generator import generate_figures_summary
+
+# Ámbito de una etapa: una vez por PDF o una sola vez para todo el corpus
+DOCUMENT = "document"
+CORPUS = "corpus"
+
+# Estado final de cada tarea (etapa, documento)
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+Stage = namedtuple("Stage", ["name", "deps", "scope", "pool"])
+
+# Grafo de etapas. Cada PDF recorre las etapas de documento por su cuenta, de modo que la escritura de links y el
+# renderizado de unos documentos se solapan con las peticiones a Grobid de otros. Una etapa de corpus que
+# depende de una etapa de documento espera a que esta termine (bien o mal) en todos los PDFs.
+STAGES = (
+    Stage("tests", (), CORPUS, "corpus"),                           # Grobid disponible (tester_inicial)
+    Stage("fetch", ("tests",), DOCUMENT, "io"),                     # TEI completo e índice: caché o processFulltextDocument
+    Stage("links", ("fetch",), DOCUMENT, "cpu"),                    # links_in_pdf/links.txt (desde el índice)
+    Stage("cloud", ("fetch",), DOCUMENT, "render"),                 # keyword_cloud/keyword_cloud.png
+    Stage("chart", ("fetch",), CORPUS, "corpus"),                   # figures_in_articles.png (desde el índice)
+    Stage("corpus_cloud", ("cloud",), CORPUS, "corpus"),            # keyword_cloud_corpus.png (opcional)
+    Stage("verify", ("links", "chart", "corpus_cloud"), CORPUS, "corpus"),  # tester_final
+)
+
+# Etapas que se ejecutan con las opciones --fetch-only y --charts-only de cli.py
+FETCH_ONLY = ("tests", "fetch")
+CHARTS_ONLY = ("chart", "corpus_cloud")
+
+def skip_except(names, stages=STAGES):
+    """Nombres de las etapas que no están en names, para ejecutar solo una parte del grafo."""
+    return tuple(stage.name for stage in stages if stage.name not in names)
+
+def topological_order(stages):
+    """Ordena las etapas de modo que cada una aparezca después de sus dependencias."""
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, visited = [], set(), set()
+
+    def visit(stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Ciclo en el grafo de etapas: {stage.name}")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"La etapa {stage.name} depende de una etapa desconocida: {dep}")
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        visited.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+class Pipeline:
+    """
+    Ejecuta el grafo de etapas sobre los PDFs de pdf_folder en un solo proceso:
+      - 'io': peticiones a Grobid en un pool de hilos de GROBID_CONCURRENCY (con reintentos ante 503).
+      - 'cpu': escritura de links.txt en un pool de hilos pequeño.
+      - 'render': las nubes se renderizan en un pool de procesos (KEYWORD_CLOUD_WORKERS) a medida que
+        cada PDF tiene sus frecuencias, sin esperar al resto del corpus.
+      - 'corpus': las etapas de corpus, de una en una.
+    Un fallo (o una excepción) en una tarea solo cancela las etapas que dependen de ella para ese PDF.
+    Las etapas indicadas en skip no se ejecutan, pero no bloquean a las que dependen de ellas.
+    Si se indica journal (run_journal.Journal), el estado de cada tarea de documento se anota en el diario.
+    """
+    def __init__(self, pdf_folder, base_url, stages=STAGES, skip=(), journal=None):
+        self.pdf_folder = pdf_folder
+        self.base_url = base_url
+        self.stages = topological_order(stages)
+        self._by_name = {stage.name: stage for stage in self.stages}
+        self.skip = set(skip)
+        self.journal = journal
+        self.options = get_render_options()
+        self.config_changed = False
+        self.rendered = 0
+        # Documentos de PDFs borrados o renombrados eliminados del índice (prune): la nube del corpus cambia
+        self.pruned = 0
+        self.results = {}
+        self.render_pool = None
+        self._lock = threading.Lock()
+
+    # Etapas
+
+    def tests(self):
+        if not tester_inicial.wait_for_grobid():
+            return False
+        self.config_changed = ensure_term_counts_config(self.pdf_folder)
+        return True
+
+    def fetch(self, pdf_file):
+        tei_xml = retry_when_busy(lambda name: get_fulltext_tei(self.pdf_folder, name, self.base_url), pdf_file)
+        if tei_xml is None:
+            print(f"No se pudo obtener el TEI XML para {pdf_file}.")
+            return False
+        return True
+
+    def fetched_document(self, pdf_file):
+        """
+        Fila del índice que dejó la etapa fetch ('done' con el resumen, los links y las frecuencias del TEI, o
+        'no_content'). Las etapas links y cloud trabajan con ella en lugar de volver a leer y descomprimir el
+        TEI; retorna None si el documento no está indexado, y entonces se recurre al TEI.
+        """
+        document = metadata_index.get_document(self.pdf_folder, os.path.splitext(pdf_file)[0])
+        if document is None or document["status"] not in (metadata_index.STATUS_DONE, metadata_index.STATUS_NO_CONTENT):
+            return None
+        return document
+
+    def links(self, pdf_file):
+        process_pdf_extract_links(self.pdf_folder, pdf_file, self.base_url, self.fetched_document(pdf_file))
+        return True
+
+    def cloud(self, pdf_file):
+        document = self.fetched_document(pdf_file)
+        if document is not None and document["status"] == metadata_index.STATUS_NO_CONTENT:
+            print(f"Grobid no devolvió contenido para {pdf_file}. No se genera la keyword cloud.")
+            return True
+        job = keyword_cloud_job(self.pdf_folder, pdf_file, self.base_url, self.options, force=self.config_changed,
+                                document=document)
+        if job is None:
+            return True
+        return self._render(job)
+
+    def chart(self):
+        generate_figures_summary(self.pdf_folder, os.path.join(self.pdf_folder, "figures_in_articles.png"))
+        return True
+
+    def corpus_cloud(self):
+        corpus_file = os.path.join(self.pdf_folder, "keyword_cloud_corpus.png")
+        if not self.options["corpus"]:
+            return True
+        if not (self.rendered or self.config_changed or self.pruned or not os.path.exists(corpus_file)):
+            return True
+        keywords = dict(metadata_index.corpus_tfidf_keywords(self.pdf_folder, CORPUS_KEYWORDS))
+        if not keywords:
+            return True
+        return self._render(("corpus", keywords, corpus_file, None))
+
+    def prune(self, pdf_files=None):
+        """Elimina del índice los documentos cuyo PDF ya no está en la carpeta (metadata_index.prune_documents)."""
+        removed = metadata_index.prune_documents(self.pdf_folder, pdf_files)
+        if removed:
+            print(f"Se eliminaron del índice {removed} documentos cuyo PDF ya no está en la carpeta.")
+            with self._lock:
+                self.pruned += removed
+        return removed
+
+    def verify(self):
+        print(f"\n{'-' * 20} \n")
+        passed = tester_final.main()
+        print(f"{'-' * 20}\n")
+        return passed
+
+    def _render(self, job):
+        if self.render_pool is None:
+            # Sin pool de procesos (run_document): se renderiza en este proceso, de una nube en una
+            with self._lock:
+                ok = render_keyword_clouds([job], self.options, workers=1, pdf_folder=self.pdf_folder) == 1
+        else:
+            ok = report_render(self.render_pool.submit(render_keyword_cloud, job).result(), self.pdf_folder)
+        if ok:
+            with self._lock:
+                self.rendered += 1
+        return ok
+
+    def run_document(self, pdf_file):
+        """
+        Lleva un solo PDF por las etapas de documento en el hilo actual (lo usa el modo demonio).
+        Retorna True si todas terminaron bien.
+        """
+        results = {}
+        for stage in self.stages:
+            if stage.scope != DOCUMENT:
+                continue
+            if stage.name in self.skip:
+                results[stage.name] = SKIPPED
+            elif all(results.get(dep) == DONE or dep in self.skip for dep in stage.deps
+                     if self._by_name[dep].scope == DOCUMENT):
+                task, ok = self._call((stage.name, pdf_file))
+                results[stage.name] = DONE if ok else FAILED
+            else:
+                results[stage.name] = SKIPPED
+        return all(status == DONE for name, status in results.items() if name not in self.skip)
+
+    # Planificador
+
+    def _build_tasks(self, pdf_files):
+        """Crea las tareas (etapa, documento) con sus dependencias y las dependientes de cada una."""
+        deps = {}
+        dependents = {}
+        for stage in self.stages:
+            documents = pdf_files if stage.scope == DOCUMENT else [None]
+            for document in documents:
+                task = (stage.name, document)
+                deps[task] = []
+                for dep_name in stage.deps:
+                    dep_stage = self._by_name[dep_name]
+                    if dep_stage.scope == CORPUS:
+                        deps[task].append((dep_name, None))
+                    elif stage.scope == DOCUMENT:
+                        deps[task].append((dep_name, document))
+                    else:
+                        deps[task].extend((dep_name, d) for d in pdf_files)
+                for dep in deps[task]:
+                    dependents.setdefault(dep, []).append(task)
+        return deps, dependents
+
+    def _runnable(self, task, task_deps):
+        """
+        Una tarea se ejecuta si todas sus dependencias terminaron bien (o pertenecen a etapas omitidas a
+        propósito). Las etapas de corpus que dependen de una etapa de documento se ejecutan igualmente con
+        los PDFs que sí la completaron.
+        """
+        stage = self._by_name[task[0]]
+        for dep in task_deps:
+            if self.results[dep] == DONE or dep[0] in self.skip:
+                continue
+            if stage.scope == CORPUS and dep[1] is not None:
+                continue
+            return False
+        return True
+
+    def document_stages(self):
+        """Nombres de las etapas de documento que se ejecutan (las que anota el diario)."""
+        return [stage.name for stage in self.stages if stage.scope == DOCUMENT and stage.name not in self.skip]
+
+    def _call(self, task):
+        name, document = task
+        journaled = self.journal is not None and document is not None
+        if journaled:
+            self.journal.start(name, document)
+        start = time.perf_counter()
+        reason = None
+        try:
+            ok = getattr(self, name)() if document is None else getattr(self, name)(document)
+        except Exception as e:
+            label = f" para {document}" if document else ""
+            print(f"Excepción en la etapa {name}{label}: {e}")
+            reason = f"{type(e).__name__}: {e}"
+            instrumentation.record_error(name, document, reason)
+            ok = False
+        if journaled:
+            # Sin excepción, el motivo es el último error que la etapa registró para el documento
+            error = instrumentation.pop_last_error(document)
+            self.journal.finish(name, document, ok, reason or error)
+        # Duración de la tarea completa del pipeline (incluye las etapas medidas dentro de ella)
+        instrumentation.emit("task", stage=name, document=document, seconds=round(time.perf_counter() - start, 6),
+                             ok=bool(ok))
+        return task, ok
+
+    def run(self, pdf_files):
+        """Ejecuta todas las etapas sobre pdf_files. Retorna {(etapa, documento): estado}."""
+        deps, dependents = self._build_tasks(pdf_files)
+        if self.journal is not None:
+            self.journal.mark_pending(pdf_files, self.document_stages())
+        remaining = {task: len(task_deps) for task, task_deps in deps.items()}
+        self.results = {}
+        completed = queue.Queue()
+        render_workers = get_render_workers()
+        pools = {
+            "io": ThreadPoolExecutor(max_workers=get_concurrency()),
+            "cpu": ThreadPoolExecutor(max_workers=max(2, min(4, os.cpu_count() or 1))),
+            "render": ThreadPoolExecutor(max_workers=render_workers),
+            "corpus": ThreadPoolExecutor(max_workers=1),
+        }
+        # Los procesos de renderizado se crean con 'spawn': al haber hilos en marcha, un fork podría
+        # heredar locks tomados (conexiones HTTP, SQLite) por otros hilos.
+        render_pool = ProcessPoolExecutor(max_workers=render_workers, initializer=init_render_worker,
+                                          initargs=(self.options,),
+                                          mp_context=multiprocessing.get_context("spawn"))
+        self.render_pool = render_pool
+        running = 0
+
+        def settle(task, status):
+            # Marca el estado final de una tarea y libera (o cancela) las que dependían de ella
+            settled = [(task, status)]
+            while settled:
+                task, status = settled.pop()
+                self.results[task] = status
+                for dependent in dependents.get(task, ()):
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        if self._runnable(dependent, deps[dependent]):
+                            ready.append(dependent)
+                        else:
+                            settled.append((dependent, SKIPPED))
+
+        ready = deque(task for task, count in remaining.items() if count == 0)
+        try:
+            while ready or running:
+                while ready:
+                    task = ready.popleft()
+                    if task[0] in self.skip:
+                        settle(task, SKIPPED)
+                        continue
+                    future = pools[self._by_name[task[0]].pool].submit(self._call, task)
+                    future.add_done_callback(lambda f: completed.put(f.result()))
+                    running += 1
+                if running:
+                    task, ok = completed.get()
+                    running -= 1
+                    settle(task, DONE if ok else FAILED)
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+            render_pool.shutdown(wait=True)
+            self.render_pool = None
+        return self.results
+
+def report(results, elapsed, exhausted=()):
+    """
+    Imprime, por etapa, cuántas tareas terminaron bien, fallaron o se omitieron, y los PDFs con fallos
+    (incluidos los que la reanudación ya no reintenta, con el motivo de su último fallo).
+    """
+    print(f"{'-' * 20}")
+    print(f"Pipeline completado en {elapsed:.1f} s")
+    counts = {}
+    failed_documents = set()
+    for (name, document), status in results.items():
+        counts.setdefault(name, Counter())[status] += 1
+        if status == FAILED and document is not None:
+            failed_documents.add(document)
+    for stage in topological_order(STAGES):
+        if stage.name in counts:
+            c = counts[stage.name]
+            print(f"  {stage.name:<13} {c[DONE]:>5} correctas {c[FAILED]:>5} fallidas {c[SKIPPED]:>5} omitidas")
+    if failed_documents:
+        print("PDFs con errores: " + ", ".join(sorted(failed_documents)))
+    for document, reason in exhausted:
+        print(f"  Sin reintentos: {document} ({reason})")
+    print(f"{'-' * 20}")
+
+def plan_resume(journal, pdf_files, stage_names):
+    """
+    Reanudación (--resume o PIPELINE_RESUME=1): con el diario de ejecuciones anteriores, solo se vuelven a
+    procesar los PDFs sin terminar (interrumpidos, fallidos, nuevos o modificados); los que agotaron
+    PIPELINE_RETRY_BUDGET intentos se apartan. Las etapas de corpus se ejecutan igualmente con todo el índice.
+    Retorna (PDFs a procesar, [(PDF agotado, motivo del último fallo)]).
+    """
+    pending, finished, exhausted = journal.plan(pdf_files, stage_names)
+    print(f"Reanudación: {len(finished)} PDFs terminados se omiten, {len(pending)} por procesar y "
+          f"{len(exhausted)} sin reintentos (límite de {run_journal.get_retry_budget()} intentos).")
+    instrumentation.emit("resume", finished=len(finished), pending=len(pending), exhausted=len(exhausted))
+    return pending, [(document, journal.last_failure(document, stage_names)) for document in exhausted]
+
+def main(skip=(), resume=None):
+    """
+    Punto de entrada único del proceso: comprueba Grobid, obtiene el TEI de cada PDF, extrae los links,
+    genera las keyword clouds y el gráfico resumen y ejecuta los test finales, todo en un solo intérprete.
+    Las etapas de skip no se ejecutan (p. ej. skip_except(FETCH_ONLY)). El estado de cada tarea de documento
+    se anota en el diario (run_journal); con resume (por defecto PIPELINE_RESUME) solo se procesan los PDFs
+    que la ejecución anterior no terminó.
+    Retorna 0 si todas las etapas ejecutadas terminaron bien y 1 en caso contrario.
+    """
+    base_url = grobid_backends.get_base_url()
+    pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    pdf_files = sorted(f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf"))
+    if not pdf_files:
+        print(f"No se encontraron archivos PDF en el directorio {pdf_folder}.")
+    instrumentation.configure(pdf_folder)
+    start = time.perf_counter()
+    journal = run_journal.open_journal(pdf_folder)
+    pipeline = Pipeline(pdf_folder, base_url, skip=skip, journal=journal)
+    # Los PDFs borrados o renombrados salen del índice antes de las etapas de corpus (links y TF-IDF)
+    pipeline.prune(pdf_files)
+    exhausted = []
+    if resume is None:
+        resume = run_journal.resume_enabled()
+    if resume and journal is not None:
+        pdf_files, exhausted = plan_resume(journal, pdf_files, pipeline.document_stages())
+    try:
+        results = pipeline.run(pdf_files)
+    finally:
+        if journal is not None:
+            journal.close()
+    report(results, time.perf_counter() - start, exhausted)
+    instrumentation.finish()
+    if exhausted:
+        return 1
+    return 0 if all(status == DONE for (name, _), status in results.items() if name not in skip) else 1
+
+if __name__ == "__main__":
+    print("Ejecutando pipeline.py")
+    sys.exit(main())
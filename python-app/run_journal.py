@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import threading
+import atomic_files
+
+# Estados de una tarea (documento, etapa) en el diario
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+# Intentos fallidos tras los que --resume deja de reintentar un PDF (PIPELINE_RETRY_BUDGET)
+DEFAULT_RETRY_BUDGET = 3
+# El diario se compacta al abrirlo si tiene más de COMPACT_FACTOR líneas por tarea (y al menos COMPACT_MIN_LINES)
+COMPACT_FACTOR = 4
+COMPACT_MIN_LINES = 1000
+
+def get_journal_path(pdf_folder):
+    """Ruta del diario: PIPELINE_JOURNAL o, por defecto, <pdf_folder>/pipeline_journal.jsonl; 'off' lo desactiva."""
+    path = os.environ.get("PIPELINE_JOURNAL", os.path.join(pdf_folder, "pipeline_journal.jsonl"))
+    return None if path.lower() in ("0", "off", "false", "no") else path
+
+def get_retry_budget():
+    try:
+        return max(1, int(os.environ.get("PIPELINE_RETRY_BUDGET", DEFAULT_RETRY_BUDGET)))
+    except ValueError:
+        return DEFAULT_RETRY_BUDGET
+
+def resume_enabled():
+    """Indica si el pipeline reanuda la ejecución anterior por defecto (PIPELINE_RESUME=1)."""
+    return os.environ.get("PIPELINE_RESUME", "0").lower() in ("1", "true", "yes")
+
+def pdf_signature(pdf_folder, pdf_file):
+    """Tamaño y mtime del PDF, como en watch_daemon; si cambian, el historial anterior del PDF deja de valer."""
+    try:
+        stat = os.stat(os.path.join(pdf_folder, pdf_file))
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+class Journal:
+    """
+    Diario de solo anexión (JSON lines) con el estado de cada tarea (documento, etapa) del pipeline:
+    pending al planificarla, in_flight al empezar y done o failed (con el motivo) al terminar. Cada línea
+    lleva la firma del PDF y el número de intentos desde el último done, de modo que al releerlo:
+      - una tarea cuya última línea es in_flight se interrumpió (el proceso murió) y cuenta como intento fallido;
+      - un PDF está terminado si todas sus etapas están en done con la firma actual del PDF.
+    Cada línea se escribe completa con una sola llamada; una última línea truncada por una caída se ignora.
+    """
+    def __init__(self, path, pdf_folder):
+        self.path = path
+        self.pdf_folder = pdf_folder
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[(entry["document"], entry["stage"])] = entry
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        if lines >= COMPACT_MIN_LINES and lines > COMPACT_FACTOR * len(self.entries):
+            self.compact()
+
+    def compact(self):
+        """Reescribe el diario (de forma atómica) con solo la última línea de cada tarea."""
+        with self._lock:
+            self._close()
+            content = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.entries.values())
+            atomic_files.atomic_write(self.path, content)
+
+    def _append(self, entries):
+        # Llamado con self._lock tomado
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._file.flush()
+
+    def _entry(self, document, stage, state, signature, attempts, reason=None):
+        entry = {"ts": round(time.time(), 3), "document": document, "stage": stage, "state": state,
+                 "signature": signature, "attempts": attempts}
+        if reason:
+            entry["reason"] = reason
+        self.entries[(document, stage)] = entry
+        return entry
+
+    def _attempts(self, document, stage, signature):
+        """Intentos de la tarea desde su último done (0 si no hay historial o el PDF ha cambiado)."""
+        entry = self.entries.get((document, stage))
+        if entry is None or entry["state"] == DONE or entry.get("signature") != signature:
+            return 0
+        return entry.get("attempts", 0)
+
+    def mark_pending(self, documents, stages):
+        """Registra como pendientes, en una sola escritura, las etapas de documento que se van a ejecutar."""
+        with self._lock:
+            entries = []
+            for document in documents:
+                signature = pdf_signature(self.pdf_folder, document)
+                for stage in stages:
+                    attempts = self._attempts(document, stage, signature)
+                    entries.append(self._entry(document, stage, PENDING, signature, attempts))
+            if entries:
+                self._append(entries)
+
+    def start(self, stage, document):
+        with self._lock:
+            signature = pdf_signature(self.pdf_folder, document)
+            attempts = self._attempts(document, stage, signature) + 1
+            self._append([self._entry(document, stage, IN_FLIGHT, signature, attempts)])
+
+    def finish(self, stage, document, ok, reason=None):
+        with self._lock:
+            previous = self.entries.get((document, stage)) or {}
+            signature = pdf_signature(self.pdf_folder, document)
+            state = DONE if ok else FAILED
+            self._append([self._entry(document, stage, state, signature, previous.get("attempts", 1),
+                                      None if ok else reason or f"la etapa {stage} no terminó correctamente")])
+
+    def failures(self, document, stages, signature):
+        """Intentos fallidos (o interrumpidos) del PDF: el máximo entre sus etapas sin terminar."""
+        return max((self._attempts(document, stage, signature) for stage in stages), default=0)
+
+    def plan(self, pdf_files, stages, budget=None):
+        """
+        Reparte los PDFs para reanudar una ejecución. Retorna (pendientes, terminados, agotados):
+          - terminados: todas las etapas en done con la firma actual del PDF; no se vuelven a procesar.
+          - agotados: sin terminar tras budget intentos fallidos o interrumpidos (PIPELINE_RETRY_BUDGET).
+          - pendientes: el resto (nuevos, modificados, interrumpidos o fallidos con intentos disponibles).
+        """
+        budget = budget or get_retry_budget()
+        pending, finished, exhausted = [], [], []
+        with self._lock:
+            for pdf_file in pdf_files:
+                signature = pdf_signature(self.pdf_folder, pdf_file)
+                entries = [self.entries.get((pdf_file, stage)) for stage in stages]
+                if all(entry is not None and entry["state"] == DONE and entry.get("signature") == signature
+                       for entry in entries):
+                    finished.append(pdf_file)
+                elif self.failures(pdf_file, stages, signature) >= budget:
+                    exhausted.append(pdf_file)
+                else:
+                    pending.append(pdf_file)
+        return pending, finished, exhausted
+
+    def last_failure(self, document, stages):
+        """Motivo del último fallo registrado del PDF (o None)."""
+        for stage in stages:
+            entry = self.entries.get((document, stage))
+            if entry is not None and entry["state"] in (FAILED, IN_FLIGHT):
+                return entry.get("reason") or "ejecución interrumpida"
+        return None
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+def open_journal(pdf_folder):
+    """Abre el diario de pdf_folder, o retorna None si está desactivado (PIPELINE_JOURNAL=off)."""
+    path = get_journal_path(pdf_folder)
+    return Journal(path, pdf_folder) if path else None
@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import threading
+import grobid_backends
+import tei_storage
+import metadata_index
+from tester_inicial import get_grobid_version
+
+# Tamaño máximo de la caché en MB (configurable con TEI_CACHE_MAX_MB); al superarse se eliminan las entradas menos usadas
+DEFAULT_MAX_MB = 2048
+CHUNK_SIZE = 1024 * 1024
+# Nombres de las entradas de la caché, con cualquiera de las compresiones de tei_storage
+ENTRY_SUFFIXES = tuple(".tei.xml" + ext for ext in tei_storage.EXTENSIONS.values())
+
+_versions = {}
+_hashes = {}
+_key_locks = {}
+_sizes = {}
+_lock = threading.Lock()
+_version_lock = threading.Lock()
+
+def get_cache_dir(pdf_folder):
+    """Carpeta de la caché de TEI: TEI_CACHE_DIR o, por defecto, <pdf_folder>/.tei_cache."""
+    return os.environ.get("TEI_CACHE_DIR", os.path.join(pdf_folder, ".tei_cache"))
+
+def get_max_bytes():
+    try:
+        return int(float(os.environ.get("TEI_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_MAX_MB * 1024 * 1024
+
+def file_sha256(path):
+    """
+    Calcula el SHA-256 del contenido del archivo leyendo por bloques.
+    El resultado se memoriza por (ruta, tamaño, mtime) en memoria y en el índice SQLite de la carpeta del
+    archivo, de modo que un PDF sin cambios no se vuelve a leer ni en esta ejecución ni en las siguientes.
+    """
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if signature in _hashes:
+            return _hashes[signature]
+    folder = os.path.dirname(signature[0])
+    sha256 = metadata_index.get_file_hash(folder, signature[0], stat.st_size, stat.st_mtime_ns)
+    if sha256 is None:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        metadata_index.record_file_hash(folder, signature[0], stat.st_size, stat.st_mtime_ns, sha256)
+    with _lock:
+        _hashes[signature] = sha256
+    return sha256
+
+def grobid_version(base_url):
+    """
+    Versión de Grobid (memorizada por URL para todo el proceso). Si base_url no responde se consulta a los
+    demás backends sanos de GROBID_URLS, que deben ejecutar la misma versión. Si ninguno responde retorna None:
+    la versión nunca se sustituye por un valor provisional, que cambiaría todas las claves de la caché.
+    El fallo también se memoriza, para que con Grobid caído cada PDF no espere de nuevo el timeout de la
+    consulta; forget_failed_versions() permite volver a consultarla (p. ej. en cada exploración del demonio).
+    """
+    with _version_lock:
+        if base_url not in _versions:
+            version = None
+            for url in grobid_backends.candidate_urls(base_url):
+                try:
+                    version = get_grobid_version(url)
+                except Exception as e:
+                    print(f"No se pudo obtener la versión de Grobid de {url} para la caché: {e}")
+                if version is not None:
+                    break
+            _versions[base_url] = version
+        return _versions[base_url]
+
+def forget_failed_versions():
+    """Olvida las consultas de versión fallidas, para que la siguiente vuelva a preguntar a Grobid."""
+    with _version_lock:
+        for base_url in [url for url, version in _versions.items() if version is None]:
+            del _versions[base_url]
+
+def cache_key(pdf_path, base_url, endpoint, options=None):
+    """
+    Clave de la caché: SHA-256 de (hash del PDF, versión de Grobid, endpoint, opciones).
+    Un PDF renombrado o duplicado produce la misma clave; un PDF reemplazado, una distinta.
+    Retorna None si no se puede leer la versión de Grobid.
+    """
+    version = grobid_version(base_url)
+    if version is None:
+        return None
+    payload = json.dumps({
+        "pdf": file_sha256(pdf_path),
+        "grobid": version,
+        "endpoint": endpoint,
+        "options": options or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def key_lock(key):
+    """Lock por clave, para que dos PDFs idénticos procesados a la vez generen una sola petición a Grobid."""
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.tei.xml")
+
+def entry_path(cache_dir, key):
+    """Ruta en disco de la entrada de la clave (con la extensión de su compresión), o None si no está en la caché."""
+    path = tei_storage.locate(_entry_path(cache_dir, key))
+    return path if os.path.exists(path) else None
+
+def get(cache_dir, key):
+    """
+    Devuelve el TEI XML cacheado para la clave (comprimido o no) o None. Cada acierto actualiza el mtime
+    (orden LRU) de las entradas propias; las enlazadas desde la carpeta de un PDF no se tocan, ya que son el
+    mismo archivo que su TEI y no se expulsan.
+    """
+    path = tei_storage.locate(_entry_path(cache_dir, key))
+    try:
+        tei_xml = tei_storage.read_tei(path)
+        if os.stat(path).st_nlink == 1:
+            os.utime(path)
+        return tei_xml
+    except FileNotFoundError:
+        return None
+
+def put(cache_dir, key, tei_xml):
+    """
+    Guarda el TEI XML en la caché (escritura atómica, con la compresión de TEI_COMPRESSION) y aplica el
+    límite de tamaño, que se cuenta en bytes en disco. Retorna la ruta de la entrada.
+    """
+    path = _entry_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    path, data = tei_storage.write_tei(path, tei_xml)
+    # El tamaño total se calcula una vez por proceso y después se actualiza con cada escritura;
+    # solo se recorre la caché completa cuando se supera el límite.
+    with _lock:
+        if cache_dir not in _sizes:
+            _sizes[cache_dir] = cache_size(cache_dir)
+        else:
+            _sizes[cache_dir] += len(data)
+        over_limit = _sizes[cache_dir] > get_max_bytes()
+    if over_limit:
+        # La entrada recién escrita se conserva: a continuación se enlaza desde la carpeta del PDF
+        evict(cache_dir, keep=path)
+    return path
+
+def entry_paths(cache_dir):
+    """Rutas de las entradas de la caché (propias y enlazadas desde la carpeta de un PDF)."""
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(ENTRY_SUFFIXES):
+                yield os.path.join(root, name)
+
+def _own_entries(cache_dir):
+    """
+    (stat, ruta) de las entradas que solo existen en la caché (un único enlace). Las que comparten archivo
+    con el TEI de un PDF no ocupan espacio adicional: expulsarlas no liberaría disco y obligaría a volver a
+    enviar el PDF a Grobid si su TEI se pierde, así que no cuentan para el límite ni se expulsan.
+    """
+    for path in entry_paths(cache_dir):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink == 1:
+            yield stat, path
+
+def cache_size(cache_dir):
+    """Suma el tamaño en bytes de las entradas propias de la caché (las que cuentan para TEI_CACHE_MAX_MB)."""
+    return sum(stat.st_size for stat, _ in _own_entries(cache_dir))
+
+def evict(cache_dir, max_bytes=None, keep=None):
+    """
+    Elimina las entradas propias usadas hace más tiempo (mtime más antiguo) hasta quedar por debajo de
+    max_bytes. Las entradas enlazadas desde la carpeta de un PDF no cuentan ni se expulsan (_own_entries),
+    y tampoco la entrada keep.
+    """
+    max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for stat, path in _own_entries(cache_dir):
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    if total <= max_bytes:
+        with _lock:
+            _sizes[cache_dir] = total
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except FileNotFoundError:
+            pass
+    with _lock:
+        _sizes[cache_dir] = total
+    if removed:
+        print(f"Caché de TEI: se eliminaron {removed} entradas para no superar {max_bytes // (1024 * 1024)} MB.")
+    return removed
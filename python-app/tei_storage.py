@@ -0,0 +1,351 @@
+"""
+Almacenamiento compacto de los TEI: el TEI completo de cada PDF y las entradas de la caché se guardan
+comprimidos con gzip (por defecto) o zstd, y los lectores los descomprimen en streaming sin que el resto
+del código tenga que saber cómo se guardaron.
+
+Uso:
+    python tei_storage.py [report]     tamaño de los TEI guardados y bytes ahorrados
+    python tei_storage.py migrate      recomprime los TEI existentes y elimina los TEI parciales duplicados
+"""
+import os
+import sys
+import gzip
+import atomic_files
+
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+CODEC_NONE = "none"
+# Extensión que se añade al nombre del TEI según la compresión, en el orden en que se buscan al leer
+EXTENSIONS = {CODEC_ZSTD: ".zst", CODEC_GZIP: ".gz", CODEC_NONE: ""}
+DEFAULT_CODEC = CODEC_GZIP
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Números mágicos con los que se reconoce la compresión al leer, sea cual sea la extensión
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Razón de compresión máxima de deflate: un ISIZE mayor que el tamaño en disco por esta razón es de un gzip truncado
+DEFLATE_MAX_RATIO = 1032
+# TEI parciales de versiones anteriores (cabecera y referencias), cuyo contenido ya está en el TEI completo
+LEGACY_TEI = (os.path.join("keyword_cloud", "tei.xml"), os.path.join("links_in_pdf", "tei.xml"))
+
+_warned = set()
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def get_codec():
+    """
+    Compresión de los TEI nuevos (TEI_COMPRESSION): 'gzip' (por defecto), 'zstd' o 'none'.
+    zstd requiere el paquete opcional zstandard; si no está instalado se usa gzip.
+    """
+    codec = os.environ.get("TEI_COMPRESSION", DEFAULT_CODEC).lower()
+    if codec not in EXTENSIONS:
+        return DEFAULT_CODEC
+    if codec == CODEC_ZSTD and _zstandard() is None:
+        if codec not in _warned:
+            _warned.add(codec)
+            print("TEI_COMPRESSION=zstd requiere el paquete zstandard (pip install zstandard). Se usa gzip.")
+        return CODEC_GZIP
+    return codec
+
+def base_path(path):
+    """Ruta del TEI sin la extensión de compresión (p. ej. .../tei.xml para .../tei.xml.gz)."""
+    for ext in EXTENSIONS.values():
+        if ext and path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+def locate(path):
+    """
+    Ruta en disco del TEI path (con o sin extensión de compresión): la de la variante que exista o, si no
+    hay ninguna, la que tendrá con la compresión configurada.
+    """
+    path = base_path(path)
+    for ext in EXTENSIONS.values():
+        if os.path.exists(path + ext):
+            return path + ext
+    return path + EXTENSIONS[get_codec()]
+
+def compress(data, codec=None):
+    codec = codec or get_codec()
+    if codec == CODEC_GZIP:
+        # mtime=0: el mismo TEI produce siempre los mismos bytes (y el mismo checksum en el manifiesto)
+        return gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if codec == CODEC_ZSTD:
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+def _magic(path):
+    with open(path, "rb") as f:
+        return f.read(4)
+
+def open_tei(path):
+    """
+    Abre el TEI en modo binario con descompresión transparente en streaming, reconociendo el formato por
+    sus primeros bytes. El resultado se puede pasar directamente a iterparse.
+    """
+    magic = _magic(path)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rb")
+    if magic.startswith(ZSTD_MAGIC):
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError(f"{path} está comprimido con zstd y el paquete zstandard no está instalado")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+def read_tei(path):
+    """TEI XML (cadena) guardado en path, comprimido o no."""
+    with open_tei(path) as f:
+        return f.read().decode("utf-8")
+
+def write_tei(path, tei_xml, codec=None):
+    """
+    Guarda el TEI con la compresión indicada (por defecto TEI_COMPRESSION), de forma atómica, y elimina las
+    variantes con otra compresión para que quede un único documento. Retorna (ruta escrita, bytes escritos).
+    """
+    codec = codec or get_codec()
+    path = base_path(path)
+    target = path + EXTENSIONS[codec]
+    data = atomic_files.atomic_write(target, compress(tei_xml.encode("utf-8"), codec))
+    _remove_variants(path, target)
+    return target, data
+
+def link_tei(source, path):
+    """
+    Guarda en path el TEI ya guardado en source (p. ej. la entrada de la caché) como un enlace duro, de modo
+    que ambas rutas comparten un único archivo en disco, con la compresión de source. Si no se puede enlazar
+    (otro sistema de archivos o uno sin enlaces duros), se copia. El reemplazo es atómico y se eliminan las
+    variantes con otra compresión. Retorna (ruta escrita, bytes del archivo).
+    """
+    with open(source, "rb") as f:
+        data = f.read()
+    path = base_path(path)
+    target = path + source[len(base_path(source)):]
+    if not (os.path.exists(target) and os.path.samefile(source, target)):
+        try:
+            with atomic_files.atomic_path(target) as tmp_path:
+                os.link(source, tmp_path)
+        except OSError:
+            atomic_files.atomic_write(target, data)
+    _remove_variants(path, target)
+    return target, data
+
+def _remove_variants(path, target):
+    """Elimina las variantes de path con otra compresión que target, para que quede un único documento."""
+    for ext in EXTENSIONS.values():
+        if path + ext != target:
+            try:
+                os.remove(path + ext)
+            except FileNotFoundError:
+                pass
+
+def uncompressed_size(path):
+    """
+    Tamaño sin comprimir del TEI. En gzip se lee del final del archivo (ISIZE) y en zstd de la cabecera
+    de la trama, sin descomprimir; si la trama no lo indica, o el ISIZE es imposible porque el gzip está
+    truncado, se descomprime en streaming para contar lo que se pueda leer.
+    """
+    magic = _magic(path)
+    if magic.startswith(GZIP_MAGIC):
+        with open(path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            size = int.from_bytes(f.read(4), "little")
+        if size <= DEFLATE_MAX_RATIO * os.path.getsize(path):
+            return size
+        return _streamed_size(path)
+    if magic.startswith(ZSTD_MAGIC) and _zstandard() is not None:
+        with open(path, "rb") as f:
+            size = _zstandard().frame_content_size(f.read(18))
+        if size >= 0:
+            return size
+        return _streamed_size(path)
+    return os.path.getsize(path)
+
+def _streamed_size(path):
+    """Bytes que se obtienen al descomprimir el TEI en streaming, hasta el final o hasta donde esté truncado."""
+    size = 0
+    try:
+        with open_tei(path) as f:
+            # Bloques pequeños: en un archivo truncado se cuentan los que se leen antes del error
+            for block in iter(lambda: f.read(16 * 1024), b""):
+                size += len(block)
+    except (OSError, EOFError, ValueError):
+        pass
+    return size
+
+def _tei_files(pdf_folder):
+    """
+    Recorre los TEI guardados: (categoría, ruta, PDF o None). Categorías: 'tei' (TEI completo de cada PDF),
+    'duplicados' (TEI parciales de versiones anteriores) y 'caché' (entradas de tei_cache).
+    """
+    from fulltext_extraction import fulltext_tei_path
+    import tei_cache
+    pdf_files = sorted(f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf"))
+    for pdf_file in pdf_files:
+        tei_path = fulltext_tei_path(pdf_folder, pdf_file)
+        if os.path.exists(tei_path):
+            yield "tei", tei_path, pdf_file
+        folder = os.path.join(pdf_folder, os.path.splitext(pdf_file)[0])
+        for legacy in LEGACY_TEI:
+            path = os.path.join(folder, legacy)
+            if os.path.exists(path):
+                yield "duplicados", path, pdf_file
+    for path in tei_cache.entry_paths(tei_cache.get_cache_dir(pdf_folder)):
+        yield "caché", path, None
+
+def _cache_entry(pdf_folder, tei_path):
+    """
+    Entrada de la caché con la misma clave (tei.key) que el TEI de un PDF, si existe y no es el mismo archivo
+    (una copia que migrate puede sustituir por un enlace duro). Retorna None en otro caso.
+    """
+    import tei_cache
+    from fulltext_extraction import fulltext_key_path
+    try:
+        with open(fulltext_key_path(tei_path), "r", encoding="utf-8") as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        return None
+    entry = tei_cache.entry_path(tei_cache.get_cache_dir(pdf_folder), key) if key else None
+    if entry is None or os.path.samefile(entry, tei_path):
+        return None
+    return entry
+
+def _print_report(title, totals):
+    print(title)
+    before_total = after_total = 0
+    for category, (files, before, after) in totals.items():
+        before_total += before
+        after_total += after
+        print(f"  {category:<11} {files:>6} archivos {before / 1e6:>10.1f} MB -> {after / 1e6:>10.1f} MB")
+    saved = before_total - after_total
+    share = 100 * saved / before_total if before_total else 0
+    print(f"Total: {before_total / 1e6:.1f} MB -> {after_total / 1e6:.1f} MB ({saved / 1e6:.1f} MB ahorrados, {share:.0f} %).")
+
+def _read_or_empty(path):
+    """TEI guardado en path, o "" si no se puede leer (p. ej. un gzip truncado)."""
+    try:
+        return read_tei(path)
+    except (OSError, EOFError, ValueError, RuntimeError):
+        return ""
+
+def _fulltext_complete(pdf_folder, pdf_file, checked):
+    """
+    Indica si el PDF tiene su TEI completo y se puede leer entero, condición para eliminar sus TEI parciales.
+    checked memoriza el resultado por PDF, que tiene hasta dos parciales.
+    """
+    from fulltext_extraction import fulltext_tei_path, tei_is_complete
+    if pdf_file not in checked:
+        fulltext = fulltext_tei_path(pdf_folder, pdf_file)
+        checked[pdf_file] = os.path.exists(fulltext) and tei_is_complete(_read_or_empty(fulltext))
+    return checked[pdf_file]
+
+def report(pdf_folder):
+    """
+    Informe del almacenamiento actual: por categoría, el tamaño que ocuparían los TEI sin comprimir, el que
+    ocupan en disco (un archivo con varios enlaces duros, como el TEI de un PDF y su entrada de la caché, se
+    cuenta una sola vez en ambas columnas), los bytes ahorrados y los que migrate puede liberar: los TEI
+    parciales duplicados y los TEI de PDFs que son una copia aparte de su entrada de la caché.
+    Retorna {categoría: [archivos, bytes sin comprimir, bytes en disco, bytes recuperables]}.
+    """
+    totals = {}
+    seen = set()
+    complete = {}
+    for category, path, pdf_file in _tei_files(pdf_folder):
+        stat = os.stat(path)
+        first = (stat.st_dev, stat.st_ino) not in seen
+        seen.add((stat.st_dev, stat.st_ino))
+        on_disk = stat.st_size if first else 0
+        if category == "duplicados":
+            reclaimable = on_disk if _fulltext_complete(pdf_folder, pdf_file, complete) else 0
+        elif category == "tei" and _cache_entry(pdf_folder, path) is not None:
+            reclaimable = on_disk
+        else:
+            reclaimable = 0
+        entry = totals.setdefault(category, [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] += uncompressed_size(path) if first else 0
+        entry[2] += on_disk
+        entry[3] += reclaimable
+    print(f"Almacenamiento de TEI en {pdf_folder}:")
+    print(f"  {'':<11} {'':>15} {'sin comprimir':>13} {'en disco':>13} {'recuperables':>13}")
+    for category, (files, uncompressed, on_disk, reclaimable) in totals.items():
+        print(f"  {category:<11} {files:>6} archivos {uncompressed / 1e6:>10.1f} MB {on_disk / 1e6:>10.1f} MB "
+              f"{reclaimable / 1e6:>10.1f} MB")
+    uncompressed, on_disk, reclaimable = (sum(entry[i] for entry in totals.values()) for i in (1, 2, 3))
+    saved = uncompressed - on_disk
+    share = 100 * saved / uncompressed if uncompressed else 0
+    print(f"Total: {uncompressed / 1e6:.1f} MB sin comprimir, {on_disk / 1e6:.1f} MB en disco "
+          f"({saved / 1e6:.1f} MB ahorrados, {share:.0f} %), {reclaimable / 1e6:.1f} MB recuperables con 'migrate'.")
+    return totals
+
+def migrate(pdf_folder, codec=None):
+    """
+    Migra un árbol de carpetas existente al almacenamiento compacto:
+      - las entradas de la caché y el TEI completo de cada PDF se reescriben con la compresión indicada
+        (por defecto TEI_COMPRESSION) y la entrada del TEI en el manifiesto se actualiza;
+      - el TEI de un PDF que tiene entrada en la caché (misma tei.key) se sustituye por un enlace duro a
+        ella, de modo que cada TEI ocupa un único archivo en disco;
+      - los TEI parciales de versiones anteriores (keyword_cloud/tei.xml y links_in_pdf/tei.xml) se eliminan
+        si el PDF ya tiene su TEI completo y se puede leer entero, ya que contiene la misma cabecera y
+        referencias; si está truncado, los parciales se conservan.
+    Cada archivo se reescribe de forma atómica y los que no se pueden leer (p. ej. truncados) se dejan como
+    están. Retorna {categoría: [archivos, bytes antes, bytes después]}.
+    """
+    import metadata_index
+    from fulltext_extraction import tei_is_complete
+    codec = codec or get_codec()
+    totals = {}
+    skipped = []
+    complete = {}
+    # La caché primero: los TEI de los PDFs se enlazan después a sus entradas ya migradas
+    for category, path, pdf_file in sorted(_tei_files(pdf_folder), key=lambda item: item[0] != "caché"):
+        before = os.path.getsize(path)
+        after = before
+        cache_entry = _cache_entry(pdf_folder, path) if category == "tei" else None
+        if category == "duplicados":
+            if not _fulltext_complete(pdf_folder, pdf_file, complete):
+                skipped.append(path)
+                continue
+            os.remove(path)
+            after = 0
+        elif cache_entry is not None:
+            path, data = link_tei(cache_entry, path)
+            after = 0 if os.path.samefile(cache_entry, path) else len(data)
+            metadata_index.record_artifact(pdf_folder, pdf_file, metadata_index.ARTIFACT_TEI, path, data)
+        elif path != base_path(path) + EXTENSIONS[codec]:
+            tei_xml = _read_or_empty(path)
+            if not tei_is_complete(tei_xml):
+                skipped.append(path)
+                continue
+            path, data = write_tei(path, tei_xml, codec)
+            after = len(data)
+            if category == "tei":
+                metadata_index.record_artifact(pdf_folder, pdf_file, metadata_index.ARTIFACT_TEI, path, data)
+        entry = totals.setdefault(category, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += before
+        entry[2] += after
+    _print_report(f"Migración de los TEI de {pdf_folder} a '{codec}' (antes -> después):", totals)
+    for path in skipped:
+        print(f"  No se pudo leer {path} (o el TEI completo del que es duplicado); se deja como está.")
+    return totals
+
+def main():
+    pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "migrate":
+        migrate(pdf_folder)
+    elif command == "report":
+        report(pdf_folder)
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
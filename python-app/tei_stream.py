@@ -0,0 +1,96 @@
+import io
+import xml.etree.ElementTree as ET
+import tei_storage
+
+TEI = "{http://www.tei-c.org/ns/1.0}"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+def empty_summary():
+    return {"figures": 0, "tables": 0, "abstract": None, "links": [], "references": []}
+
+def _text(elem):
+    return " ".join("".join(elem.itertext()).split())
+
+def _reference(bibl):
+    """Resume un <biblStruct>: identificador, título, DOI y targets http."""
+    title = None
+    for tag in ("analytic", "monogr"):
+        title_elem = bibl.find(f"{TEI}{tag}/{TEI}title")
+        if title_elem is not None:
+            title = _text(title_elem) or None
+            break
+    doi_elem = bibl.find(f".//{TEI}idno[@type='DOI']")
+    targets = sorted({e.get("target") for e in bibl.iter() if e.get("target", "").startswith("http")})
+    return {
+        "id": bibl.get(XML_ID),
+        "title": title,
+        "doi": doi_elem.text.strip() if doi_elem is not None and doi_elem.text else None,
+        "targets": targets,
+    }
+
+def extract_tei_summary(source):
+    """
+    Recorre el TEI XML una sola vez con iterparse y devuelve un diccionario con:
+      - figures: número de elementos <figure> (incluidas las tablas, como el conteo original)
+      - tables: número de <figure type="table">
+      - abstract: texto del abstract o None
+      - links: links 'http' de las referencias (<listBibl>), sin duplicados y ordenados
+      - references: lista de referencias (id, title, doi, targets)
+    source puede ser una ruta (de un TEI comprimido o no; se descomprime en streaming con tei_storage) o un
+    archivo abierto en modo binario. Cada elemento se elimina del árbol en cuanto se ha procesado, de modo que
+    la memoria no crece con el tamaño del documento.
+    """
+    if isinstance(source, str):
+        with tei_storage.open_tei(source) as f:
+            return extract_tei_summary(f)
+    summary = empty_summary()
+    links = set()
+    stack = []
+    in_list_bibl = 0
+    capturing = 0
+    try:
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                stack.append(elem)
+                if tag == f"{TEI}listBibl":
+                    in_list_bibl += 1
+                elif tag in (f"{TEI}abstract", f"{TEI}biblStruct"):
+                    capturing += 1
+                continue
+
+            stack.pop()
+            if tag == f"{TEI}figure":
+                summary["figures"] += 1
+                if elem.get("type") == "table":
+                    summary["tables"] += 1
+            elif tag == f"{TEI}abstract":
+                capturing -= 1
+                if summary["abstract"] is None:
+                    summary["abstract"] = _text(elem) or None
+            elif tag == f"{TEI}biblStruct":
+                capturing -= 1
+                if in_list_bibl:
+                    summary["references"].append(_reference(elem))
+            elif tag == f"{TEI}listBibl":
+                in_list_bibl -= 1
+            if in_list_bibl:
+                target = elem.get("target", "")
+                if target.startswith("http"):
+                    links.add(target)
+
+            # Mientras se está dentro de un <abstract> o <biblStruct> se conservan sus hijos hasta procesarlo;
+            # en otro caso el elemento (que siempre es el último hijo de su padre) se elimina del árbol.
+            if not capturing:
+                elem.clear()
+                if stack:
+                    del stack[-1][-1]
+    except ET.ParseError as e:
+        print("Error al parsear el TEI XML:", e)
+        return empty_summary()
+    summary["links"] = sorted(links)
+    return summary
+
+def summarize_tei_string(tei_xml):
+    """Igual que extract_tei_summary, para un TEI XML ya cargado como cadena."""
+    return extract_tei_summary(io.BytesIO(tei_xml.encode("utf-8")))
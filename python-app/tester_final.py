@@ -1,125 +1,201 @@
 import os
 import sys
+import hashlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import metadata_index
+import tei_storage
 
-def test_folder_per_pdf(pdf_folder):
+# Artefactos esperados por PDF: (tipo en el manifiesto, subcarpeta, archivo si no figura en el manifiesto)
+DOCUMENT_ARTIFACTS = (
+    (metadata_index.ARTIFACT_KEYWORD_CLOUD, "keyword_cloud", "keyword_cloud.png"),
+    (metadata_index.ARTIFACT_TEI, "pdf_full_text_document", "tei.xml"),
+    (metadata_index.ARTIFACT_LINKS, "links_in_pdf", "links.txt"),
+)
+DEFAULT_WORKERS = 16
+
+def deep_enabled():
+    """Validación profunda (TESTER_DEEP=1 o --deep): checksum, TEI bien formado y PNG decodificable."""
+    return "--deep" in sys.argv or os.environ.get("TESTER_DEEP", "0").lower() in ("1", "true", "yes")
+
+def get_workers():
+    try:
+        return max(1, int(os.environ.get("TESTER_WORKERS", DEFAULT_WORKERS)))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+def scan_folder(pdf_folder):
+    """Una sola exploración de pdf_folder: (PDFs ordenados, nombres de las subcarpetas, nombres de los archivos)."""
+    pdf_files, folders, files = [], set(), set()
+    with os.scandir(pdf_folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                folders.add(entry.name)
+            else:
+                files.add(entry.name)
+                if entry.name.lower().endswith(".pdf"):
+                    pdf_files.append(entry.name)
+    return sorted(pdf_files), folders, files
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _well_formed_xml(path):
+    with tei_storage.open_tei(path) as f:
+        for _, elem in ET.iterparse(f):
+            elem.clear()
+
+def _decodes_png(path):
+    from PIL import Image
+    with Image.open(path) as image:
+        image.load()
+
+def check_artifact(path, expected=None, deep=False):
     """
-    Comprueba que para cada archivo PDF en pdf_folder exista una carpeta con su nombre base.
+    Comprueba un artefacto con una sola llamada a stat: que exista y, si está en el manifiesto, que su tamaño
+    coincida con el registrado por el productor (un archivo truncado no pasa); sin manifiesto, que no esté vacío.
+    En modo profundo se recalcula además el checksum y se valida el contenido (XML bien formado o PNG decodificable).
+    Retorna None si es correcto o el motivo del fallo.
     """
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
-    all_ok = True
-    for pdf in pdf_files:
-        base_name = os.path.splitext(pdf)[0]
-        folder_path = os.path.join(pdf_folder, base_name)
-        if not os.path.isdir(folder_path):
-            print(f"Test 1 FAILED: La carpeta '{folder_path}' no existe para el PDF '{pdf}'.")
-            all_ok = False
-        # else:
-            # print(f"Test 1 PASSED: La carpeta '{folder_path}' existe para el PDF '{pdf}'.")
-    if all_ok:
-        print(f"Test 1 PASSED: Se han generado las carpetas correspondientes para todos los pdfs correctamente.")
-    return all_ok
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return "no se encontró"
+    if expected is not None and size != expected["size"]:
+        return f"tamaño {size} bytes, el manifiesto registra {expected['size']}"
+    if expected is None and size == 0:
+        return "está vacío"
+    if deep:
+        try:
+            if expected is not None and _sha256(path) != expected["sha256"]:
+                return "el checksum no coincide con el manifiesto"
+            if tei_storage.base_path(path).endswith(".xml"):
+                _well_formed_xml(path)
+            elif path.endswith(".png"):
+                _decodes_png(path)
+        except Exception as e:
+            return f"contenido no válido ({type(e).__name__}: {e})"
+    return None
 
-def test_keyword_cloud_folder(pdf_folder):
+def verify_artifacts(pdf_folder, pdf_files, folders, deep=False):
     """
-    Comprueba que en cada carpeta de PDF exista una subcarpeta 'keyword_cloud' 
-    que contenga los archivos 'keyword_cloud.png' y 'tei.xml'.
+    Comprueba en paralelo los artefactos esperados de cada PDF (cuya carpeta existe) y el gráfico resumen,
+    usando el manifiesto del índice. Retorna {(base_name, tipo): (ruta, motivo del fallo o None)}.
     """
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
-    all_ok = True
+    manifest = metadata_index.get_artifacts(pdf_folder)
+    checks = []
     for pdf in pdf_files:
         base_name = os.path.splitext(pdf)[0]
-        folder_path = os.path.join(pdf_folder, base_name, "keyword_cloud")
-        if not os.path.isdir(folder_path):
-            print(f"Test 2 FAILED: La carpeta 'keyword_cloud' no existe en '{os.path.join(pdf_folder, base_name)}'.")
-            all_ok = False
+        if base_name not in folders:
             continue
-        kw_image = os.path.join(folder_path, "keyword_cloud.png")
-        tei_file = os.path.join(folder_path, "tei.xml")
-        if not os.path.isfile(kw_image):
-            print(f"Test 2 FAILED: El archivo 'keyword_cloud.png' no se encontró en '{folder_path}'.")
-            all_ok = False
-        # else:
-            # print(f"Test 2 PASSED: 'keyword_cloud.png' existe en '{folder_path}'.")
-        if not os.path.isfile(tei_file):
-            print(f"Test 2 FAILED: El archivo 'tei.xml' no se encontró en '{folder_path}'.")
-            all_ok = False
-        # else:
-            # print(f"Test 2 PASSED: 'tei.xml' existe en '{folder_path}'.")
-    if all_ok:
-        print(f"Test 2 PASSED: Se han generado los keyword cloud para todos los pdfs correctamente.")
-    return all_ok
+        for kind, subfolder, filename in DOCUMENT_ARTIFACTS:
+            expected = manifest.get((base_name, kind))
+            path = os.path.join(pdf_folder, expected["path"]) if expected else \
+                os.path.join(pdf_folder, base_name, subfolder, filename)
+            if kind == metadata_index.ARTIFACT_TEI and not expected:
+                # Sin manifiesto, el TEI puede estar comprimido (tei.xml.gz o tei.xml.zst)
+                path = tei_storage.locate(path)
+            checks.append(((base_name, kind), path, expected))
+    expected = manifest.get(("", metadata_index.ARTIFACT_FIGURES_SUMMARY))
+    checks.append((("", metadata_index.ARTIFACT_FIGURES_SUMMARY),
+                   os.path.join(pdf_folder, "figures_in_articles.png"), expected))
+
+    with ThreadPoolExecutor(max_workers=get_workers()) as executor:
+        reasons = executor.map(lambda check: check_artifact(check[1], check[2], deep), checks)
+        return {key: (path, reason) for (key, path, _), reason in zip(checks, reasons)}
 
-def test_pdf_full_text_document_folder(pdf_folder):
+def test_folder_per_pdf(pdf_folder, pdf_files, folders):
     """
-    Comprueba que en cada carpeta de PDF exista una subcarpeta 'pdf_full_text_document'
-    que contenga el archivo 'tei.xml'.
+    Comprueba que para cada archivo PDF en pdf_folder exista una carpeta con su nombre base.
     """
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
     all_ok = True
     for pdf in pdf_files:
         base_name = os.path.splitext(pdf)[0]
-        folder_path = os.path.join(pdf_folder, base_name, "pdf_full_text_document")
-        if not os.path.isdir(folder_path):
-            print(f"Test 3 FAILED: La carpeta 'pdf_full_text_document' no existe en '{os.path.join(pdf_folder, base_name)}'.")
-            all_ok = False
-            continue
-        tei_file = os.path.join(folder_path, "tei.xml")
-        if not os.path.isfile(tei_file):
-            print(f"Test 3 FAILED: El archivo 'tei.xml' no se encontró en '{folder_path}'.")
+        if base_name not in folders:
+            print(f"Test 1 FAILED: La carpeta '{os.path.join(pdf_folder, base_name)}' no existe para el PDF '{pdf}'.")
             all_ok = False
-        # else:
-            # print(f"Test 3 PASSED: 'tei.xml' existe en '{folder_path}'.")
     if all_ok:
-        print(f"Test 3 PASSED: Se han generado los pdf_full_documents para todos los pdfs correctamente.")
+        print("Test 1 PASSED: Se han generado las carpetas correspondientes para todos los pdfs correctamente.")
     return all_ok
 
-def test_links_in_pdf_folder(pdf_folder):
+def test_document_artifacts(pdf_folder, pdf_files, folders, results, kind, number, passed_message):
     """
-    Comprueba que en cada carpeta de PDF exista una subcarpeta 'links_in_pdf'
-    que contenga el archivo 'links.txt'.
+    Comprueba, con los resultados de verify_artifacts, el artefacto 'kind' de cada PDF (Tests 2, 3 y 4).
     """
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith(".pdf")]
     all_ok = True
     for pdf in pdf_files:
         base_name = os.path.splitext(pdf)[0]
-        folder_path = os.path.join(pdf_folder, base_name, "links_in_pdf")
-        if not os.path.isdir(folder_path):
-            print(f"Test 4 FAILED: La carpeta 'links_in_pdf' no existe en '{os.path.join(pdf_folder, base_name)}'.")
+        if base_name not in folders:
+            print(f"Test {number} FAILED: No existe la carpeta '{os.path.join(pdf_folder, base_name)}'.")
             all_ok = False
             continue
-        links_file = os.path.join(folder_path, "links.txt")
-        if not os.path.isfile(links_file):
-            print(f"Test 4 FAILED: El archivo 'links.txt' no se encontró en '{folder_path}'.")
+        path, reason = results[(base_name, kind)]
+        if reason:
+            print(f"Test {number} FAILED: El archivo '{os.path.basename(path)}' de '{pdf}' "
+                  f"('{os.path.dirname(path)}'): {reason}.")
             all_ok = False
-        # else:
-            # print(f"Test 4 PASSED: 'links.txt' existe en '{folder_path}'.")
-    
     if all_ok:
-        print(f"Test 4 PASSED: Se han generado los links para todos los pdfs correctamente.")
+        print(f"Test {number} PASSED: {passed_message}")
     return all_ok
 
-def test_figures_in_articles(pdf_folder):
+def test_figures_in_articles(pdf_folder, results):
     """
     Comprueba que en la carpeta general de PDFs exista el archivo 'figures_in_articles.png'.
     """
-    file_path = os.path.join(pdf_folder, "figures_in_articles.png")
-    if os.path.isfile(file_path):
+    _, reason = results[("", metadata_index.ARTIFACT_FIGURES_SUMMARY)]
+    if reason is None:
         print(f"Test 5 PASSED: 'figures_in_articles.png' existe en '{pdf_folder}'.")
         return True
     else:
-        print(f"Test 5 FAILED: 'figures_in_articles.png' no se encontró en '{pdf_folder}'.")
+        print(f"Test 5 FAILED: 'figures_in_articles.png' en '{pdf_folder}': {reason}.")
         return False
 
+def test_metadata_index(pdf_folder, pdf_files):
+    """
+    Comprueba con una sola consulta al índice SQLite que cada PDF tenga su documento registrado
+    con estado 'done' (TEI obtenido y metadatos extraídos).
+    """
+    documents = metadata_index.get_documents(pdf_folder)
+    all_ok = True
+    for pdf in pdf_files:
+        base_name = os.path.splitext(pdf)[0]
+        document = documents.get(base_name)
+        if document is None:
+            print(f"Test 6 FAILED: El PDF '{pdf}' no está registrado en el índice de metadatos.")
+            all_ok = False
+        elif document["status"] != metadata_index.STATUS_DONE:
+            reason = f" ({document['error']})" if document["error"] else ""
+            print(f"Test 6 FAILED: El PDF '{pdf}' tiene estado '{document['status']}' en el índice{reason}.")
+            all_ok = False
+    if all_ok:
+        print("Test 6 PASSED: Todos los pdfs están registrados correctamente en el índice de metadatos.")
+    return all_ok
+
 def main():
+    """
+    Verificación final: se explora pdf_folder una sola vez y los artefactos de cada PDF se comprueban en paralelo
+    (TESTER_WORKERS hilos) contra el manifiesto de tamaños y checksums que registran los generadores.
+    """
     pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
-    print("Ejecutando tester_final.py...\n")
-    result1 = test_folder_per_pdf(pdf_folder)
-    result2 = test_keyword_cloud_folder(pdf_folder)
-    result3 = test_pdf_full_text_document_folder(pdf_folder)
-    result4 = test_links_in_pdf_folder(pdf_folder)
-    result5 = test_figures_in_articles(pdf_folder)
+    deep = deep_enabled()
+    print("Ejecutando tester_final.py" + (" con validación profunda" if deep else "") + "...\n")
+    pdf_files, folders, _ = scan_folder(pdf_folder)
+    results = verify_artifacts(pdf_folder, pdf_files, folders, deep)
+    result1 = test_folder_per_pdf(pdf_folder, pdf_files, folders)
+    result2 = test_document_artifacts(pdf_folder, pdf_files, folders, results, metadata_index.ARTIFACT_KEYWORD_CLOUD, 2,
+                                      "Se han generado los keyword cloud para todos los pdfs correctamente.")
+    result3 = test_document_artifacts(pdf_folder, pdf_files, folders, results, metadata_index.ARTIFACT_TEI, 3,
+                                      "Se han generado los pdf_full_documents para todos los pdfs correctamente.")
+    result4 = test_document_artifacts(pdf_folder, pdf_files, folders, results, metadata_index.ARTIFACT_LINKS, 4,
+                                      "Se han generado los links para todos los pdfs correctamente.")
+    result5 = test_figures_in_articles(pdf_folder, results)
+    result6 = test_metadata_index(pdf_folder, pdf_files)
     
-    all_passed = result1 and result2 and result3 and result4 and result5
+    all_passed = result1 and result2 and result3 and result4 and result5 and result6
 
     print(f"\n{'-' * 20}\n")
     
@@ -127,6 +203,7 @@ def main():
         print("\nTodos los test han pasado exitosamente. \n Se recomienda finalizar ya la ejecución del docker.")
     else:
         print("\nUno o más test han fallado. Se recomienda ejecutar nuevamente el proceso de generación.")
+    return all_passed
 
 if __name__ == "__main__":
     print("\n \ n")
@@ -1,33 +1,41 @@
-import os
-import requests
 import time
 import sys
+import grobid_client
+import grobid_backends
+import grobid_readiness
 
-def run_tester():
-    base_url = os.environ.get("GROBID_URL", "http://grobid:8070")
+def get_grobid_version(base_url):
+    """
+    Devuelve la versión de Grobid reportada por /api/version.
+    Retorna None si el endpoint responde con un código distinto de 200.
+    """
+    response = grobid_client.get(base_url, "/api/version", timeout=grobid_client.PROBE_TIMEOUT, retries=0)
+    if response.status_code == 200:
+        return response.text.strip()
+    print("Error en /api/version. Código:", response.status_code)
+    return None
+
+def run_tester(base_url=None):
+    base_url = base_url or grobid_backends.get_base_url()
     success = True
 
     # Test 1: Versión de la API
-    version_url = f"{base_url}/api/version"
     try:
-        response = requests.get(version_url)
-        if response.status_code == 200:
-            version = response.text.strip()
+        version = get_grobid_version(base_url)
+        if version is not None:
             print("Versión de la API:", version)
             if version != "0.8.1":
                 print("Test fallido: se esperaba '0.8.1'.")
                 success = False
         else:
-            print("Error en /api/version. Código:", response.status_code)
             success = False
     except Exception as e:
         print("Excepción en /api/version:", e)
         success = False
 
     # Test 2: Estado isalive
-    isalive_url = f"{base_url}/api/isalive"
     try:
-        response = requests.get(isalive_url)
+        response = grobid_client.get(base_url, "/api/isalive", timeout=grobid_client.PROBE_TIMEOUT, retries=0)
         if response.status_code == 200:
             is_alive = response.text.strip().lower()
             print("Resultado de /api/isalive:", is_alive)
@@ -43,23 +51,44 @@ def run_tester():
 
     return success
 
-if __name__ == "__main__":
-    i = 0
-    delay = 10
-    while not run_tester():
-        print(f"{'-' * 20}")
-        print(f"Intento {i+1}: Comprobando endpoints de la API...")
-        i = i + 1
-
-        print(f" \nError en las pruebas unitarias.\n") 
+def wait_for_grobid():
+    """
+    Espera a que Grobid esté listo (grobid_readiness): comprobaciones rápidas de /api/isalive con espera
+    exponencial acotada, las pruebas de run_tester y, opcionalmente, una petición de calentamiento.
+    Con varios backends (GROBID_URLS) basta con que uno esté listo: el resto se comprueba a continuación y los
+    que no respondan quedan expulsados del pool hasta que su /api/isalive vuelva a responder.
+    Retorna True cuando Grobid puede atender peticiones o False si se agota READINESS_TIMEOUT.
+    """
+    pool = grobid_backends.get_pool()
+    attempts = [0]
 
-        print(f"Esperando {delay} segundos antes del siguiente intento...\n")
+    def check(base_url):
+        attempts[0] += 1
         print(f"{'-' * 20}")
+        print(f"Intento {attempts[0]}: Comprobando endpoints de la API en {base_url}...")
+        if run_tester(base_url):
+            return True
+        print(" \nError en las pruebas unitarias.\n")
+        print(f"{'-' * 20}")
+        return False
 
-        time.sleep(delay)
+    start = time.monotonic()
+    if not grobid_readiness.wait_until_ready(grobid_backends.get_urls(), check, grobid_readiness.get_deadline()):
+        print(f"{'-' * 20}")
+        print(f"Grobid no estuvo disponible tras {time.monotonic() - start:.0f} segundos.")
+        print(f"{'-' * 20}")
+        return False
 
+    if len(pool.backends) > 1:
+        pool.check_health()
+        print(f"Backends de Grobid disponibles: {len(pool.healthy_urls())}/{len(pool.backends)}.")
     print(f"{'-' * 20}")
-    print("Pruebas unitarias completadas exitosamente.")
+    print(f"Pruebas unitarias completadas exitosamente ({time.monotonic() - start:.1f} s).")
     print(f"{'-' * 20}")
-    print(f"\n Ejecutando los siguientes archivos, espere...\n")
+    return True
+
+if __name__ == "__main__":
+    if not wait_for_grobid():
+        sys.exit(1)
+    print("\n Ejecutando los siguientes archivos, espere...\n")
     sys.exit(0)
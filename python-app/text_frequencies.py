@@ -0,0 +1,89 @@
+import os
+import re
+import math
+from collections import Counter
+
+# Palabras vacías por idioma (artículos, preposiciones, pronombres, auxiliares y conectores frecuentes)
+STOPWORDS = {
+    "en": frozenset("""
+        a about above after again against all also am an and any are as at be because been before being below
+        between both but by can could did do does doing down during each either et few for from further had has
+        have having he her here hers herself him himself his how however i if in into is it its itself just me
+        more most my myself no nor not now of off on once only or other our ours ourselves out over own per
+        same she should so some such than that the their theirs them themselves then there these they this
+        those through thus to too under until up upon us use used using very via was we were what when where
+        whether which while who whom why will with within without would you your yours yourself yourselves
+        among another based e eg etc ie may might must one paper present presents
+        proposed show shows study two well
+    """.split()),
+    "es": frozenset("""
+        a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde donde durante e el
+        ella ellas ellos en entre era erais eran eras eres es esa esas ese eso esos esta estaba estado estamos
+        estan estar estas este esto estos estoy fue fueron fui ha habia han has hasta hay la las le les lo los
+        mas me mi mis mucho muy nada ni no nos nosotros o os otra otras otro otros para pero poco por porque que
+        quien quienes se sea sean ser si sido sin sobre son su sus tambien tanto te tiene tienen todo todos tu
+        tus un una unas uno unos usted ya yo él más está están también qué cómo según través sí sólo solo
+        además así cada dos presenta presentamos propone propuesta puede pueden sino trabajo
+    """.split()),
+}
+
+TOKEN_RE = re.compile(r"[^\W\d_]{2,}(?:[-'][^\W\d_]+)*", re.UNICODE)
+DEFAULT_LANGUAGES = ("es", "en")
+
+def get_tokenizer_config():
+    """
+    Configuración del análisis de texto leída del entorno:
+      - KEYWORD_LANGUAGES: idiomas de las palabras vacías, separados por comas (por defecto 'es,en').
+      - KEYWORD_BIGRAMS=1: cuenta también bigramas de palabras consecutivas sin palabra vacía entre ellas.
+    """
+    languages = tuple(lang.strip() for lang in os.environ.get("KEYWORD_LANGUAGES", ",".join(DEFAULT_LANGUAGES))
+                      .split(",") if lang.strip() in STOPWORDS) or DEFAULT_LANGUAGES
+    bigrams = os.environ.get("KEYWORD_BIGRAMS", "0").lower() in ("1", "true", "yes")
+    return {"languages": languages, "bigrams": bigrams}
+
+def config_signature(config):
+    return f"languages={','.join(sorted(config['languages']))};bigrams={int(config['bigrams'])}"
+
+def get_stopwords(languages):
+    stopwords = set()
+    for lang in languages:
+        stopwords |= STOPWORDS[lang]
+    return stopwords
+
+def normalize_plurals(counts):
+    """Une las formas plurales terminadas en 's' con su singular cuando este también aparece en el texto."""
+    for term in [t for t in counts if t.endswith("s") and not t.endswith("ss") and " " not in t]:
+        singular = term[:-1]
+        if singular in counts:
+            counts[singular] += counts.pop(term)
+    return counts
+
+def term_frequencies(text, config=None):
+    """
+    Tokeniza el texto una sola vez (expresión regular compilada, en minúsculas), descarta las palabras vacías
+    de los idiomas configurados y devuelve un Counter {término: frecuencia}, con bigramas opcionales.
+    """
+    config = config or get_tokenizer_config()
+    stopwords = get_stopwords(config["languages"])
+    counts = Counter()
+    previous = None
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group(0)
+        if token in stopwords:
+            previous = None
+            continue
+        counts[token] += 1
+        if config["bigrams"] and previous is not None:
+            counts[f"{previous} {token}"] += 1
+        previous = token
+    return normalize_plurals(counts)
+
+def tfidf_scores(term_stats, total_documents):
+    """
+    Calcula la puntuación TF-IDF de cada término del corpus a partir de (término, suma de frecuencias
+    relativas por documento, número de documentos que lo contienen), con idf suavizado.
+    """
+    scores = {}
+    for term, tf, df in term_stats:
+        scores[term] = tf * (math.log((1 + total_documents) / (1 + df)) + 1)
+    return scores
@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import queue
+import signal
+import threading
+import tester_inicial
+import instrumentation
+import run_journal
+import tei_cache
+import metadata_index
+import grobid_backends
+from grobid_pool import get_concurrency
+from keyword_cloud_generator import ensure_term_counts_config
+from pipeline import Pipeline
+
+# Segundos entre dos exploraciones de la carpeta (configurable con WATCH_INTERVAL)
+DEFAULT_INTERVAL = 2.0
+
+def get_interval():
+    try:
+        return max(0.2, float(os.environ.get("WATCH_INTERVAL", DEFAULT_INTERVAL)))
+    except ValueError:
+        return DEFAULT_INTERVAL
+
+def scan_pdfs(pdf_folder):
+    """Una sola llamada a os.scandir: devuelve {nombre del PDF: (tamaño, mtime)}."""
+    signatures = {}
+    with os.scandir(pdf_folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(".pdf") and entry.is_file():
+                stat = entry.stat()
+                signatures[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return signatures
+
+class WatchDaemon:
+    """
+    Modo demonio: vigila PDF_FOLDER y encola solo los PDFs nuevos o modificados.
+    Un PDF se encola cuando su tamaño y mtime no cambian entre dos exploraciones seguidas (copia terminada).
+    Cada PDF recorre las etapas de documento del pipeline (fetch, links, cloud) en un hilo de trabajo, que
+    mantiene la sesión HTTP con Grobid y los módulos de parseo y renderizado ya cargados; la etapa de
+    gráfico resumen se ejecuta cuando la cola queda vacía. El estado de cada etapa se anota en el diario
+    (run_journal), de modo que `cli.py run --resume` retoma lo que el demonio no llegó a terminar.
+    Al arrancar, los PDFs que el diario (o el índice) ya da por procesados no se vuelven a encolar.
+    """
+    def __init__(self, pdf_folder, base_url, interval=None, workers=None):
+        self.pdf_folder = pdf_folder
+        self.base_url = base_url
+        self.interval = interval or get_interval()
+        self.workers = workers or get_concurrency()
+        self.pipeline = Pipeline(pdf_folder, base_url, journal=run_journal.open_journal(pdf_folder))
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.chart_dirty = False
+        self._lock = threading.Lock()
+
+    def worker(self):
+        while not self.stop_event.is_set():
+            try:
+                pdf_file = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if os.path.exists(os.path.join(self.pdf_folder, pdf_file)):
+                    print(f"\nProcesando PDF nuevo o modificado: {pdf_file}")
+                    self.pipeline.run_document(pdf_file)
+                    with self._lock:
+                        self.chart_dirty = True
+            except Exception as e:
+                print(f"Excepción al procesar {pdf_file}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def refresh_chart(self):
+        with self._lock:
+            if not self.chart_dirty or self.queue.unfinished_tasks:
+                return
+            self.chart_dirty = False
+        self.pipeline.chart()
+        instrumentation.write_prometheus()
+
+    def initial_state(self):
+        """
+        Firmas de los PDFs que ya están procesados al arrancar, para que la primera exploración no los vuelva
+        a encolar. Se decide como la reanudación del pipeline: con el diario, los PDFs cuyas etapas están en
+        done con la firma actual (y los que agotaron PIPELINE_RETRY_BUDGET intentos); sin diario
+        (PIPELINE_JOURNAL=off), los documentos del índice cuyo PDF no ha cambiado.
+        """
+        current = scan_pdfs(self.pdf_folder)
+        journal = self.pipeline.journal
+        if journal is not None:
+            pending, finished, exhausted = journal.plan(sorted(current), self.pipeline.document_stages())
+            done = finished + exhausted
+            if exhausted:
+                print(f"{len(exhausted)} PDFs sin reintentos (límite de {run_journal.get_retry_budget()} intentos); "
+                      "se volverán a procesar si cambian.")
+        else:
+            done = metadata_index.current_documents(self.pdf_folder, current)
+        print(f"{len(done)} PDFs ya procesados; se encolan los {len(current) - len(done)} restantes.")
+        return {name: current[name] for name in done}
+
+    def run(self):
+        if ensure_term_counts_config(self.pdf_folder):
+            print("La configuración de las frecuencias de términos ha cambiado; se recalcularán a demanda.")
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        print(f"Vigilando {self.pdf_folder} cada {self.interval} s con {self.workers} hilos de trabajo...")
+
+        try:
+            seen = self.initial_state()
+        except OSError as e:
+            print(f"Error al explorar {self.pdf_folder}: {e}")
+            seen = {}
+        pending = {}
+        while not self.stop_event.is_set():
+            # Si Grobid no respondía a /api/version, se vuelve a consultar en cada exploración
+            tei_cache.forget_failed_versions()
+            try:
+                current = scan_pdfs(self.pdf_folder)
+            except OSError as e:
+                print(f"Error al explorar {self.pdf_folder}: {e}")
+                current = {}
+            for name, signature in current.items():
+                if seen.get(name) == signature:
+                    continue
+                if pending.get(name) == signature:
+                    del pending[name]
+                    seen[name] = signature
+                    self.queue.put(name)
+                else:
+                    pending[name] = signature
+            removed = [n for n in seen if n not in current]
+            for name in removed:
+                del seen[name]
+                with self._lock:
+                    self.chart_dirty = True
+            if removed:
+                self.pipeline.prune(list(current))
+            for name in [n for n in pending if n not in current]:
+                del pending[name]
+            self.refresh_chart()
+            self.stop_event.wait(self.interval)
+
+        for thread in threads:
+            thread.join()
+        if self.pipeline.journal is not None:
+            self.pipeline.journal.close()
+        instrumentation.finish()
+        print("Demonio detenido.")
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+def main():
+    base_url = grobid_backends.get_base_url()
+    pdf_folder = os.environ.get("PDF_FOLDER", "/app/pdfs")
+    while not tester_inicial.wait_for_grobid():
+        time.sleep(get_interval())
+    instrumentation.configure(pdf_folder)
+    daemon = WatchDaemon(pdf_folder, base_url)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
+
+if __name__ == "__main__":
+    print("Ejecutando watch_daemon.py")
+    main()
+    sys.exit(0)